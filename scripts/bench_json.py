@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Compara a serialização JSON da stdlib com o backend de `src.core.json_backend`
+(orjson quando instalado) nos caminhos quentes: linhas de log, arquivo do
+webhook (indent=2) e corpo da requisição de visitas.
+
+Uso:
+  python scripts/bench_json.py --visits 500 --rounds 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_mapper import make_record  # noqa: E402
+from src.core import json_backend  # noqa: E402
+from src.core.encoding import prune_normalize  # noqa: E402
+from src.integrations.simpliroute.client import VISIT_PRUNE_RULE  # noqa: E402
+from src.integrations.simpliroute.mapper import build_visit_payload  # noqa: E402
+
+
+def timed(fn, rounds: int) -> float:
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--visits", type=int, default=500, help="Visitas no corpo da requisição")
+    p.add_argument("--log-lines", type=int, default=10000, help="Linhas de log serializadas")
+    p.add_argument("--rounds", type=int, default=20, help="Rodadas (mostra a melhor)")
+    args = p.parse_args()
+
+    os.environ.setdefault("ORACLE_VIEW", "VW_ENTREGAS")
+    payloads = [build_visit_payload(make_record(i, 80, 5)) for i in range(args.visits)]
+    pruned = prune_normalize(payloads, VISIT_PRUNE_RULE)
+    log_records = [
+        {
+            "timestamp": datetime.now().isoformat(),
+            "level": "INFO",
+            "message": f"SR status inserido: idreference={i} status=5 observação",
+            "name": "simpliroute",
+        }
+        for i in range(args.log_lines)
+    ]
+    webhook = {"visits": pruned[:50]}
+
+    cases = [
+        (
+            "log lines",
+            lambda: [json.dumps(r, ensure_ascii=False) for r in log_records],
+            lambda: [json_backend.dumps(r) for r in log_records],
+        ),
+        (
+            "webhook file (indent=2)",
+            lambda: json.dumps(webhook, ensure_ascii=False, indent=2).encode("utf-8"),
+            lambda: json_backend.dumps_bytes(webhook, indent=True),
+        ),
+        (
+            f"request body ({args.visits} visits)",
+            lambda: json.dumps(pruned, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            lambda: json_backend.dumps_compact_bytes(pruned),
+        ),
+    ]
+
+    print(f"backend: {json_backend.BACKEND}")
+    for name, stdlib_fn, backend_fn in cases:
+        std = timed(stdlib_fn, args.rounds)
+        fast = timed(backend_fn, args.rounds)
+        print(f"{name:<28} stdlib {std * 1000:8.2f} ms   backend {fast * 1000:8.2f} ms   x{std / fast:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
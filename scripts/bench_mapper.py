@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Mede o tempo de `build_visit_payload` sobre registros sintéticos no formato
+das views Oracle (colunas em CAIXA ALTA, ~80 colunas, itens agrupados).
+
+Uso:
+  python scripts/bench_mapper.py --records 2000 --columns 80 --items 5
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.integrations.simpliroute.mapper import build_visit_payload  # noqa: E402
+
+BASE_COLUMNS = {
+    "ID_ATENDIMENTO": 123456,
+    "ID_PROTOCOLO": 998877,
+    "ID_PRESCRICAO": 554433,
+    "TPREGISTRO": 2,
+    "NOME_PACIENTE": "JOSÉ DA SILVA",
+    "ENDERECO_GEOLOCALIZACAO": "Rua das Flores, 100 - Centro, São Paulo - SP",
+    "LATITUDE": "-23.5505",
+    "LONGITUDE": "-46.6333",
+    "DT_ENTREGA": date(2026, 1, 15),
+    "PESSOACONTATO": "Maria",
+    "TELEFONES": "11999990000",
+    "EMAIL": "maria@example.com",
+    "ESPECIALIDADE": "ENTREGA",
+    "TIPOVISITA": "ROTA",
+    "PERIODICIDADE": "SEMANAL",
+    "OBSERVACAO": "Portaria 24h",
+}
+
+
+def make_record(idx: int, columns: int, items: int):
+    record = dict(BASE_COLUMNS)
+    record["ID_ATENDIMENTO"] = 100000 + idx
+    record["ID_PROTOCOLO"] = 900000 + idx
+    for col in range(len(record), columns):
+        record[f"COLUNA_EXTRA_{col:03d}"] = None if col % 3 == 0 else f"valor {col}"
+    record["_source_view"] = "VW_ENTREGAS"
+    record["items"] = [
+        {
+            **record,
+            "ID_PRODUTO": 7000 + item,
+            "PRODUTO": f"MATERIAL HOSPITALAR {item}",
+            "QUANTIDADE": item + 1,
+            "DT_ATUALIZACAO": datetime(2026, 1, 14, 8, 30),
+        }
+        for item in range(items)
+    ]
+    return record
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--records", type=int, default=2000, help="Quantidade de registros")
+    p.add_argument("--columns", type=int, default=80, help="Colunas por registro")
+    p.add_argument("--items", type=int, default=5, help="Itens (linhas) por registro")
+    p.add_argument("--repeat", type=int, default=3, help="Rodadas (mostra a melhor)")
+    args = p.parse_args()
+
+    os.environ.setdefault("ORACLE_VIEW", "VW_ENTREGAS")
+    records = [make_record(i, args.columns, args.items) for i in range(args.records)]
+
+    best = None
+    for _ in range(max(1, args.repeat)):
+        start = time.perf_counter()
+        for record in records:
+            build_visit_payload(record)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(
+        f"{args.records} registros x {args.columns} colunas x {args.items} itens: "
+        f"{best:.3f}s ({best / args.records * 1000:.3f} ms/registro)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Mede a poda dos payloads de visita antes do envio (`VISIT_PRUNE_RULE`) em um
+lote realista, comparando com a poda antiga (closure recriada a cada chamada,
+com busca em listas) e com o caminho sem cópia para payloads já conformes.
+
+Uso:
+  python scripts/bench_prune.py --visits 500 --rounds 20
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_mapper import make_record  # noqa: E402
+from src.core.encoding import normalize_obj, prune_normalize  # noqa: E402
+from src.integrations.simpliroute.client import (  # noqa: E402
+    ALLOWED_ITEM_FIELDS,
+    ALLOWED_PROPERTY_FIELDS,
+    ALLOWED_VISIT_FIELDS,
+    VISIT_PRUNE_RULE,
+)
+from src.integrations.simpliroute.mapper import build_visit_payload  # noqa: E402
+
+
+def legacy_prune(body):
+    """Poda como era feita em `post_simpliroute` (referência do benchmark)."""
+    allowed_visit_fields = list(ALLOWED_VISIT_FIELDS)
+    allowed_item_fields = list(ALLOWED_ITEM_FIELDS)
+
+    def prune_visit(v: dict) -> dict:
+        out = {}
+        for k in allowed_visit_fields:
+            if k in v and v[k] is not None:
+                out[k] = v[k]
+        if "properties" in out and isinstance(out["properties"], dict):
+            props = out["properties"]
+            kept = {k: props[k] for k in props if k in list(ALLOWED_PROPERTY_FIELDS)}
+            if kept:
+                out["properties"] = kept
+            else:
+                out.pop("properties", None)
+        if "items" in out and isinstance(out["items"], list):
+            items = []
+            for it in out["items"]:
+                if not isinstance(it, dict):
+                    continue
+                newi = {k: it[k] for k in allowed_item_fields if k in it and it[k] is not None}
+                if newi:
+                    items.append(newi)
+            if items:
+                out["items"] = items
+            else:
+                out.pop("items", None)
+        return out
+
+    return normalize_obj([prune_visit(v) for v in body])
+
+
+def timed(fn, rounds: int) -> float:
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--visits", type=int, default=500, help="Visitas no lote")
+    p.add_argument("--rounds", type=int, default=20, help="Rodadas (mostra a melhor)")
+    args = p.parse_args()
+
+    os.environ.setdefault("ORACLE_VIEW", "VW_ENTREGAS")
+    payloads = [build_visit_payload(make_record(i, 80, 5)) for i in range(args.visits)]
+    conforming = prune_normalize(payloads, VISIT_PRUNE_RULE)
+    assert legacy_prune(payloads) == conforming
+
+    reused = sum(a is b for a, b in zip(prune_normalize(conforming, VISIT_PRUNE_RULE), conforming))
+    cases = [
+        ("poda anterior + NFC", lambda: legacy_prune(payloads)),
+        ("VISIT_PRUNE_RULE (payload do mapper)", lambda: prune_normalize(payloads, VISIT_PRUNE_RULE)),
+        ("VISIT_PRUNE_RULE (já conforme)", lambda: prune_normalize(conforming, VISIT_PRUNE_RULE)),
+    ]
+    for name, fn in cases:
+        print(f"{name:<40} {timed(fn, args.rounds) * 1000:8.2f} ms")
+    print(f"visitas conformes reaproveitadas sem cópia: {reused}/{len(conforming)}")
+
+
+if __name__ == "__main__":
+    main()
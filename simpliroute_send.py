@@ -2,6 +2,7 @@ import json
 import logging
 import os
 import platform
+import queue
 import sys
 import time
 import traceback
@@ -10,7 +11,7 @@ from collections import deque
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 import oracledb
 import uvicorn
@@ -20,6 +21,10 @@ from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 
 from send_helper import build_visit_payload
+from src.adapters.send_ledger import SendLedger, open_send_ledger
+from src.core.json_backend import dumps as json_dumps
+from src.core.rate_limit import get_rate_limiter
+from src.integrations.simpliroute.client import extract_visit_ids
 
 # =========================
 # Config / Diretórios
@@ -27,7 +32,22 @@ from send_helper import build_visit_payload
 
 SEND_INTERVAL_SECONDS = 60
 SEND_LIMIT = int(os.getenv("ORACLE_FETCH_LIMIT", "100"))
+# Lotes enviados em uma única chamada a /v1/routes/visits/ (limite por quantidade e por bytes)
+SEND_BATCH_SIZE = int(os.getenv("SIMPLIROUTE_BATCH_SIZE", "50"))
+SEND_BATCH_MAX_BYTES = int(os.getenv("SIMPLIROUTE_BATCH_MAX_BYTES", str(512 * 1024)))
+# "keyset" (padrão) pagina pela chave DT_ENTREGA + ID_PRESCRICAO + ID_PROTOCOLO; "offset" mantém o ROWNUM antigo
+SEND_PAGINATION_MODE = os.getenv("SIMPLIROUTE_SEND_PAGINATION", "keyset").strip().lower()
+KEYSET_COLUMNS = ("DT_ENTREGA", "ID_PRESCRICAO", "ID_PROTOCOLO")
+# Pipeline busca → montagem → envio → update (threads por estágio e filas limitadas entre eles)
+PIPELINE_MAP_WORKERS = max(1, int(os.getenv("SIMPLIROUTE_PIPELINE_MAP_WORKERS", "1")))
+PIPELINE_SEND_WORKERS = max(1, int(os.getenv("SIMPLIROUTE_PIPELINE_SEND_WORKERS", "2")))
+PIPELINE_UPDATE_WORKERS = max(1, int(os.getenv("SIMPLIROUTE_PIPELINE_UPDATE_WORKERS", "1")))
+PIPELINE_QUEUE_SIZE = max(1, int(os.getenv("SIMPLIROUTE_PIPELINE_QUEUE_SIZE", "4")))
+# no shutdown, tempo para concluir envios em andamento e gravar os lotes já aceitos
+PIPELINE_SHUTDOWN_SECONDS = float(os.getenv("SIMPLIROUTE_PIPELINE_SHUTDOWN_SECONDS", "60"))
 LOG_TO_FILE = False
+# Ledger local das visitas aceitas (SIMPLIROUTE_SEND_LEDGER=0 desativa); aberto pelo main_loop
+SEND_LEDGER: Optional[SendLedger] = None
 
 HEALTH_CHECK_ROUTE = "/health_send"
 
@@ -90,7 +110,7 @@ class JsonFormatter(logging.Formatter):
         }
         if record.exc_info:
             log_record["exception"] = self.formatException(record.exc_info)
-        return json.dumps(log_record, ensure_ascii=False)
+        return json_dumps(log_record)
 
 
 def get_logger() -> logging.Logger:
@@ -256,10 +276,17 @@ def get_engine() -> Engine:
 # DB / HTTP
 # =========================
 
-def fetch_records(limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+def fetch_records(limit: int, offset: int = 0, null_keys_only: bool = False) -> List[Dict[str, Any]]:
     try:
         schema = os.getenv("ORACLE_SCHEMA")
         view = get_oracle_view()
+        # varredura das linhas que a paginação por chave não alcança (ver fetch_page)
+        null_keys = (
+            """
+                    AND (ID_PRESCRICAO IS NULL OR ID_PROTOCOLO IS NULL)"""
+            if null_keys_only
+            else ""
+        )
 
         sql = f"""
             SELECT * FROM (
@@ -269,7 +296,7 @@ def fetch_records(limit: int, offset: int = 0) -> List[Dict[str, Any]]:
                         DT_ENTREGA = TO_CHAR(SYSDATE, 'YYYY-MM-DD')
                         OR DT_ENTREGA = TO_CHAR(SYSDATE + 1, 'YYYY-MM-DD')
                     )
-                    AND DT_ENVIOROTEIRIZADOR IS NULL
+                    AND DT_ENVIOROTEIRIZADOR IS NULL{null_keys}
                     ORDER BY DT_ENTREGA DESC
                 ) a WHERE ROWNUM <= :max_row
             ) WHERE rnum > :offset
@@ -288,92 +315,238 @@ def fetch_records(limit: int, offset: int = 0) -> List[Dict[str, Any]]:
             extra_info={
                 "limit": limit,
                 "offset": offset,
+                "null_keys_only": null_keys_only,
                 "env": {"ORACLE_SCHEMA": os.getenv("ORACLE_SCHEMA")},
             },
         )
         raise
 
 
-def update_envioroteirizador(id_prescription, id_protocolo, id_simpliroute) -> None:
-    global envios_total, envios_hoje
-
-    # Calcula data/hora atual em UTC-3
-    now_utc3 = datetime.now(timezone.utc) - timedelta(hours=3)
-    now_str = now_utc3.strftime("%Y-%m-%d %H:%M:%S")
+def _record_key(record: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+    values = []
+    for column in KEYSET_COLUMNS:
+        value = record.get(column)
+        if value is None:
+            value = record.get(column.lower())
+        if value is None:
+            return None
+        values.append(value)
+    return tuple(values)
+
+
+def fetch_records_keyset(
+    limit: int, after: Optional[Tuple[Any, ...]] = None, equal_to: Optional[Tuple[Any, ...]] = None
+) -> List[Dict[str, Any]]:
+    """Busca a próxima página após a chave `after` (DT_ENTREGA, ID_PRESCRICAO, ID_PROTOCOLO).
+
+    Usa `FETCH FIRST n ROWS ONLY` com predicado de seek, de modo que cada página é
+    uma varredura de faixa na chave em vez de reordenar a view inteira. Linhas sem
+    ID_PRESCRICAO/ID_PROTOCOLO não têm posição na chave e ficam para a varredura
+    `fetch_records(..., null_keys_only=True)` no fim de cada passada.
+    Com `equal_to`, retorna todas as linhas com exatamente essa chave (sem limite).
+    """
     try:
         schema = os.getenv("ORACLE_SCHEMA")
-        
+        view = get_oracle_view()
+
+        seek = ""
+        fetch_first = "FETCH FIRST :limit ROWS ONLY"
+        params: Dict[str, Any] = {"limit": limit}
+        if equal_to is not None:
+            seek = """
+                    AND DT_ENTREGA = :k_dt AND ID_PRESCRICAO = :k_presc AND ID_PROTOCOLO = :k_prot"""
+            fetch_first = ""
+            params = {"k_dt": equal_to[0], "k_presc": equal_to[1], "k_prot": equal_to[2]}
+        elif after is not None:
+            seek = """
+                    AND (
+                        DT_ENTREGA < :k_dt
+                        OR (DT_ENTREGA = :k_dt AND ID_PRESCRICAO < :k_presc)
+                        OR (DT_ENTREGA = :k_dt AND ID_PRESCRICAO = :k_presc AND ID_PROTOCOLO < :k_prot)
+                    )"""
+            params.update({"k_dt": after[0], "k_presc": after[1], "k_prot": after[2]})
+
         sql = f"""
-            UPDATE {schema}.TD_OTIMIZE_ALTSTAT
-            SET DT_ENVIOROTEIRIZADOR = TO_DATE(:dt_envio, 'YYYY-MM-DD HH24:MI:SS'),
-                IDSIMPLIROUTE = :id_simpliroute
-            WHERE IDREGISTRO = :id_prescription
-              AND IDREFERENCE = :id_protocolo
-              AND IDSIMPLIROUTE IS NOT NULL
+            SELECT * FROM {schema}.{view}
+            WHERE (
+                DT_ENTREGA = TO_CHAR(SYSDATE, 'YYYY-MM-DD')
+                OR DT_ENTREGA = TO_CHAR(SYSDATE + 1, 'YYYY-MM-DD')
+            )
+            AND DT_ENVIOROTEIRIZADOR IS NULL
+            AND ID_PRESCRICAO IS NOT NULL
+            AND ID_PROTOCOLO IS NOT NULL{seek}
+            ORDER BY DT_ENTREGA DESC, ID_PRESCRICAO DESC, ID_PROTOCOLO DESC
+            {fetch_first}
         """
-        
-        params = {
-            "dt_envio": now_str,
-            "id_prescription": id_prescription,
-            "id_protocolo": id_protocolo,
-            "id_simpliroute": id_simpliroute,
-        }
 
         engine = get_engine()
         with engine.begin() as conn:
             result = conn.execute(text(sql), params)
+            columns = result.keys()
+            rows = [dict(zip(columns, row)) for row in result.fetchall()]
+        return rows
+    except Exception as exc:
+        save_error_stacktrace(
+            exc,
+            extra_info={
+                "limit": limit,
+                "after": after,
+                "equal_to": equal_to,
+                "env": {"ORACLE_SCHEMA": os.getenv("ORACLE_SCHEMA")},
+            },
+        )
+        raise
 
-        if result.rowcount == 0:
-            error_msg = (
-                f"Nenhum registro atualizado em TD_OTIMIZE_ALTSTAT para IDREGISTRO={id_prescription}, "
-                f"IDREFERENCE={id_protocolo}, IDSIMPLIROUTE={id_simpliroute}"
-            )
-            logger.error(error_msg)
-            
-            # Incrementa contador de falhas de atualização
-            dt_utc3 = datetime.now(timezone.utc) - timedelta(hours=3)
-            with stats_lock:
-                _rollover_day_if_needed(dt_utc3)
-                falhas_atualizacao_total += 1
-                falhas_atualizacao_hoje += 1
-            
-            # Gera arquivo de log de erro
-            save_error_stacktrace(
-                Exception(error_msg),
-                extra_info={
-                    "id_prescription": id_prescription,
-                    "id_protocolo": id_protocolo,
-                    "id_simpliroute": id_simpliroute,
-                    "tipo": "update_nao_afetou_registros",
-                    "env": {"ORACLE_SCHEMA": schema},
-                },
-            )
-            return
 
+class NullKeyCursor(NamedTuple):
+    """Cursor da varredura por offset das linhas sem ID_PRESCRICAO/ID_PROTOCOLO."""
+
+    offset: int
+
+
+def _fetch_keyset_page(limit: int, cursor: Any) -> Tuple[List[Dict[str, Any]], Any, bool]:
+    while True:
+        records = fetch_records_keyset(limit, cursor)
+        if len(records) < limit:
+            return records, _record_key(records[-1]) if records else cursor, False
+        # A chave não é necessariamente única: linhas empatadas com a última chave
+        # voltam na próxima página em vez de serem puladas pelo seek estrito.
+        last_key = _record_key(records[-1])
+        cut = len(records)
+        while cut > 0 and _record_key(records[cut - 1]) == last_key:
+            cut -= 1
+        if cut > 0:
+            return records[:cut], _record_key(records[cut - 1]), True
+        # página inteira com a mesma chave: busca o grupo completo antes de avançar,
+        # senão as linhas empatadas além do limite seriam puladas pelo seek
+        records = fetch_records_keyset(limit, equal_to=last_key)
+        if records:
+            return records, last_key, True
+        # o grupo foi marcado entre as duas leituras: segue a partir dele
+        cursor = last_key
+
+
+def fetch_page(limit: int, cursor: Any = None) -> Tuple[List[Dict[str, Any]], Any, bool]:
+    """Retorna (registros, próximo cursor, há_mais) conforme SEND_PAGINATION_MODE.
+
+    No modo keyset, depois da última página com chave a mesma passada segue pelas
+    linhas sem ID_PRESCRICAO/ID_PROTOCOLO (por offset, via `NullKeyCursor`): elas
+    continuam sendo enviadas como antes, e o ledger evita o reenvio nas passadas
+    seguintes, já que não podem receber DT_ENVIOROTEIRIZADOR.
+    """
+    if SEND_PAGINATION_MODE == "offset":
+        offset = int(cursor or 0)
+        records = fetch_records(limit, offset)
+        return records, offset + len(records), len(records) >= limit
+
+    if isinstance(cursor, NullKeyCursor):
+        records: List[Dict[str, Any]] = []
+        offset = cursor.offset
+    else:
+        records, next_cursor, has_more = _fetch_keyset_page(limit, cursor)
+        if has_more:
+            return records, next_cursor, True
+        offset = 0
+
+    remaining = limit - len(records)
+    null_records = fetch_records(remaining, offset, null_keys_only=True)
+    if null_records:
         logger.info(
-            f"Atualizado DT_ENVIOROTEIRIZADOR e IDSIMPLIROUTE para IDREGISTRO={id_prescription}, IDREFERENCE={id_protocolo}, IDSIMPLIROUTE={id_simpliroute}"
+            f"{len(null_records)} linha(s) sem ID_PRESCRICAO/ID_PROTOCOLO na varredura (offset={offset})"
         )
+    return records + null_records, NullKeyCursor(offset + len(null_records)), len(null_records) >= remaining
 
-        dt_utc3 = datetime.now(timezone.utc) - timedelta(hours=3)
-        with stats_lock:
-            _rollover_day_if_needed(dt_utc3)
-            envios_total += 1
-            envios_hoje += 1
 
+def update_envioroteirizador_bulk(rows: Sequence[Tuple[Any, Any, Any]]) -> Dict[str, Any]:
+    """Aplica (IDREGISTRO, IDREFERENCE, IDSIMPLIROUTE) de um ou mais lotes com um único
+    `executemany` e um commit.
+
+    As contagens por linha (`arraydmlrowcounts`) identificam as linhas sem
+    correspondência, reportadas juntas em um único log/arquivo de erro.
+    Retorna {"updated": n, "unmatched": [(idregistro, idreference, idsimpliroute), ...]}.
+    """
+    global envios_total, envios_hoje, falhas_atualizacao_total, falhas_atualizacao_hoje
+
+    if not rows:
+        return {"updated": 0, "unmatched": []}
+
+    now_utc3 = datetime.now(timezone.utc) - timedelta(hours=3)
+    now_str = now_utc3.strftime("%Y-%m-%d %H:%M:%S")
+    schema = os.getenv("ORACLE_SCHEMA")
+    sql = f"""
+        UPDATE {schema}.TD_OTIMIZE_ALTSTAT
+        SET DT_ENVIOROTEIRIZADOR = TO_DATE(:dt_envio, 'YYYY-MM-DD HH24:MI:SS'),
+            IDSIMPLIROUTE = :id_simpliroute
+        WHERE IDREGISTRO = :id_prescription
+          AND IDREFERENCE = :id_protocolo
+          AND IDSIMPLIROUTE IS NOT NULL
+    """
+    params = [
+        {
+            "dt_envio": now_str,
+            "id_prescription": id_prescription,
+            "id_protocolo": id_protocolo,
+            "id_simpliroute": id_simpliroute,
+        }
+        for id_prescription, id_protocolo, id_simpliroute in rows
+    ]
+
+    try:
+        raw = get_engine().raw_connection()
+        try:
+            cursor = raw.cursor()
+            try:
+                cursor.executemany(sql, params, arraydmlrowcounts=True)
+                rowcounts = cursor.getarraydmlrowcounts()
+            finally:
+                cursor.close()
+            raw.commit()
+        except Exception:
+            raw.rollback()
+            raise
+        finally:
+            raw.close()
     except Exception as exc:
         save_error_stacktrace(
             exc,
             extra_info={
-                "id_prescription": id_prescription,
-                "id_protocolo": id_protocolo,
+                "rows": [list(row) for row in rows],
                 "dt_envio": now_str,
-                "env": {"ORACLE_SCHEMA": os.getenv("ORACLE_SCHEMA")},
+                "env": {"ORACLE_SCHEMA": schema},
             },
         )
         raise
 
+    unmatched = [tuple(row) for row, count in zip(rows, rowcounts) if not count]
+    updated = len(rows) - len(unmatched)
+    logger.info(f"TD_OTIMIZE_ALTSTAT: {updated}/{len(rows)} registro(s) atualizado(s) em um commit")
 
-def send_to_simpliroute(payload: Dict[str, Any]) -> Dict[str, Any]:
+    dt_utc3 = datetime.now(timezone.utc) - timedelta(hours=3)
+    with stats_lock:
+        _rollover_day_if_needed(dt_utc3)
+        envios_total += updated
+        envios_hoje += updated
+        falhas_atualizacao_total += len(unmatched)
+        falhas_atualizacao_hoje += len(unmatched)
+
+    if unmatched:
+        error_msg = f"{len(unmatched)} registro(s) sem correspondência em TD_OTIMIZE_ALTSTAT no update em lote"
+        logger.error(f"{error_msg}: {unmatched}")
+        save_error_stacktrace(
+            Exception(error_msg),
+            extra_info={
+                "tipo": "update_nao_afetou_registros",
+                "registros": [
+                    {"id_prescription": r[0], "id_protocolo": r[1], "id_simpliroute": r[2]} for r in unmatched
+                ],
+                "env": {"ORACLE_SCHEMA": schema},
+            },
+        )
+    return {"updated": updated, "unmatched": unmatched}
+
+
+def send_batch_to_simpliroute(payloads: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Envia um lote de visitas em uma única chamada a `/v1/routes/visits/`."""
     import httpx
 
     base_url = os.getenv("SIMPLIROUTE_API_BASE") or "https://api.simpliroute.com"
@@ -383,102 +556,485 @@ def send_to_simpliroute(payload: Dict[str, Any]) -> Dict[str, Any]:
         headers["Authorization"] = f"Token {token}"
 
     url = f"{base_url.rstrip('/')}/v1/routes/visits/"
-    logger.info(f"Tentando enviar para SimpliRoute com token {token[:4]}...{token[-4:]}")
+    logger.info(f"Tentando enviar {len(payloads)} visita(s) para SimpliRoute com token {token[:4]}...{token[-4:]}")
+    limiter = get_rate_limiter("simpliroute")
     try:
-        response = httpx.post(url, json=[payload], headers=headers, timeout=30)
+        limiter.acquire()
+        response = httpx.post(url, json=list(payloads), headers=headers, timeout=30)
+        limiter.observe(response.status_code, response.headers)
         logger.info(f"Enviado para SimpliRoute: HTTP {response.status_code}")
-        time.sleep(2)  # evitar rate limiting
         return {"status_code": response.status_code, "body": response.text}
     except Exception as exc:
-        save_error_stacktrace(exc, extra_info={"payload": payload, "url": url})
+        save_error_stacktrace(
+            exc,
+            extra_info={"references": [p.get("reference") for p in payloads], "url": url},
+        )
         logger.error(f"Erro ao enviar para SimpliRoute: {exc}")
         return {"status_code": None, "error": str(exc)}
 
 
+def _payload_size(payload: Dict[str, Any]) -> int:
+    return len(json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _update_keys(record: Dict[str, Any]) -> Tuple[Any, Any]:
+    """(IDREGISTRO, IDREFERENCE) do registro para o update de TD_OTIMIZE_ALTSTAT."""
+    id_prescription = record.get("id_prescricao") or record.get("ID_PRESCRICAO")
+    id_protocolo = record.get("id_protocolo") or record.get("ID_PROTOCOLO")
+    return id_prescription, id_protocolo
+
+
+def skip_already_sent(entries: Sequence[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Tuple[Any, Any, Any]]]:
+    """Separa as entradas cuja (reference, planned_date) já consta no ledger de envios.
+
+    Retorna (pendentes, updates). Um registro que ainda aparece na view já foi aceito
+    pelo SimpliRoute mas ficou sem DT_ENVIOROTEIRIZADOR (update falhou ou não casou):
+    o update é refeito com o ID de visita guardado no ledger.
+    """
+    if SEND_LEDGER is None or not entries:
+        return list(entries), []
+    try:
+        found = SEND_LEDGER.lookup([entry["payload"] for entry in entries])
+    except Exception as exc:
+        logger.error(f"Erro ao consultar o ledger de envios: {exc}")
+        return list(entries), []
+    pending: List[Dict[str, Any]] = []
+    repairs: List[Tuple[Any, Any, Any]] = []
+    for entry, (sent, visit_id) in zip(entries, found):
+        if not sent:
+            pending.append(entry)
+            continue
+        id_prescription, id_protocolo = _update_keys(entry["record"])
+        if visit_id and id_prescription and id_protocolo:
+            repairs.append((id_prescription, id_protocolo, visit_id))
+        else:
+            logger.warning(f"reference={entry['reference']} consta no ledger sem ID de visita; update não refeito")
+    skipped = len(entries) - len(pending)
+    if skipped:
+        logger.info(
+            f"{skipped} visita(s) já enviada(s) ignorada(s) pelo ledger de envios "
+            f"({len(repairs)} com update de DT_ENVIOROTEIRIZADOR refeito)"
+        )
+    return pending, repairs
+
+
+def build_send_batches(entries: Sequence[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Agrupa entradas {record, payload, reference} respeitando SEND_BATCH_SIZE e SEND_BATCH_MAX_BYTES.
+
+    Um payload maior que o limite de bytes segue sozinho em seu próprio lote.
+    """
+    max_count = max(1, SEND_BATCH_SIZE)
+    batches: List[List[Dict[str, Any]]] = []
+    current: List[Dict[str, Any]] = []
+    current_bytes = 2  # colchetes da lista JSON
+
+    for entry in entries:
+        size = _payload_size(entry["payload"]) + 1  # vírgula separadora
+        if current and (len(current) >= max_count or current_bytes + size > SEND_BATCH_MAX_BYTES):
+            batches.append(current)
+            current = []
+            current_bytes = 2
+        current.append(entry)
+        current_bytes += size
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def send_batch(batch: Sequence[Dict[str, Any]]) -> Tuple[Dict[str, Any], float]:
+    """Envia um lote; retorna o resultado HTTP e o tempo gasto."""
+    start_time = time.perf_counter()
+    result = send_batch_to_simpliroute([entry["payload"] for entry in batch])
+    return result, time.perf_counter() - start_time
+
+
+def apply_batch_result(
+    batch: Sequence[Dict[str, Any]], result: Dict[str, Any], elapsed: float
+) -> List[Tuple[Any, Any, Any]]:
+    """Registra o lote aceito e devolve as linhas (IDREGISTRO, IDREFERENCE, IDSIMPLIROUTE)
+    a atualizar em TD_OTIMIZE_ALTSTAT (ver `apply_updates`)."""
+    payloads = [entry["payload"] for entry in batch]
+    status_code = result.get("status_code")
+
+    if status_code is None or not 200 <= int(status_code) < 300:
+        logger.error(
+            f"Lote rejeitado pelo SimpliRoute: HTTP {status_code} "
+            f"references={[entry['reference'] for entry in batch]}"
+        )
+        return []
+
+    visit_ids = extract_visit_ids(result.get("body"), payloads)
+    if SEND_LEDGER is not None:
+        try:
+            SEND_LEDGER.record(payloads, visit_ids)
+        except Exception as exc:
+            logger.error(f"Erro ao registrar lote no ledger de envios: {exc}")
+
+    updates: List[Tuple[Any, Any, Any]] = []
+    without_id: List[Dict[str, Any]] = []
+    for entry, id_simpliroute in zip(batch, visit_ids):
+        record = entry["record"]
+        reference = entry["reference"]
+        # DT_ENVIOROTEIRIZADOR é atualizado em lote, depois do envio bem-sucedido
+        id_prescription, id_protocolo = _update_keys(record)
+
+        if not id_simpliroute:
+            without_id.append(
+                {"reference": reference, "id_prescription": id_prescription, "id_protocolo": id_protocolo}
+            )
+        elif id_prescription and id_protocolo:
+            updates.append((id_prescription, id_protocolo, id_simpliroute))
+        else:
+            logger.warning(
+                f"Chaves para update não encontradas: IDPRESCRIPTION={id_prescription}, ID_PROTOCOLO={id_protocolo}"
+            )
+
+        with eventos_lock:
+            eventos_enviados.appendleft(
+                {
+                    "timestamp": (datetime.now(timezone.utc) - timedelta(hours=3)).isoformat(),
+                    "payload_preview": json.dumps(entry["payload"], ensure_ascii=False)[:200],
+                    "exec_time_s": round(elapsed, 4),
+                    "reference": reference,
+                    "batch_size": len(batch),
+                }
+            )
+        logger.info(f"Envio concluído: reference={reference} id_simpliroute={id_simpliroute}")
+    if without_id:
+        report_accepted_without_id(without_id, result)
+    return updates
+
+
+def report_accepted_without_id(entries: Sequence[Dict[str, Any]], result: Dict[str, Any]) -> None:
+    """Visitas aceitas (2xx) sem ID associável na resposta: o registro não pode ser marcado.
+
+    Ficam no ledger (não são reenviadas) e vão para um arquivo de erro, como os
+    updates sem correspondência, para correção manual do IDSIMPLIROUTE.
+    """
+    global falhas_atualizacao_total, falhas_atualizacao_hoje
+
+    error_msg = f"{len(entries)} visita(s) aceita(s) pelo SimpliRoute sem ID de visita na resposta"
+    logger.error(f"{error_msg}: {[entry['reference'] for entry in entries]}")
+    dt_utc3 = datetime.now(timezone.utc) - timedelta(hours=3)
+    with stats_lock:
+        _rollover_day_if_needed(dt_utc3)
+        falhas_atualizacao_total += len(entries)
+        falhas_atualizacao_hoje += len(entries)
+    save_error_stacktrace(
+        Exception(error_msg),
+        extra_info={
+            "tipo": "visita_aceita_sem_id",
+            "registros": list(entries),
+            "status_code": result.get("status_code"),
+            "body_preview": str(result.get("body") or "")[:2000],
+        },
+    )
+
+
+def apply_updates(rows: Sequence[Tuple[Any, Any, Any]]) -> None:
+    """Atualiza DT_ENVIOROTEIRIZADOR das linhas aceitas em um único executemany/commit."""
+    if not rows:
+        return
+    try:
+        update_envioroteirizador_bulk(rows)
+    except Exception as exc:
+        logger.error(f"Erro ao atualizar envio de {len(rows)} registro(s) em lote: {exc}")
+
+
 # =========================
 # Loop principal
 # =========================
 
+class PipelineStage:
+    """Fila de entrada limitada e contadores de um estágio do pipeline de envio."""
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(self, name: str, workers: int, maxsize: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=maxsize)
+        self.processed = 0
+        self.busy = 0
+        self.blocked_puts = 0
+        self._recent: deque = deque()
+        self._lock = threading.Lock()
+
+    def put(self, item: Any, stop_event: threading.Event) -> bool:
+        """Bloqueia enquanto a fila estiver cheia (backpressure); `False` se o loop parar."""
+        while not stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                with self._lock:
+                    self.blocked_puts += 1
+        return False
+
+    def get(self) -> Any:
+        try:
+            return self.queue.get(timeout=0.5)
+        except queue.Empty:
+            return None
+
+    def begin(self) -> None:
+        with self._lock:
+            self.busy += 1
+
+    def done(self, count: int = 1) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.busy -= 1
+            self.processed += count
+            self._recent.append((now, count))
+            while self._recent and now - self._recent[0][0] > self.WINDOW_SECONDS:
+                self._recent.popleft()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(count for ts, count in self._recent if now - ts <= self.WINDOW_SECONDS)
+            stats = {
+                "workers": self.workers,
+                "busy": self.busy,
+                "processed": self.processed,
+                "per_minute": round(recent * 60.0 / self.WINDOW_SECONDS, 2),
+            }
+        if self.queue.maxsize:
+            stats.update(
+                queue_depth=self.queue.qsize(),
+                queue_max=self.queue.maxsize,
+                backpressure_waits=self.blocked_puts,
+            )
+        return stats
+
+
+class SendPipeline:
+    """
+    Estágios busca → montagem → envio → update ligados por filas limitadas.
+    A busca roda no thread do `main_loop`; os demais estágios têm seus próprios
+    workers. Fila cheia bloqueia o estágio anterior, até a busca no Oracle.
+    No stop, páginas e lotes ainda não enviados são descartados, mas todo lote já
+    enviado passa pelo update (ledger e DT_ENVIOROTEIRIZADOR) antes de sair.
+    """
+
+    def __init__(self, stop_event: threading.Event) -> None:
+        self.stop_event = stop_event
+        # unidades: registros buscados, páginas montadas, lotes enviados, lotes atualizados
+        self.fetch = PipelineStage("fetch", 1, 0)  # roda no main_loop, sem fila de entrada
+        self.map = PipelineStage("map", PIPELINE_MAP_WORKERS, PIPELINE_QUEUE_SIZE)
+        self.send = PipelineStage("send", PIPELINE_SEND_WORKERS, PIPELINE_QUEUE_SIZE)
+        self.update = PipelineStage("update", PIPELINE_UPDATE_WORKERS, PIPELINE_QUEUE_SIZE)
+        self._pending = 0
+        self._idle = threading.Condition()
+        # setado só depois que os workers de envio saem: o update esvazia a fila até lá
+        self._sends_done = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._update_threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for stage, target in ((self.map, self._map_worker), (self.send, self._send_worker), (self.update, self._update_worker)):
+            for idx in range(stage.workers):
+                thread = threading.Thread(target=self._run, args=(target,), name=f"send-{stage.name}-{idx}", daemon=True)
+                thread.start()
+                (self._update_threads if stage is self.update else self._threads).append(thread)
+
+    def join(self, timeout: float = PIPELINE_SHUTDOWN_SECONDS) -> None:
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        self._sends_done.set()
+        for thread in self._update_threads:
+            thread.join(timeout=max(0.0, deadline - time.monotonic()))
+        pending = self.update.queue.qsize()
+        if pending:
+            logger.error(f"Shutdown com {pending} lote(s) enviado(s) sem update de DT_ENVIOROTEIRIZADOR")
+
+    def _track(self, delta: int) -> None:
+        with self._idle:
+            self._pending += delta
+            if self._pending <= 0:
+                self._idle.notify_all()
+
+    def wait_idle(self) -> None:
+        """Aguarda páginas e lotes em andamento (antes de reiniciar a paginação)."""
+        with self._idle:
+            while self._pending > 0 and not self.stop_event.is_set():
+                self._idle.wait(timeout=0.5)
+
+    def submit_page(self, records: List[Dict[str, Any]]) -> bool:
+        self._track(1)
+        if not self.map.put(records, self.stop_event):
+            self._track(-1)
+            return False
+        return True
+
+    def _running(self, target) -> bool:
+        if target == self._update_worker:
+            return not (self._sends_done.is_set() and self.update.queue.empty())
+        return not self.stop_event.is_set()
+
+    def _run(self, target) -> None:
+        while self._running(target):
+            try:
+                target()
+            except Exception as exc:
+                save_error_stacktrace(exc, extra_info={"thread": threading.current_thread().name})
+                logger.error(f"Erro no pipeline de envio: {exc}\nTraceback:\n{traceback.format_exc()}")
+
+    def _map_worker(self) -> None:
+        records = self.map.get()
+        if records is None:
+            return
+        self.map.begin()
+        try:
+            entries = build_entries(records, self.stop_event)
+            entries, repairs = skip_already_sent(entries)
+            apply_updates(repairs)
+            batches = build_send_batches(entries)
+            logger.info(f"{len(entries)} payload(s) agrupado(s) em {len(batches)} lote(s)")
+            for batch in batches:
+                self._track(1)
+                if not self.send.put(batch, self.stop_event):
+                    self._track(-1)
+                    break
+        finally:
+            self.map.done()
+            self._track(-1)
+
+    def _send_worker(self) -> None:
+        batch = self.send.get()
+        if batch is None:
+            return
+        self.send.begin()
+        handed_over = False
+        try:
+            logger.info(f"Enviando lote com {len(batch)} visita(s)")
+            result, elapsed = send_batch(batch)
+            # lote enviado não pode ser descartado no stop: o update segue até esvaziar a fila
+            handed_over = self.update.put((batch, result, elapsed), self._sends_done)
+            if not handed_over:
+                apply_updates(apply_batch_result(batch, result, elapsed))
+        finally:
+            self.send.done()
+            if not handed_over:
+                self._track(-1)
+
+    def _update_worker(self) -> None:
+        item = self.update.get()
+        if item is None:
+            return
+        # lotes já enfileirados entram no mesmo executemany/commit
+        items = [item]
+        while True:
+            try:
+                items.append(self.update.queue.get_nowait())
+            except queue.Empty:
+                break
+        self.update.begin()
+        try:
+            rows: List[Tuple[Any, Any, Any]] = []
+            for batch, result, elapsed in items:
+                try:
+                    rows.extend(apply_batch_result(batch, result, elapsed))
+                except Exception as exc:
+                    logger.error(f"Erro ao processar resultado de lote: {exc}")
+            apply_updates(rows)
+        finally:
+            self.update.done(len(items))
+            self._track(-len(items))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._idle:
+            pending = self._pending
+        return {
+            "in_flight": pending,
+            "stages": {stage.name: stage.stats() for stage in (self.fetch, self.map, self.send, self.update)},
+        }
+
+
+_pipeline: Optional[SendPipeline] = None
+
+
+def build_entries(records: Sequence[Dict[str, Any]], stop_event: threading.Event) -> List[Dict[str, Any]]:
+    """Monta {record, payload, reference} de cada registro da página."""
+    entries: List[Dict[str, Any]] = []
+    for idx, record in enumerate(records, 1):
+        if stop_event.is_set():
+            break
+
+        reference = record.get("ID_ATENDIMENTO") or record.get("id_atendimento")
+        logger.info(f"Montando registro {idx}/{len(records)}: reference={reference}")
+
+        # Normaliza chaves para build_visit_payload
+        record_upper = {str(k).upper(): v for k, v in record.items()}
+
+        try:
+            payload = build_visit_payload(record_upper)
+        except Exception as exc:
+            save_error_stacktrace(exc, extra_info={"record": record})
+            logger.error(f"Erro ao montar payload para registro reference={reference}")
+            continue
+
+        entries.append({"record": record, "payload": payload, "reference": reference})
+    return entries
+
+
 def main_loop(stop_event: threading.Event) -> None:
-    logger.info("Iniciando loop de envio para SimpliRoute...")
-    offset = 0
+    global _pipeline, SEND_LEDGER
+    logger.info(f"Iniciando loop de envio para SimpliRoute (paginação={SEND_PAGINATION_MODE})...")
+    if SEND_LEDGER is None:
+        SEND_LEDGER = open_send_ledger()
+    pipeline = SendPipeline(stop_event)
+    pipeline.start()
+    _pipeline = pipeline
+    cursor: Any = None
 
     while not stop_event.is_set():
         records: List[Dict[str, Any]] = []
-        logger.info(f"--- INÍCIO DE ENVIO --- (offset={offset})")
+        has_more = False
+        logger.info(f"--- INÍCIO DE ENVIO --- (cursor={cursor})")
 
         try:
-            records = fetch_records(SEND_LIMIT, offset)
+            pipeline.fetch.begin()
+            try:
+                records, next_cursor, has_more = fetch_page(SEND_LIMIT, cursor)
+            finally:
+                pipeline.fetch.done(len(records))
 
             if not records:
-                logger.info("Nenhum registro encontrado para envio. Resetando offset e aguardando.")
-                offset = 0
+                logger.info("Nenhum registro encontrado para envio. Resetando cursor e aguardando.")
+                cursor = None
+                pipeline.wait_idle()
                 # dorme mais quando não tem nada
                 stop_event.wait(10 * SEND_INTERVAL_SECONDS)
                 continue
 
-            # Avança offset “paginando” a fonte atual
-            offset += len(records)
-
-            for idx, record in enumerate(records, 1):
-                if stop_event.is_set():
-                    break
-
-                start_time = time.perf_counter()
-                reference = record.get("ID_ATENDIMENTO") or record.get("id_atendimento")
-                logger.info(f"Enviando registro {idx}/{len(records)}: reference={reference}")
-
-                # Normaliza chaves para build_visit_payload
-                record_upper = {str(k).upper(): v for k, v in record.items()}
-
-                try:
-                    payload = build_visit_payload(record_upper)
-                except Exception as exc:
-                    save_error_stacktrace(exc, extra_info={"record": record})
-                    logger.error(f"Erro ao montar payload para registro reference={reference}")
-                    continue
-
-                result = send_to_simpliroute(payload)
-                status_code = result.get("status_code")
-
-                if status_code is not None and 200 <= int(status_code) < 300:
-                    # Atualiza DT_ENVIOROTEIRIZADOR se envio foi bem-sucedido
-                    id_prescription = record.get("id_prescricao") or record.get("ID_PRESCRICAO")
-                    id_protocolo = record.get("id_protocolo") or record.get("ID_PROTOCOLO")
-                    id_simpliroute = "123"
-
-                    if id_prescription and id_protocolo:
-                        update_envioroteirizador(id_prescription, id_protocolo, id_simpliroute)
-                    else:
-                        logger.warning(
-                            f"Chaves para update não encontradas: IDPRESCRIPTION={id_prescription}, ID_PROTOCOLO={id_protocolo}"
-                        )
-
-                    elapsed = time.perf_counter() - start_time
-                    with eventos_lock:
-                        eventos_enviados.appendleft(
-                            {
-                                "timestamp": (datetime.now(timezone.utc) - timedelta(hours=3)).isoformat(),
-                                "payload_preview": json.dumps(payload, ensure_ascii=False)[:200],
-                                "exec_time_s": round(elapsed, 4),
-                                "reference": reference,
-                            }
-                        )
-
-                logger.info(f"Envio concluído: reference={reference}")
+            # Avança o cursor “paginando” a fonte atual; a página segue para a montagem
+            # enquanto a próxima já pode ser buscada (limitado pelas filas do pipeline)
+            cursor = next_cursor
+            pipeline.submit_page(records)
 
         except Exception as exc:
-            save_error_stacktrace(exc, extra_info={"offset": offset})
+            save_error_stacktrace(exc, extra_info={"cursor": cursor})
             logger.error(f"Erro no loop de envio: {exc}\nTraceback:\n{traceback.format_exc()}")
 
-        logger.info("--- FIM DE ENVIO ---")
-
-        # Se chegou ao fim da “página”, reinicia offset
-        if not records or len(records) < SEND_LIMIT:
-            offset = 0
+        if records and has_more:
+            continue
 
+        # Fim da fonte (ou erro): espera os envios/updates em andamento para que a
+        # próxima passada não releia registros ainda sem DT_ENVIOROTEIRIZADOR
+        pipeline.wait_idle()
+        logger.info("--- FIM DE ENVIO ---")
+        cursor = None
         stop_event.wait(SEND_INTERVAL_SECONDS)
 
+    pipeline.join()
+    if SEND_LEDGER is not None:
+        SEND_LEDGER.close()
+        SEND_LEDGER = None
+
 
 # =========================
 # FastAPI com lifespan (startup/shutdown)
@@ -497,8 +1053,8 @@ async def lifespan(app: FastAPI):
         yield
     finally:
         stop_event.set()
-        # opcional: join curto para fechar “limpo”
-        t.join(timeout=5)
+        # aguarda o pipeline gravar os lotes já enviados (ver SendPipeline.join)
+        t.join(timeout=PIPELINE_SHUTDOWN_SECONDS + 5)
 
 
 app = FastAPI(title="SimpliRoute Send Health Server", lifespan=lifespan)
@@ -528,6 +1084,7 @@ async def health_check():
             "envios": {"total": env_total, "hoje": env_h},
             "erros": {"total": err_total, "hoje": err_h},
             "falhas_atualizacao_registro": {"total": falhas_atualizacao_t, "hoje": falhas_atualizacao_h},
+            "pipeline": _pipeline.stats() if _pipeline is not None else None,
         }
     )
 
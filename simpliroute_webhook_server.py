@@ -3,18 +3,22 @@ Servidor de Webhook SimpliRoute — FastAPI (SÍNCRONO + Oracle THICK MODE)
 - Mantém THICK MODE (Instant Client obrigatório)
 - Usa SQLAlchemy síncrono (create_engine)
 - Endpoint síncrono (FastAPI executa em threadpool automaticamente)
+- Inserts no Oracle em lote por uma thread de escrita (WEBHOOK_BATCH_SIZE / WEBHOOK_FLUSH_MS)
 - Logging estruturado + health + stacktrace em arquivo
 """
 
 import os
 import json
 import time
+import queue
 import logging
+import threading
 import traceback
 from pathlib import Path
 from datetime import datetime, timezone, timedelta
 from collections import deque
-from typing import Any, Dict, Optional
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
 
 import oracledb
 from fastapi import FastAPI, Body
@@ -22,6 +26,9 @@ from fastapi.responses import JSONResponse
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 
+from src.core.config import env_int
+from src.core.json_backend import dumps as json_dumps
+
 
 # ---------------------------
 # Utilitário para ler .env
@@ -138,7 +145,7 @@ class JsonFormatter(logging.Formatter):
         }
         if record.exc_info:
             log_record["exception"] = self.formatException(record.exc_info)
-        return json.dumps(log_record, ensure_ascii=False)
+        return json_dumps(log_record)
 
 
 def get_logger() -> logging.Logger:
@@ -246,149 +253,281 @@ def build_oracle_engine() -> Engine:
         raise
 
 
-engine = build_oracle_engine()
-
-
 # ---------------------------
-# Persistência (SÍNCRONA)
+# Persistência
 # ---------------------------
-def registrar_payload_oracle(payload: Dict[str, Any], engine: Engine, logger: logging.Logger) -> None:
-    """
-    Insere um registro da payload na tabela Oracle TD_OTIMIZE_ALTSTAT.
-    """
-    try:
-        schema = (os.getenv("ORACLE_SCHEMA") or "").strip()
-        table = (os.getenv("ORACLE_TABLE") or "TD_OTIMIZE_ALTSTAT").strip()
-
-        full_table = f"{schema}.{table}" if schema else table
-
-        def to_int(val: Any) -> Optional[int]:
-            try:
-                return int(val) if val is not None else None
-            except Exception:
-                return None
-
-        def get_first(*keys: str) -> Any:
-            for k in keys:
-                v = payload.get(k)
-                if v not in (None, ""):
-                    return v
-            return None
+INSERT_COLUMNS = "IDREFERENCE, EVENTDATE, IDADMISSION, IDREGISTRO, TPREGISTRO, STATUS, INFORMACAO, OBS"
+INSERT_VALUES = ":idreference, :eventdate, :idadmission, :idregistro, :tpregistro, :status, :informacao, :obs"
 
-        eventdate = utc3_now()
 
-        # tpregistro
-        tpregistro: Optional[int] = None
-        tp_val = get_first("tpregistro", "TPREGISTRO")
-        try:
-            tp_val_int = int(tp_val)
-            if tp_val_int in (1, 2):
-                tpregistro = tp_val_int
-        except Exception:
-            pass
+def oracle_target_table() -> str:
+    schema = (os.getenv("ORACLE_SCHEMA") or "").strip()
+    table = (os.getenv("ORACLE_TABLE") or "TD_OTIMIZE_ALTSTAT").strip()
+    return f"{schema}.{table}" if schema else table
 
-        if tpregistro is None:
-            visit_type = (payload.get("visit_type") or "").lower()
-            if visit_type in ("rota_log", "adm_log", "acr_log", "ret_log", "pad_log", "entrega", "delivery"):
-                tpregistro = 2
-            elif visit_type in ("med", "medico", "enf", "enfermeiro", "enfermagem"):
-                tpregistro = 1
-            else:
-                tpregistro = 2
-
-        # idreference / idadmission / idregistro
-        idreference = to_int(get_first("reference"))
-        idregistro: Optional[str] = None
-
-        if tpregistro == 1:
-            idadmission = to_int(get_first("reference"))
-        else:
-            idadmission = None
-            # id registro = últimos 6 dígitos de reference
-            idregistro = str(get_first("reference"))[-6:] if get_first("reference") is not None else None
-
-        # status / informacao
-        status_str = str(payload.get("status") or "").lower()
-        status: Optional[int] = None
-        informacao: Optional[str] = None
-
-        if status_str == "completed":
-            status = 5
-            informacao = "Entregue"
-        elif status_str == "partial":
-            status = 4
-            informacao = "Entrega parcial"
-        elif status_str in ("failed", "cancelled", "canceled", "not_delivered", "undelivered"):
-            status = 6
-            informacao = "Falha na entrega"
-
-        # obs
-        checkout_comment = payload.get("checkout_comment") or ""
-        checkout_rota2 = (payload.get("extra_field_values") or {}).get("checkout_rota2") or ""
-        obs = f"{checkout_comment} | {checkout_rota2}"
-        if obs == " | ":
-            obs = None
-
-        insert_sql = f"""
+
+def build_insert_sql(full_table: str) -> str:
+    return f"""
             INSERT INTO {full_table}
-                (IDREFERENCE, EVENTDATE, IDADMISSION, IDREGISTRO, TPREGISTRO, STATUS, INFORMACAO, OBS)
+                ({INSERT_COLUMNS})
             VALUES
-                (:idreference, :eventdate, :idadmission, :idregistro, :tpregistro, :status, :informacao, :obs)
+                ({INSERT_VALUES})
         """
 
-        params = {
-            "idreference": idreference,
-            "eventdate": eventdate,
-            "idadmission": idadmission,
-            "idregistro": idregistro,
-            "tpregistro": tpregistro,
-            "status": status,
-            "informacao": informacao,
-            "obs": obs,
-        }
 
-        logger.info(json.dumps({"trace": "params para insert", **params}, ensure_ascii=False, default=str))
+def build_insert_params(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Monta os parâmetros do INSERT na TD_OTIMIZE_ALTSTAT a partir da payload do webhook.
+    """
 
+    def to_int(val: Any) -> Optional[int]:
         try:
-            # begin() faz commit automático ao sair sem erro
-            with engine.begin() as conn:
-                conn.execute(text(insert_sql), params)
+            return int(val) if val is not None else None
+        except Exception:
+            return None
+
+    def get_first(*keys: str) -> Any:
+        for k in keys:
+            v = payload.get(k)
+            if v not in (None, ""):
+                return v
+        return None
+
+    eventdate = utc3_now()
+
+    # tpregistro
+    tpregistro: Optional[int] = None
+    tp_val = get_first("tpregistro", "TPREGISTRO")
+    try:
+        tp_val_int = int(tp_val)
+        if tp_val_int in (1, 2):
+            tpregistro = tp_val_int
+    except Exception:
+        pass
+
+    if tpregistro is None:
+        visit_type = (payload.get("visit_type") or "").lower()
+        if visit_type in ("rota_log", "adm_log", "acr_log", "ret_log", "pad_log", "entrega", "delivery"):
+            tpregistro = 2
+        elif visit_type in ("med", "medico", "enf", "enfermeiro", "enfermagem"):
+            tpregistro = 1
+        else:
+            tpregistro = 2
+
+    # idreference / idadmission / idregistro
+    idreference = to_int(get_first("reference"))
+    idregistro: Optional[str] = None
 
+    if tpregistro == 1:
+        idadmission = to_int(get_first("reference"))
+    else:
+        idadmission = None
+        # id registro = últimos 6 dígitos de reference
+        idregistro = str(get_first("reference"))[-6:] if get_first("reference") is not None else None
+
+    # status / informacao
+    status_str = str(payload.get("status") or "").lower()
+    status: Optional[int] = None
+    informacao: Optional[str] = None
+
+    if status_str == "completed":
+        status = 5
+        informacao = "Entregue"
+    elif status_str == "partial":
+        status = 4
+        informacao = "Entrega parcial"
+    elif status_str in ("failed", "cancelled", "canceled", "not_delivered", "undelivered"):
+        status = 6
+        informacao = "Falha na entrega"
+
+    # obs
+    checkout_comment = payload.get("checkout_comment") or ""
+    checkout_rota2 = (payload.get("extra_field_values") or {}).get("checkout_rota2") or ""
+    obs = f"{checkout_comment} | {checkout_rota2}"
+    if obs == " | ":
+        obs = None
+
+    return {
+        "idreference": idreference,
+        "eventdate": eventdate,
+        "idadmission": idadmission,
+        "idregistro": idregistro,
+        "tpregistro": tpregistro,
+        "status": status,
+        "informacao": informacao,
+        "obs": obs,
+    }
+
+
+def inserir_lote_oracle(rows: List[Dict[str, Any]], engine: Engine, logger: logging.Logger) -> int:
+    """
+    Insere um lote de parâmetros com um único executemany e um único commit.
+    Se o lote falhar, regrava linha a linha para isolar o registro com erro.
+    Retorna a quantidade de linhas gravadas.
+    """
+    if not rows:
+        return 0
+    full_table = oracle_target_table()
+    insert_sql = text(build_insert_sql(full_table))
+    try:
+        # begin() faz commit automático ao sair sem erro; lista de params => executemany
+        with engine.begin() as conn:
+            conn.execute(insert_sql, rows)
+        for params in rows:
             logger.info(
-                f"Payload registrado no banco Oracle: idreference={idreference} idadmission={idadmission} status={status}"
+                f"Payload registrado no banco Oracle: idreference={params['idreference']} "
+                f"idadmission={params['idadmission']} status={params['status']}"
             )
-
-        except Exception as exc:
-            save_error_stacktrace(exc, extra_info={"params": params, "table": full_table})
+        return len(rows)
+    except Exception as exc:
+        if len(rows) == 1:
+            save_error_stacktrace(exc, extra_info={"params": rows[0], "table": full_table})
             tb_str = traceback.format_exc()
             logger.error(f"Falha ao inserir payload no banco Oracle: {exc}\nTraceback:\n{tb_str}")
+            return 0
+        logger.warning(f"Falha no insert em lote ({len(rows)} linhas), regravando individualmente: {exc}")
+        return sum(inserir_lote_oracle([params], engine, logger) for params in rows)
+
+
+class OracleBatchWriter:
+    """
+    Thread de escrita em background: acumula os parâmetros enfileirados pelo
+    endpoint e grava com um executemany por lote, ao atingir `batch_size`
+    linhas ou após `flush_ms` milissegundos desde a primeira linha pendente.
+    """
+
+    def __init__(self, engine: Engine, logger: logging.Logger, batch_size: int = 100, flush_ms: int = 200) -> None:
+        self.engine = engine
+        self.logger = logger
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = max(1, flush_ms) / 1000.0
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._in_flight = 0
+        self.batches_total = 0
+        self.rows_total = 0
+        self.last_flush_ms: Optional[float] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="oracle-batch-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Sinaliza o fim e aguarda o flush das linhas pendentes."""
+        if not self._thread:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, params: Dict[str, Any]) -> None:
+        self._queue.put(params)
+
+    def pending(self) -> int:
+        return self._queue.qsize() + self._in_flight
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pendentes": self.pending(),
+            "lotes_gravados": self.batches_total,
+            "linhas_gravadas": self.rows_total,
+            "ultimo_flush_ms": self.last_flush_ms,
+            "batch_size": self.batch_size,
+            "flush_ms": int(self.flush_seconds * 1000),
+        }
 
+    def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        start = time.perf_counter()
+        try:
+            self.rows_total += inserir_lote_oracle(batch, self.engine, self.logger)
+            self.batches_total += 1
+        except Exception as exc:
+            save_error_stacktrace(exc, extra_info={"batch_size": len(batch)})
+            self.logger.error(f"Erro inesperado no flush do lote Oracle: {exc}")
+        finally:
+            self.last_flush_ms = round((time.perf_counter() - start) * 1000, 2)
+            self._in_flight = 0
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            self._in_flight = 1
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+                self._in_flight = len(batch)
+            self._flush(batch)
+
+
+engine = build_oracle_engine()
+batch_writer = OracleBatchWriter(
+    engine,
+    logger,
+    batch_size=env_int("WEBHOOK_BATCH_SIZE", 100),
+    flush_ms=env_int("WEBHOOK_FLUSH_MS", 200),
+)
+
+
+def enfileirar_payload_oracle(payload: Dict[str, Any], logger: logging.Logger) -> None:
+    """
+    Monta os parâmetros da payload e enfileira no writer em lote.
+    """
+    try:
+        params = build_insert_params(payload)
+        logger.info(json_dumps({"trace": "params para insert", **params}, default=str))
+        batch_writer.submit(params)
     except Exception as exc:
         save_error_stacktrace(exc, extra_info={"payload": payload})
-        logger.error(f"Erro inesperado em registrar_payload_oracle: {exc}")
+        logger.error(f"Erro inesperado em enfileirar_payload_oracle: {exc}")
 
 
 # ---------------------------
 # App FastAPI
 # ---------------------------
-app = FastAPI(title="SimpliRoute Webhook Server (Sync + Thick Mode)")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    batch_writer.start()
+    try:
+        yield
+    finally:
+        # grava o que ainda estiver pendente antes de encerrar
+        batch_writer.stop()
+
+
+app = FastAPI(title="SimpliRoute Webhook Server (Sync + Thick Mode)", lifespan=lifespan)
 
 
 @app.post(WEBHOOK_ROUTE)
 def receive_webhook(payload: Dict[str, Any] = Body(...)):
     start_time = time.perf_counter()
     try:
-        logger.info(f"Payload recebido:\n{json.dumps(payload, ensure_ascii=False)[:200]}...")
+        logger.info(f"Payload recebido:\n{json_dumps(payload)[:200]}...")
 
-        # rotina principal (SÍNCRONA)
-        registrar_payload_oracle(payload, engine, logger)
+        # gravação no Oracle fica com o batch_writer (executemany por lote)
+        enfileirar_payload_oracle(payload, logger)
 
         elapsed = time.perf_counter() - start_time
 
         eventos_recebidos.appendleft(
             {
                 "timestamp": utc3_now().isoformat(),
-                "payload_preview": json.dumps(payload, ensure_ascii=False)[:200],
+                "payload_preview": json_dumps(payload)[:200],
                 "exec_time_s": round(elapsed, 4),
             }
         )
@@ -396,7 +535,7 @@ def receive_webhook(payload: Dict[str, Any] = Body(...)):
         return JSONResponse({"status": "received"})
 
     except Exception as exc:
-        save_error_stacktrace(exc, extra_info={"payload_preview": json.dumps(payload, ensure_ascii=False)[:200]})
+        save_error_stacktrace(exc, extra_info={"payload_preview": json_dumps(payload)[:200]})
         logger.error(f"Exceção não controlada em receive_webhook: {exc}")
         return JSONResponse({"error": "internal_server_error"}, status_code=500)
 
@@ -410,6 +549,7 @@ def health_check():
             "hora_atual": dt_utc3.isoformat(),
             "error_log_dir": str(ERROR_LOG_DIR.resolve()),
             "ultimos_eventos": list(eventos_recebidos),
+            "oracle_writer": batch_writer.stats(),
             "erros": {
                 "total": erros_total,
                 "hoje": erros_hoje,
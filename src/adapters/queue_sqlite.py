@@ -0,0 +1,125 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterable, List, Sequence, Tuple, Union
+
+
+class SQLiteQueue:
+    """
+    Fila durável em SQLite (modo WAL) com entrega at-least-once.
+    API: enqueue(item)/enqueue_many(items), claim(limit) -> [(id, tentativas, item)], ack(ids).
+    Itens lidos e não confirmados voltam a ser entregues no próximo `claim`, com a
+    contagem de tentativas incrementada (o chamador decide quando desistir do item).
+    Itens que nunca serão aceitos vão para a tabela `dead_letter` (dead_letter/dead_letter_count).
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # em WAL, NORMAL só perde transações em queda de energia, não em crash do processo
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                enqueued_at REAL NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                payload TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                failed_at REAL NOT NULL,
+                error TEXT,
+                payload TEXT NOT NULL
+            )
+            """
+        )
+
+    def enqueue(self, item: Any) -> int:
+        return self.enqueue_many([item])
+
+    def enqueue_many(self, items: Iterable[Any]) -> int:
+        now = time.time()
+        rows = [(now, json.dumps(item, ensure_ascii=False, default=str)) for item in items]
+        if not rows:
+            return 0
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT INTO queue (enqueued_at, payload) VALUES (?, ?)", rows)
+        return len(rows)
+
+    def claim(self, limit: int) -> List[Tuple[int, int, Any]]:
+        """Retorna os itens mais antigos (sem removê-los) e incrementa suas tentativas.
+
+        Cada item vem como (id, tentativas, item); `tentativas` já conta este claim.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, attempts, payload FROM queue ORDER BY id LIMIT ?", (max(1, int(limit)),)
+            ).fetchall()
+            if rows:
+                with self._conn:
+                    self._conn.execute("BEGIN")
+                    self._conn.executemany("UPDATE queue SET attempts = attempts + 1 WHERE id = ?", [(r[0],) for r in rows])
+        return [(row_id, attempts + 1, json.loads(payload)) for row_id, attempts, payload in rows]
+
+    def ack(self, ids: Sequence[int]) -> None:
+        if not ids:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("DELETE FROM queue WHERE id = ?", [(i,) for i in ids])
+
+    def dead_letter(self, entries: Iterable[Tuple[Any, str]]) -> int:
+        """Guarda (item, erro) na tabela `dead_letter` para análise/reprocessamento manual."""
+        now = time.time()
+        rows = [(now, str(error), json.dumps(item, ensure_ascii=False, default=str)) for item, error in entries]
+        if not rows:
+            return 0
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT INTO dead_letter (failed_at, error, payload) VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def bury(self, entries: Iterable[Tuple[int, Any, str]]) -> int:
+        """Move (id, item, erro) da fila para a `dead_letter` numa única transação."""
+        now = time.time()
+        entries = list(entries)
+        if not entries:
+            return 0
+        rows = [(now, str(error), json.dumps(item, ensure_ascii=False, default=str)) for _, item, error in entries]
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany("INSERT INTO dead_letter (failed_at, error, payload) VALUES (?, ?, ?)", rows)
+                self._conn.executemany("DELETE FROM queue WHERE id = ?", [(row_id,) for row_id, _, _ in entries])
+        return len(entries)
+
+    def dead_letter_count(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0])
+
+    def oldest_age_seconds(self) -> float:
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(enqueued_at) FROM queue").fetchone()
+        return round(time.time() - row[0], 3) if row and row[0] is not None else 0.0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,130 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+LedgerKey = Tuple[str, str]
+
+# limite de variáveis por consulta em builds antigos do SQLite
+_IN_CHUNK = 500
+
+
+def ledger_key(payload: Dict[str, Any]) -> Optional[LedgerKey]:
+    """Chave (reference, planned_date) de uma visita; `None` quando não há reference."""
+    reference = payload.get("reference")
+    if reference in (None, ""):
+        return None
+    return str(reference), str(payload.get("planned_date") or "")
+
+
+class SendLedger:
+    """
+    Registro local (SQLite, modo WAL) das visitas aceitas pelo SimpliRoute.
+    API: sent_mask(payloads) -> [bool], lookup(payloads) -> [(enviada, visit_id)],
+    record(payloads, visit_ids), forget(references).
+    A consulta é indexada por (reference, planned_date) e não depende do Oracle.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sent (
+                reference TEXT NOT NULL,
+                planned_date TEXT NOT NULL,
+                visit_id TEXT,
+                sent_at REAL NOT NULL,
+                PRIMARY KEY (reference, planned_date)
+            ) WITHOUT ROWID
+            """
+        )
+
+    def _visit_ids(self, keys: Iterable[LedgerKey]) -> Dict[LedgerKey, Optional[str]]:
+        """visit_id de cada chave já registrada (uma consulta por bloco de references)."""
+        wanted = set(keys)
+        if not wanted:
+            return {}
+        references = sorted({reference for reference, _ in wanted})
+        found: Dict[LedgerKey, Optional[str]] = {}
+        with self._lock:
+            for start in range(0, len(references), _IN_CHUNK):
+                chunk = references[start : start + _IN_CHUNK]
+                marks = ", ".join("?" for _ in chunk)
+                rows = self._conn.execute(
+                    f"SELECT reference, planned_date, visit_id FROM sent WHERE reference IN ({marks})", chunk
+                ).fetchall()
+                for reference, planned_date, visit_id in rows:
+                    if (reference, planned_date) in wanted:
+                        found[(reference, planned_date)] = visit_id
+        return found
+
+    def sent_keys(self, keys: Iterable[LedgerKey]) -> Set[LedgerKey]:
+        """Subconjunto de `keys` já registrado."""
+        return set(self._visit_ids(keys))
+
+    def sent_mask(self, payloads: Sequence[Dict[str, Any]]) -> List[bool]:
+        """Para cada payload, se a mesma (reference, planned_date) já foi aceita."""
+        keys = [ledger_key(payload) for payload in payloads]
+        found = self.sent_keys(key for key in keys if key is not None)
+        return [key is not None and key in found for key in keys]
+
+    def lookup(self, payloads: Sequence[Dict[str, Any]]) -> List[Tuple[bool, Optional[str]]]:
+        """Para cada payload, (já aceito?, ID da visita devolvido pelo SimpliRoute)."""
+        keys = [ledger_key(payload) for payload in payloads]
+        found = self._visit_ids(key for key in keys if key is not None)
+        return [(key is not None and key in found, found.get(key) if key is not None else None) for key in keys]
+
+    def record(self, payloads: Sequence[Dict[str, Any]], visit_ids: Optional[Sequence[Optional[str]]] = None) -> int:
+        """Registra visitas aceitas (com o ID devolvido pelo SimpliRoute, quando houver)."""
+        now = time.time()
+        ids = list(visit_ids or [])
+        rows = []
+        for idx, payload in enumerate(payloads):
+            key = ledger_key(payload)
+            if key is None:
+                continue
+            visit_id = ids[idx] if idx < len(ids) else None
+            rows.append((key[0], key[1], None if visit_id is None else str(visit_id), now))
+        if not rows:
+            return 0
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sent (reference, planned_date, visit_id, sent_at) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+        return len(rows)
+
+    def forget(self, references: Iterable[Any]) -> int:
+        """Remove references do ledger (ex.: para reenviar uma visita apagada no SimpliRoute)."""
+        params = [(str(reference),) for reference in references]
+        if not params:
+            return 0
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                cur = self._conn.executemany("DELETE FROM sent WHERE reference = ?", params)
+        return cur.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM sent").fetchone()[0])
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_send_ledger(path: Union[str, Path, None] = None) -> Optional[SendLedger]:
+    """Ledger configurado por `SIMPLIROUTE_SEND_LEDGER_PATH`; `None` com `SIMPLIROUTE_SEND_LEDGER=0`."""
+    if os.getenv("SIMPLIROUTE_SEND_LEDGER", "1") == "0":
+        return None
+    return SendLedger(path or os.getenv("SIMPLIROUTE_SEND_LEDGER_PATH", "data/work/send_ledger.sqlite3"))
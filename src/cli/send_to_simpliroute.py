@@ -4,9 +4,11 @@ import asyncio
 import json
 import os
 import shlex
+import textwrap
+from contextlib import ExitStack, closing
 from datetime import UTC, datetime
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Sequence
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, TextIO
 
 import sys
 if __name__ == "__main__":
@@ -14,12 +16,24 @@ if __name__ == "__main__":
 
 import httpx
 
+from src.adapters.send_ledger import SendLedger, open_send_ledger
+from src.core.batching import fetch_slice_size, iter_slices
 from src.core.config import load_config
-from src.integrations.simpliroute.client import post_simpliroute
-from src.integrations.simpliroute.mapper import build_visit_payload
+from src.core.json_backend import dumps as json_dumps
+from src.core.rate_limit import get_rate_limiter
+from src.integrations.simpliroute.client import (
+    SendResult,
+    close_http_clients,
+    get_http_client,
+    post_simpliroute,
+)
+from src.integrations.simpliroute.mapper import build_visit_payloads
 from src.integrations.simpliroute.oracle_source import (
-    fetch_grouped_records,
-    fetch_view_rows,
+    config_projections,
+    iter_view_records,
+    iter_view_rows,
+    measure_view_fetch,
+    resolve_projection,
     resolve_where_clause,
 )
 
@@ -91,47 +105,66 @@ def _simpliroute_token() -> str:
     )
 
 
-def _collect_records(
+def _load_file_records(file_path: Path | None) -> List[Dict[str, Any]]:
+    if not file_path:
+        raise ValueError("Informe um arquivo via --file para usar dados locais")
+    if not file_path.exists():
+        raise FileNotFoundError(f"Arquivo não encontrado: {file_path}")
+    with open(file_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        if "records" in data and isinstance(data["records"], list):
+            return data["records"]
+        if "data" in data and isinstance(data["data"], list):
+            return data["data"]
+        return [data]
+    raise ValueError("Formato de arquivo inválido: esperado dict ou list")
+
+
+def _iter_records(
     use_db: bool,
     file_path: Path | None,
     limit: int,
     where: str | None,
     view_names: Sequence[str] | None,
     order_by: str | None = None,
-) -> List[Dict[str, Any]]:
-    if use_db:
-        targets = list(view_names or []) or [None]
-        rows: List[Dict[str, Any]] = []
-        for target_view in targets:
-            effective_where = resolve_where_clause(target_view, where)
-            rows.extend(
-                fetch_grouped_records(limit=limit, where_clause=effective_where, view_name=target_view, order_by=order_by)
-            )
-        return rows
-    if file_path:
-        if not file_path.exists():
-            raise FileNotFoundError(f"Arquivo não encontrado: {file_path}")
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            return data
-        if isinstance(data, dict):
-            if "records" in data and isinstance(data["records"], list):
-                return data["records"]
-            if "data" in data and isinstance(data["data"], list):
-                return data["data"]
-            return [data]
-        raise ValueError("Formato de arquivo inválido: esperado dict ou list")
-    raise ValueError("Informe um arquivo via --file para usar dados locais")
-
-
-def _save_payload(payloads: Sequence[Dict[str, Any]], output_dir: Path) -> Path:
+) -> Iterator[Dict[str, Any]]:
+    """Registros da origem; do Oracle cada view é lida em streaming, uma por vez."""
+    if not use_db:
+        yield from _load_file_records(file_path)
+        return
+    projections = config_projections(_load_cached_config())
+    for view in list(view_names or []) or [None]:
+        with closing(
+            iter_view_records(view, limit=limit, where_clause=where, order_by=order_by, projections=projections)
+        ) as records:
+            yield from records
+
+
+def _payload_path(output_dir: Path) -> Path:
     output_dir.mkdir(parents=True, exist_ok=True)
     timestamp = datetime.now(UTC).strftime("%Y%m%d_%H%M%S")
-    target = output_dir / f"send_to_sr_{timestamp}.json"
-    with open(target, "w", encoding="utf-8") as fp:
-        json.dump(payloads, fp, ensure_ascii=False, indent=2)
-    return target
+    return output_dir / f"send_to_sr_{timestamp}.json"
+
+
+class _PayloadWriter:
+    """Grava os payloads como uma lista JSON à medida que as fatias ficam prontas."""
+
+    def __init__(self, fp: TextIO) -> None:
+        self._fp = fp
+        self._count = 0
+
+    def write(self, payloads: Sequence[Dict[str, Any]]) -> None:
+        for payload in payloads:
+            self._fp.write("[\n" if self._count == 0 else ",\n")
+            self._fp.write(textwrap.indent(json.dumps(payload, ensure_ascii=False, indent=2), "  "))
+            self._count += 1
+
+    def close(self) -> None:
+        self._fp.write("\n]" if self._count else "[]")
+        self._fp.write("\n" if self._fp is sys.stdout else "")
 
 
 def _is_delivery(payload: Dict[str, Any]) -> bool:
@@ -149,12 +182,9 @@ def _is_delivery(payload: Dict[str, Any]) -> bool:
     return False
 
 
-def _print_summary(payloads: Sequence[Dict[str, Any]]) -> None:
-    total = len(payloads)
-    deliveries = sum(1 for p in payloads if _is_delivery(p))
+def _print_summary(total: int, deliveries: int, sample: Dict[str, Any] | None) -> None:
     print(f"Payloads gerados: {total} (entregas: {deliveries}, visitas: {total - deliveries})")
-    if payloads:
-        sample = payloads[0]
+    if sample:
         reference = sample.get("reference") or sample.get("tracking_id")
         print(f"Exemplo: title='{sample.get('title')}', reference='{reference}'")
 
@@ -167,11 +197,10 @@ def _append_send_log(entry: Dict[str, Any]) -> None:
     }
     LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
     with open(LOG_PATH, "a", encoding="utf-8") as fp:
-        json.dump(log_entry, fp, ensure_ascii=False)
-        fp.write("\n")
+        fp.write(json_dumps(log_entry) + "\n")
 
 
-def _extract_response_ids(response: httpx.Response) -> List[str]:
+def _extract_response_ids(response: SendResult) -> List[str]:
     ids: List[str] = []
     try:
         payload = response.json()
@@ -196,7 +225,7 @@ def _extract_response_ids(response: httpx.Response) -> List[str]:
     return ids
 
 
-def _pretty_print_response(response: httpx.Response) -> bool:
+def _pretty_print_response(response: SendResult) -> bool:
     try:
         parsed = response.json()
     except ValueError:
@@ -234,6 +263,18 @@ def _pretty_print_response(response: httpx.Response) -> bool:
     return False
 
 
+def _run_http(coro: Any) -> Any:
+    """Executa `coro` num loop próprio e fecha os clients HTTP compartilhados ao final."""
+
+    async def _runner() -> Any:
+        try:
+            return await coro
+        finally:
+            await close_http_clients()
+
+    return asyncio.run(_runner())
+
+
 def _run_send_flow(args: argparse.Namespace) -> int:
     where = args.where or None
     if args.file and (args.view or args.views):
@@ -258,31 +299,77 @@ def _run_send_flow(args: argparse.Namespace) -> int:
         "limit": args.limit,
         "where": where or env_where_hint,
     }
-    try:
-        records = _collect_records(
-            use_db,
-            args.file,
-            args.limit,
-            where,
-            resolved_views,
-            getattr(args, "order_by", None),
-        )
-    except Exception as exc:
-        print(f"Erro ao obter registros: {exc}")
-        if getattr(args, "send_payloads", False):
+    send = getattr(args, "send_payloads", False)
+    records = _iter_records(
+        use_db,
+        args.file,
+        args.limit,
+        where,
+        resolved_views,
+        getattr(args, "order_by", None),
+    )
+    total = deliveries = 0
+    sample: Dict[str, Any] | None = None
+    exit_code = 0
+    with ExitStack() as stack:
+        stack.callback(records.close)
+        ledger = None if not send or getattr(args, "ignore_ledger", False) else open_send_ledger()
+        if ledger is not None:
+            stack.callback(ledger.close)
+        writer: _PayloadWriter | None = None
+        target: Path | None = None
+        if not send:
+            if args.no_save:
+                writer = _PayloadWriter(sys.stdout)
+            else:
+                target = _payload_path(args.output_dir)
+                writer = _PayloadWriter(stack.enter_context(open(target, "w", encoding="utf-8")))
+        # fatias limitadas: nem os registros nem os payloads da origem inteira ficam em memória
+        slices = iter_slices(records, fetch_slice_size())
+        collect_error: Exception | None = None
+        while True:
+            try:
+                batch = next(slices, None)
+            except Exception as exc:
+                collect_error = exc
+                break
+            if batch is None:
+                break
+            payloads = build_visit_payloads(batch, workers=getattr(args, "workers", None))
+            if sample is None and payloads:
+                sample = payloads[0]
+            total += len(payloads)
+            deliveries += sum(1 for p in payloads if _is_delivery(p))
+            if writer is not None:
+                writer.write(payloads)
+                continue
+            code = _send_payloads(payloads, ledger, log_context)
+            if code == 1 or exit_code == 0:
+                exit_code = code
+            if code == 1:
+                # SimpliRoute inacessível: não adianta ler o resto da origem
+                break
+        if writer is not None and (total or target is not None):
+            writer.close()
+
+    if collect_error is not None:
+        print(f"Erro ao obter registros: {collect_error}")
+        if target is not None:
+            target.unlink(missing_ok=True)
+        if send:
             _append_send_log(
                 {
                     "status": "failure",
                     "stage": "collect_records",
-                    "message": str(exc),
+                    "message": str(collect_error),
                     **log_context,
                 }
             )
         return 1
 
-    if not records:
+    if not total:
         print("Nenhum registro retornado pela origem.")
-        if getattr(args, "send_payloads", False):
+        if send:
             _append_send_log(
                 {
                     "status": "failure",
@@ -291,54 +378,85 @@ def _run_send_flow(args: argparse.Namespace) -> int:
                     **log_context,
                 }
             )
+        if target is not None:
+            target.unlink(missing_ok=True)
         return 0
 
-    payloads = [build_visit_payload(record) for record in records]
-    _print_summary(payloads)
+    _print_summary(total, deliveries, sample)
+    if target is not None:
+        print(f"Payload salvo em: {target}")
+    return exit_code
 
-    if getattr(args, "send_payloads", False):
-        response = asyncio.run(post_simpliroute(payloads))
-        if response is None:
-            print("Falha ao enviar payloads ao SimpliRoute.")
+
+def _send_payloads(payloads: List[Dict[str, Any]], ledger: SendLedger | None, log_context: Dict[str, Any]) -> int:
+    if ledger is not None:
+        sent = ledger.sent_mask(payloads)
+        skipped = [p.get("reference") for p, done in zip(payloads, sent) if done]
+        if skipped:
+            payloads = [p for p, done in zip(payloads, sent) if not done]
+            print(f"{len(skipped)} visita(s) já enviada(s) ignorada(s) pelo ledger (use --ignore-ledger para reenviar).")
             _append_send_log(
                 {
-                    "status": "failure",
-                    "stage": "http_request",
-                    "message": "Resposta vazia do cliente HTTP",
+                    "status": "skipped",
+                    "stage": "ledger",
+                    "references": skipped,
                     **log_context,
-                    "payload_count": len(payloads),
-                    "references": [p.get("reference") for p in payloads],
                 }
             )
-            return 1
-        print(f"Resposta SimpliRoute: HTTP {response.status_code}")
-        body_text = response.text if hasattr(response, "text") else ""
-        if not _pretty_print_response(response) and body_text:
-            print(body_text)
-        response_ids = _extract_response_ids(response)
-        log_entry = {
-            "status": "success" if 200 <= response.status_code < 400 else "failure",
-            "stage": "http_request",
-            "http_status": response.status_code,
-            "response_ids": response_ids,
-            "payload_count": len(payloads),
-            "references": [p.get("reference") for p in payloads],
-            **log_context,
-        }
-        if body_text:
-            log_entry["response_body"] = body_text[:1000]
-        _append_send_log(log_entry)
-        if response_ids:
-            print(f"IDs retornados: {', '.join(response_ids)}")
-        return 0 if 200 <= response.status_code < 400 else 2
-
-    if args.no_save:
-        print(json.dumps(payloads, ensure_ascii=False, indent=2))
-        return 0
-
-    target = _save_payload(payloads, args.output_dir)
-    print(f"Payload salvo em: {target}")
-    return 0
+        if not payloads:
+            print("Nenhuma visita pendente de envio.")
+            return 0
+
+    result = _run_http(post_simpliroute(payloads))
+    accepted = result.accepted
+    if result.status_code is None and not any(accepted):
+        print(f"Falha ao enviar payloads ao SimpliRoute: {result.error}")
+        _append_send_log(
+            {
+                "status": "failure",
+                "stage": "http_request",
+                "message": result.error or "Resposta vazia do cliente HTTP",
+                **log_context,
+                "payload_count": len(payloads),
+                "references": [p.get("reference") for p in payloads],
+            }
+        )
+        return 1
+    print(f"Resposta SimpliRoute: HTTP {result.status_code}")
+    body_text = result.text
+    if not _pretty_print_response(result) and body_text:
+        print(body_text)
+    response_ids = _extract_response_ids(result)
+    failures = result.failures
+    log_entry = {
+        "status": "success" if result.ok else "failure",
+        "stage": "http_request",
+        "http_status": result.status_code,
+        "response_ids": response_ids,
+        "payload_count": len(payloads),
+        "references": [p.get("reference") for p in payloads],
+        **log_context,
+    }
+    if len(result.chunks) > 1:
+        log_entry["chunks"] = result.chunks
+    if failures:
+        log_entry["rejected"] = [
+            {"reference": outcome.reference, "http_status": outcome.status_code, "error": (outcome.error or "")[:500]}
+            for outcome in failures
+        ]
+    if body_text:
+        log_entry["response_body"] = body_text[:1000]
+    _append_send_log(log_entry)
+    if response_ids:
+        print(f"IDs retornados: {', '.join(response_ids)}")
+    if failures:
+        print(f"{len(failures)} de {len(payloads)} visita(s) não aceita(s):")
+        for outcome in failures:
+            print(f"  reference={outcome.reference} HTTP {outcome.status_code}: {(outcome.error or '')[:200]}")
+    if ledger is not None and any(accepted) and not result.dry_run:
+        sent = [p for p, done in zip(payloads, accepted) if done]
+        ledger.record(sent, [visit_id for visit_id, done in zip(result.visit_ids, accepted) if done])
+    return 0 if result.ok else 2
 
 
 def _run_preview_flow(args: argparse.Namespace) -> int:
@@ -372,10 +490,13 @@ def _cmd_diagnose_sr(args: argparse.Namespace) -> int:
         headers["Authorization"] = f"Token {token}"
     try:
         async def _ping() -> httpx.Response:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                return await client.get(url, headers=headers)
+            limiter = get_rate_limiter("simpliroute")
+            await limiter.acquire_async()
+            resp = await get_http_client(base).get(url, headers=headers, timeout=15.0)
+            limiter.observe(resp.status_code, resp.headers)
+            return resp
 
-        resp = asyncio.run(_ping())
+        resp = _run_http(_ping())
         print(f"Ping {url} -> HTTP {resp.status_code}")
         if resp.content:
             print(resp.text)
@@ -385,17 +506,58 @@ def _cmd_diagnose_sr(args: argparse.Namespace) -> int:
         return 1
 
 
+def _print_fetch_measure(label: str, result: Dict[str, Any]) -> None:
+    net = result["net_bytes"]
+    net_text = f"{net} bytes" if net is not None else "n/d (sem acesso a v$mystat)"
+    print(
+        f"  {label:<10} colunas={result['columns']:<4} linhas={result['rows']:<6} "
+        f"tempo={result['seconds']:.3f}s  rede={net_text}  valores≈{result['value_bytes']} bytes"
+    )
+
+
+def _compare_projection(args: argparse.Namespace, where: str | None) -> int:
+    view = args.view or os.getenv("ORACLE_VIEW")
+    configured = config_projections(_load_cached_config()).get((view or "").upper())
+    try:
+        columns = resolve_projection(view, configured, explicit=args.projection)
+        if columns is None and not args.projection:
+            # sem projeção configurada: compara com a derivada do mapper
+            columns = resolve_projection(view, explicit="auto")
+        full = measure_view_fetch(limit=args.limit, where_clause=where, view_name=view)
+        projected = measure_view_fetch(limit=args.limit, where_clause=where, view_name=view, columns=columns)
+    except Exception as exc:
+        print(f"Erro ao consultar Oracle: {exc}")
+        return 1
+    if columns:
+        print(f"Projeção: {len(columns)} coluna(s)")
+        print("  " + ", ".join(columns))
+    else:
+        print("Projeção: SELECT * (nenhuma coluna selecionada)")
+    _print_fetch_measure("SELECT *", full)
+    _print_fetch_measure("projeção", projected)
+    for key, label in (("net_bytes", "rede"), ("value_bytes", "valores")):
+        if full[key] and projected[key] is not None:
+            print(f"  {label}: {projected[key] / full[key]:.1%} do SELECT *")
+    return 0
+
+
 def _cmd_diagnose_db(args: argparse.Namespace) -> int:
     where = resolve_where_clause(args.view, args.where)
+    if args.compare_projection:
+        return _compare_projection(args, where)
+    total = 0
+    sample: Dict[str, Any] | None = None
     try:
-        rows = fetch_view_rows(limit=args.limit, where_clause=where, view_name=args.view)
+        with closing(iter_view_rows(limit=args.limit, where_clause=where, view_name=args.view)) as rows:
+            for row in rows:
+                if sample is None:
+                    sample = row
+                total += 1
     except Exception as exc:
         print(f"Erro ao consultar Oracle: {exc}")
         return 1
-    total = len(rows)
     print(f"Linhas retornadas: {total}")
-    if rows:
-        sample = rows[0]
+    if sample:
         print(f"Campos do primeiro registro ({len(sample)} colunas):")
         for key in list(sample.keys())[:10]:
             print(f"  - {key}: {sample[key]}")
@@ -414,11 +576,14 @@ def _cmd_get_visit(args: argparse.Namespace) -> int:
     headers = {"Authorization": f"Token {token}", "Accept": "application/json"}
 
     async def _fetch() -> httpx.Response:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            return await client.get(url, headers=headers)
+        limiter = get_rate_limiter("simpliroute")
+        await limiter.acquire_async()
+        resp = await get_http_client(base).get(url, headers=headers)
+        limiter.observe(resp.status_code, resp.headers)
+        return resp
 
     try:
-        resp = asyncio.run(_fetch())
+        resp = _run_http(_fetch())
     except httpx.RequestError as exc:
         print(f"Erro ao consultar visita {args.visit_id}: {exc}")
         return 1
@@ -476,6 +641,14 @@ def _build_parser() -> argparse.ArgumentParser:
             "action": "store_true",
             "help": "Não gravar arquivo no modo dry-run (imprime no stdout)",
         },
+        "--ignore-ledger": {
+            "action": "store_true",
+            "help": "Envia mesmo as visitas já registradas no ledger local de envios",
+        },
+        "--workers": {
+            "type": int,
+            "help": "Processos para montar payloads em paralelo (padrão=SIMPLIROUTE_MAPPER_WORKERS; 0/1 = serial)",
+        },
     }
 
     send_parser = subparsers.add_parser("send", help="Gera payloads e (opcionalmente) envia ao SimpliRoute")
@@ -502,6 +675,16 @@ def _build_parser() -> argparse.ArgumentParser:
     diag_db.add_argument("--limit", type=int, default=5, help="Quantidade de linhas para amostragem")
     diag_db.add_argument("--where", type=str, help="Cláusula WHERE adicional")
     diag_db.add_argument("--view", type=str, help="Nome da view Oracle (padrão=ORACLE_VIEW)")
+    diag_db.add_argument(
+        "--compare-projection",
+        action="store_true",
+        help="Mede tempo e bytes do SELECT * contra a projeção de colunas da view",
+    )
+    diag_db.add_argument(
+        "--projection",
+        type=str,
+        help="Projeção usada na comparação: 'auto' ou lista de colunas (padrão=config/env, senão 'auto')",
+    )
     diag_db.set_defaults(func=_cmd_diagnose_db)
 
     get_visit = subparsers.add_parser("get-visit", help="Consulta uma visita existente no SimpliRoute")
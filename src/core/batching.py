@@ -0,0 +1,135 @@
+import threading
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from src.core.config import env_float, env_int
+
+T = TypeVar("T")
+
+
+class AdaptiveChunker:
+    """Tamanho de lote adaptativo (AIMD) por quantidade e bytes serializados.
+
+    Um lote cheio respondido com 2xx abaixo de `target_seconds` aumenta o tamanho
+    em `increase_step` (até `max_size`); lote lento, timeout/erro de transporte,
+    408/413/5xx reduzem o tamanho para `decrease_factor` do lote observado (até
+    `min_size`). Um 413 também reduz o limite de bytes. 429 fica com o rate limiter.
+    """
+
+    def __init__(
+        self,
+        size: int = 50,
+        min_size: int = 1,
+        max_size: int = 500,
+        max_bytes: int = 1_048_576,
+        target_seconds: float = 10.0,
+        increase_step: int = 5,
+        decrease_factor: float = 0.5,
+        concurrency: int = 2,
+    ) -> None:
+        self.min_size = max(1, int(min_size))
+        self.max_size = max(self.min_size, int(max_size))
+        self.size = min(self.max_size, max(self.min_size, int(size)))
+        self.max_bytes = max(1024, int(max_bytes))
+        self.target_seconds = max(0.1, float(target_seconds))
+        self.increase_step = max(1, int(increase_step))
+        self.decrease_factor = min(max(float(decrease_factor), 0.05), 0.95)
+        self.concurrency = max(1, int(concurrency))
+        self._increases = 0
+        self._decreases = 0
+        self._lock = threading.Lock()
+
+    def split(self, sizes: Sequence[int]) -> List[Tuple[int, int]]:
+        """Intervalos [início, fim) respeitando o tamanho atual e `max_bytes`.
+
+        `sizes` são os bytes serializados de cada item; um item maior que
+        `max_bytes` vai sozinho no próprio lote.
+        """
+        with self._lock:
+            limit, max_bytes = self.size, self.max_bytes
+        ranges: List[Tuple[int, int]] = []
+        start, used = 0, 2  # colchetes da lista JSON
+        for idx, nbytes in enumerate(sizes):
+            extra = nbytes + (1 if idx > start else 0)
+            if idx > start and (idx - start >= limit or used + extra > max_bytes):
+                ranges.append((start, idx))
+                start, used, extra = idx, 2, nbytes
+            used += extra
+        if start < len(sizes):
+            ranges.append((start, len(sizes)))
+        return ranges
+
+    def observe(self, count: int, nbytes: int, status_code: Optional[int], elapsed: float) -> None:
+        """Ajusta o tamanho a partir do resultado de um lote enviado."""
+        with self._lock:
+            if status_code is not None and 200 <= status_code < 300:
+                if elapsed > self.target_seconds:
+                    self._decrease(count)
+                elif count >= self.size:
+                    # só cresce quando o tamanho atual foi de fato o limite do lote
+                    self.size = min(self.max_size, self.size + self.increase_step)
+                    self._increases += 1
+                return
+            if status_code is None or status_code in (408, 413) or status_code >= 500:
+                self._decrease(count)
+                if status_code == 413 and nbytes > 0:
+                    self.max_bytes = max(1024, min(self.max_bytes, int(nbytes * self.decrease_factor)))
+
+    def _decrease(self, count: int) -> None:
+        # baseado no lote observado: falhas simultâneas de lotes iguais reduzem uma vez só
+        target = max(self.min_size, int(max(1, count) * self.decrease_factor))
+        if target < self.size:
+            self.size = target
+            self._decreases += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "max_bytes": self.max_bytes,
+                "concurrency": self.concurrency,
+                "increases": self._increases,
+                "decreases": self._decreases,
+            }
+
+
+_CHUNKERS: Dict[str, AdaptiveChunker] = {}
+_CHUNKERS_LOCK = threading.Lock()
+
+
+def get_chunker(name: str = "simpliroute") -> AdaptiveChunker:
+    """Retorna o chunker compartilhado do processo para `name`.
+
+    Configurável via `<NAME>_CHUNK_SIZE`, `_MIN`, `_MAX`, `_MAX_BYTES`,
+    `_TARGET_SECONDS`, `_INCREASE` e `_CONCURRENCY`.
+    """
+    with _CHUNKERS_LOCK:
+        chunker = _CHUNKERS.get(name)
+        if chunker is None:
+            prefix = f"{name.upper()}_CHUNK"
+            chunker = AdaptiveChunker(
+                size=int(env_float(f"{prefix}_SIZE", 50)),
+                min_size=int(env_float(f"{prefix}_MIN", 1)),
+                max_size=int(env_float(f"{prefix}_MAX", 500)),
+                max_bytes=int(env_float(f"{prefix}_MAX_BYTES", 1_048_576)),
+                target_seconds=env_float(f"{prefix}_TARGET_SECONDS", 10.0),
+                increase_step=int(env_float(f"{prefix}_INCREASE", 5)),
+                concurrency=int(env_float(f"{prefix}_CONCURRENCY", 2)),
+            )
+            _CHUNKERS[name] = chunker
+        return chunker
+
+
+def fetch_slice_size() -> int:
+    """Registros por fatia lida do Oracle (`SIMPLIROUTE_FETCH_SLICE_RECORDS`, default 2000)."""
+    return max(1, env_int("SIMPLIROUTE_FETCH_SLICE_RECORDS", 2000))
+
+
+def iter_slices(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Consome `items` em listas de até `size` elementos, sem materializar o resto."""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, max(1, size)))
+        if not chunk:
+            return
+        yield chunk
@@ -5,6 +5,22 @@ import yaml
 from dotenv import load_dotenv
 
 
+def env_int(name: str, default: int) -> int:
+    """Inteiro lido do ambiente; valor ausente ou inválido volta para `default`."""
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """Float lido do ambiente; valor ausente ou inválido volta para `default`."""
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
 def _load_yaml_config(path: str) -> Dict[str, Any]:
     if not os.path.exists(path):
         # Config mínima padrão caso o arquivo não exista
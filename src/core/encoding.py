@@ -1,10 +1,14 @@
 import unicodedata
-import json
-from typing import Any
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from src.core.json_backend import dumps_compact_bytes
 
 
 def _norm_str(s: Any) -> Any:
     if isinstance(s, str):
+        if s.isascii():
+            return s
         try:
             return unicodedata.normalize("NFC", s)
         except Exception:
@@ -21,7 +25,175 @@ def normalize_obj(obj: Any) -> Any:
     return _norm_str(obj)
 
 
-def dumps_utf8(obj: Any) -> bytes:
-    """Return UTF-8 bytes of JSON representation with normalized strings."""
-    norm = normalize_obj(obj)
-    return json.dumps(norm, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+@dataclass(frozen=True)
+class PruneRule:
+    """Campos permitidos de um objeto JSON, aplicados durante a serialização.
+
+    - `fields`: chaves mantidas, na ordem de saída (`None` mantém todas).
+    - `source_order`: mantém a ordem do objeto de origem em vez da ordem de `fields`.
+    - `skip_none`: omite chaves com valor `None`.
+    - `children`: regra aplicada ao valor da chave (dict, ou cada dict de uma lista;
+      itens de lista que não são dict são descartados).
+    - `drop_empty`: como filha, omite a chave quando nada sobra após a poda.
+    """
+
+    fields: Optional[Tuple[str, ...]] = None
+    source_order: bool = False
+    skip_none: bool = True
+    children: Mapping[str, "PruneRule"] = field(default_factory=dict)
+    drop_empty: bool = False
+    field_set: FrozenSet[str] = field(init=False, repr=False, compare=False)
+    plan: Tuple[Tuple[str, Optional["PruneRule"]], ...] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # compilados uma vez: conjunto para pertinência e (campo, regra filha) na ordem de saída
+        object.__setattr__(self, "field_set", frozenset(self.fields or ()))
+        object.__setattr__(self, "plan", tuple((name, self.children.get(name)) for name in self.fields or ()))
+
+
+# Os helpers abaixo devolvem o próprio objeto de entrada quando nada precisa ser
+# removido ou normalizado; só há cópia a partir do primeiro nível alterado.
+
+
+_SCALARS = (int, float, bool, type(None))
+_DROP = object()
+
+
+def _prune_value(value: Any) -> Any:
+    kind = type(value)
+    if kind is str:
+        return value if value.isascii() else _norm_str(value)
+    if kind in _SCALARS:
+        return value
+    if isinstance(value, str):
+        return _norm_str(value)
+    if isinstance(value, dict):
+        return _prune_plain_dict(value)
+    if isinstance(value, list):
+        return _prune_list(value)
+    if isinstance(value, tuple):
+        return [_prune_value(item) for item in value]
+    return value
+
+
+def _prune_plain_dict(obj: Dict[Any, Any]) -> Dict[Any, Any]:
+    out = None
+    for key, value in obj.items():
+        new = _prune_value(value)
+        if new is not value:
+            if out is None:
+                out = dict(obj)
+            out[key] = new
+    return obj if out is None else out
+
+
+def _prune_list(value: List[Any]) -> List[Any]:
+    out = None
+    for idx, item in enumerate(value):
+        new = _prune_value(item)
+        if new is not item:
+            if out is None:
+                out = list(value)
+            out[idx] = new
+    return value if out is None else out
+
+
+def _prune_child(value: Any, rule: PruneRule) -> Any:
+    if isinstance(value, dict):
+        return _prune_dict(value, rule)
+    pruned = []
+    changed = False
+    for item in value:
+        if not isinstance(item, dict):
+            changed = True
+            continue
+        entry = _prune_dict(item, rule)
+        if not entry and rule.drop_empty:
+            changed = True
+            continue
+        changed = changed or entry is not item
+        pruned.append(entry)
+    return pruned if changed else value
+
+
+def _prune_field(value: Any, child: Optional[PruneRule]) -> Any:
+    """Valor podado de um campo; `_DROP` quando o campo deve ser omitido."""
+    if child is not None and isinstance(value, (dict, list)):
+        pruned = _prune_child(value, child)
+        if not pruned and child.drop_empty:
+            return _DROP
+        return pruned
+    kind = type(value)
+    if kind is str and value.isascii():
+        return value
+    return _prune_value(value)
+
+
+def _prune_dict(obj: Mapping[Any, Any], rule: Optional[PruneRule]) -> Dict[Any, Any]:
+    if rule is None:
+        return _prune_plain_dict(obj)
+
+    out: Dict[Any, Any] = {}
+    changed = False
+    skip_none = rule.skip_none
+    if rule.fields is not None and not rule.source_order:
+        # caminho principal (visitas/itens): percorre o plano de campos compilado na regra
+        for key, child in rule.plan:
+            if key not in obj:
+                continue
+            value = obj[key]
+            if value is None and skip_none:
+                changed = True
+                continue
+            pruned = _prune_field(value, child)
+            if pruned is _DROP:
+                changed = True
+                continue
+            if pruned is not value:
+                changed = True
+            out[key] = pruned
+        same_keys = not changed and len(out) == len(obj) and list(out) == list(obj)
+    else:
+        field_set = rule.field_set if rule.fields is not None else None
+        for key, value in obj.items():
+            if field_set is not None and key not in field_set:
+                changed = True
+                continue
+            if value is None and skip_none:
+                changed = True
+                continue
+            pruned = _prune_field(value, rule.children.get(key))
+            if pruned is _DROP:
+                changed = True
+                continue
+            if pruned is not value:
+                changed = True
+            out[key] = pruned
+        same_keys = not changed
+    # mesmas chaves, na mesma ordem e com os mesmos valores: nada foi podado
+    return obj if same_keys else out  # type: ignore[return-value]
+
+
+def prune_normalize(obj: Any, rule: Optional[PruneRule] = None) -> Any:
+    """`obj` podado por `rule` (no objeto ou em cada dict de uma lista) e com strings em NFC.
+
+    Partes que já estão conformes são devolvidas sem cópia; a entrada nunca é alterada.
+    """
+    if rule is not None and isinstance(obj, dict):
+        return _prune_dict(obj, rule)
+    if rule is not None and isinstance(obj, list):
+        return [_prune_dict(item, rule) if isinstance(item, dict) else _prune_value(item) for item in obj]
+    return _prune_value(obj)
+
+
+def dumps_utf8(obj: Any, rule: Optional[PruneRule] = None) -> bytes:
+    """Return UTF-8 bytes of JSON representation with normalized strings.
+
+    Poda (`rule`) e normalização NFC acontecem em uma única passada em Python
+    (strings ASCII não são normalizadas); a serialização fica com o backend de
+    `src.core.json_backend` (orjson quando instalado).
+    """
+    return dumps_compact_bytes(prune_normalize(obj, rule))
+
+
+__all__ = ["PruneRule", "dumps_utf8", "normalize_obj", "prune_normalize"]
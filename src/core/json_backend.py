@@ -0,0 +1,70 @@
+"""Serialização JSON com backend plugável: orjson quando instalado, stdlib caso contrário.
+
+`SIMPLIROUTE_JSON_BACKEND=json` força a stdlib. Com orjson a saída compacta não
+tem espaços após `,`/`:` (continua JSON válido, uma linha por registro); com
+`indent=True` a saída é idêntica a `json.dumps(..., ensure_ascii=False, indent=2)`.
+Valores que o orjson não serializa (ex.: inteiros acima de 64 bits) caem na stdlib.
+"""
+
+import json
+import os
+from typing import Any, Callable, Optional
+
+try:  # opcional
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - depende do ambiente
+    orjson = None  # type: ignore
+
+
+def _select_backend() -> str:
+    requested = os.getenv("SIMPLIROUTE_JSON_BACKEND", "auto").strip().lower()
+    if requested in ("json", "stdlib") or orjson is None:
+        return "json"
+    return "orjson"
+
+
+BACKEND = _select_backend()
+
+if orjson is not None:
+    # datetime/date passam pelo `default` para manter o mesmo texto da stdlib (ex.: default=str)
+    _ORJSON_OPTS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    _ORJSON_INDENT_OPTS = _ORJSON_OPTS | orjson.OPT_INDENT_2
+else:  # pragma: no cover - depende do ambiente
+    _ORJSON_OPTS = _ORJSON_INDENT_OPTS = 0
+
+
+def dumps_bytes(obj: Any, *, indent: bool = False, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """Serializa `obj` em JSON UTF-8 (sem escapes ASCII)."""
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_INDENT_OPTS if indent else _ORJSON_OPTS)
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj, indent, default).encode("utf-8")
+
+
+def dumps(obj: Any, *, indent: bool = False, default: Optional[Callable[[Any], Any]] = None) -> str:
+    """Como `dumps_bytes`, retornando `str`."""
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_INDENT_OPTS if indent else _ORJSON_OPTS).decode("utf-8")
+        except TypeError:
+            pass
+    return _stdlib_dumps(obj, indent, default)
+
+
+def dumps_compact_bytes(obj: Any) -> bytes:
+    """JSON sem espaços (separadores `,`/`:`), como usado no corpo das requisições."""
+    if BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _stdlib_dumps(obj: Any, indent: bool, default: Optional[Callable[[Any], Any]]) -> str:
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None, default=default)
+
+
+__all__ = ["BACKEND", "dumps", "dumps_bytes", "dumps_compact_bytes"]
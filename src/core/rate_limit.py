@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Mapping, Optional
+
+from src.core.config import env_float
+
+
+def parse_retry_after(value: Any) -> Optional[float]:
+    """Converte o header `Retry-After` (segundos ou data HTTP) em segundos de espera."""
+    if value in (None, ""):
+        return None
+    text = str(value).strip()
+    try:
+        return max(0.0, float(text))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(text)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """Rate limiter token bucket (requisições/s + burst) seguro para threads e asyncio.
+
+    O ritmo é adaptativo (AIMD): cada resposta bem-sucedida aumenta a taxa em
+    `increase_step` até `max_rate`; um 429/`Retry-After` reduz a taxa pela metade
+    (até `min_rate`) e pausa todos os chamadores pelo tempo indicado pela API.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float = 1.0,
+        min_rate: Optional[float] = None,
+        max_rate: Optional[float] = None,
+        increase_step: float = 0.05,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.rate = max(0.001, float(rate))
+        self.burst = max(1.0, float(burst))
+        self.min_rate = max(0.001, float(min_rate if min_rate is not None else self.rate / 10))
+        self.max_rate = max(self.rate, float(max_rate if max_rate is not None else self.rate))
+        self.increase_step = float(increase_step)
+        self.decrease_factor = min(max(float(decrease_factor), 0.05), 1.0)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._throttled = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        # `_updated` pode estar no futuro enquanto houver pausa por Retry-After
+        if now > self._updated:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def _reserve(self) -> float:
+        """Consome um token e retorna quantos segundos o chamador deve aguardar."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = max(0.0, self._updated - now)
+            if self._tokens < 0:
+                wait += -self._tokens / self.rate
+            return wait
+
+    def acquire(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttled(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._throttled += 1
+            # vários 429 simultâneos do mesmo pico contam como uma única redução
+            if now - self._last_decrease >= 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                self._last_decrease = now
+            pause = retry_after if retry_after is not None else 1.0 / self.rate
+            resume_at = now + pause
+            if resume_at > self._updated:
+                self._updated = resume_at
+                self._tokens = min(self._tokens, 1.0)
+
+    def observe(self, status_code: Optional[int], headers: Optional[Mapping[str, str]] = None) -> None:
+        """Ajusta o ritmo a partir da resposta HTTP recebida."""
+        if status_code is None:
+            return
+        retry_after = parse_retry_after(headers.get("Retry-After")) if headers else None
+        if status_code == 429 or (status_code == 503 and retry_after is not None):
+            self.on_throttled(retry_after)
+        elif 200 <= status_code < 300:
+            self.on_success()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rate_per_sec": round(self.rate, 3),
+                "burst": self.burst,
+                "tokens": round(self._tokens, 3),
+                "throttled": self._throttled,
+            }
+
+
+_LIMITERS: Dict[str, TokenBucket] = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_rate_limiter(name: str = "simpliroute") -> TokenBucket:
+    """Retorna o limiter compartilhado do processo para `name`.
+
+    Configurável via `<NAME>_RATE_LIMIT_RPS`, `_BURST`, `_MIN_RPS` e `_MAX_RPS`.
+    """
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(name)
+        if limiter is None:
+            prefix = f"{name.upper()}_RATE_LIMIT"
+            rate = env_float(f"{prefix}_RPS", 2.0)
+            limiter = TokenBucket(
+                rate=rate,
+                burst=env_float(f"{prefix}_BURST", 5.0),
+                min_rate=env_float(f"{prefix}_MIN_RPS", 0.2),
+                max_rate=env_float(f"{prefix}_MAX_RPS", max(rate, 10.0)),
+            )
+            _LIMITERS[name] = limiter
+        return limiter
@@ -1,25 +1,29 @@
 from __future__ import annotations
 
 import asyncio
-import json
 import logging
 import math
 import os
 import time
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, closing
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Sequence
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
 
-from fastapi import BackgroundTasks, FastAPI, Request
+from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 
-from src.core.config import load_config
+from src.adapters.queue_sqlite import SQLiteQueue
+from src.adapters.send_ledger import SendLedger, open_send_ledger
+from src.core.batching import fetch_slice_size, get_chunker, iter_slices
+from src.core.config import env_int, load_config
+from src.core.json_backend import dumps as json_dumps, dumps_bytes
 
-from .client import post_simpliroute
-from .mapper import build_visit_payload
-from .oracle_source import fetch_grouped_records, resolve_where_clause
-from .oracle_status_sync import persist_status_updates
+from .client import close_http_clients, get_http_client, post_simpliroute, simpliroute_base_url
+from .mapper import build_visit_payloads
+from .oracle_source import ViewFilter, close_pool, config_projections, iter_view_records, pool_stats
+from .oracle_status_sync import identifier_cache_stats, persist_status_updates, remember_sent_identifiers
+from .watermark import PollProgress, WatermarkStore, WatermarkUpdate, plan_view_query, trim_page, watermark_column
 
 LOGGER = logging.getLogger("simpliroute.service")
 if not LOGGER.handlers:
@@ -27,6 +31,7 @@ if not LOGGER.handlers:
 
 SERVICE_LOG = Path("data/work/service_events.log")
 SERVICE_LOG.parent.mkdir(parents=True, exist_ok=True)
+WEBHOOK_ARCHIVE_DIR = Path("data/work/webhooks")
 
 
 CONFIG_CACHE: Dict[str, Any] = {}
@@ -116,26 +121,84 @@ def _resolve_views(candidate: Sequence[str] | None) -> List[str | None]:
     return [None]
 
 
-def _collect_records(limit: int | None, where: str | None, view_names: Sequence[str] | None) -> List[Dict[str, Any]]:
+@dataclass
+class _ViewPoll:
+    """Consulta de uma view no ciclo e o progresso usado para avançar o high-water mark."""
+
+    view: str | None
+    limit: int | None
+    view_filter: ViewFilter | None = None
+    current: Any = None
+    full: bool = False
+    progress: PollProgress | None = None
+    records: int = 0
+
+    def watermark_update(self) -> WatermarkUpdate | None:
+        if self.progress is None:
+            return None
+        return self.progress.update(self.view, self.current, self.full)
+
+
+def _plan_views(
+    limit: int | None,
+    view_names: Sequence[str] | None,
+    watermarks: WatermarkStore | None = None,
+) -> List[_ViewPoll]:
+    """Uma consulta por view, com o limite dividido entre elas e o filtro de high-water mark."""
     targets = _resolve_views(view_names)
-    rows: List[Dict[str, Any]] = []
     per_view_limit: int | None = None
-    limit_split_across_views = False
     if limit and limit > 0:
         per_view_limit = max(1, math.ceil(limit / len(targets)))
-        limit_split_across_views = len(targets) > 1
-    for target_view in targets:
-        effective_where = resolve_where_clause(target_view, where)
-        batch = fetch_grouped_records(limit=per_view_limit, where_clause=effective_where, view_name=target_view)
-        rows.extend(batch)
-    if not limit_split_across_views and limit and limit > 0 and len(rows) > limit:
-        rows = rows[:limit]
-    return rows
+    cfg = _load_cached_config() if watermarks is not None else {}
+    polls: List[_ViewPoll] = []
+    for view in targets:
+        poll = _ViewPoll(view=view, limit=per_view_limit)
+        column = watermark_column(view, cfg) if watermarks is not None and view else None
+        if column:
+            poll.view_filter, poll.current, poll.full = plan_view_query(
+                watermarks, view, column, paged=per_view_limit is not None
+            )
+            poll.progress = PollProgress(column)
+        polls.append(poll)
+    return polls
+
+
+def _view_slices(poll: _ViewPoll, where: str | None) -> Iterator[List[Dict[str, Any]]]:
+    """Registros da view em fatias de `SIMPLIROUTE_FETCH_SLICE_RECORDS`.
+
+    Sem limite a view vem em streaming; a página limitada de uma view com high-water
+    mark (no máximo `limit` linhas) é lida inteira para descartar o último valor
+    incompleto (`trim_page`) antes de ser fatiada.
+    """
+    records = iter_view_records(
+        poll.view,
+        limit=poll.limit,
+        where_clause=where,
+        view_filter=poll.view_filter,
+        projections=config_projections(_load_cached_config()),
+    )
+    progress = poll.progress
+    with closing(records):
+        if progress is not None and poll.limit:
+            page = list(records)
+            fetched_rows = sum(len(record.get("items") or ()) for record in page)
+            progress.page_full = fetched_rows >= poll.limit
+            page, _ = trim_page(page, progress.column, progress.page_full)
+            progress.track(page)
+            progress.complete = True
+            yield from iter_slices(page, fetch_slice_size())
+            return
+        for batch in iter_slices(records, fetch_slice_size()):
+            if progress is not None:
+                progress.track(batch)
+            yield batch
+        if progress is not None:
+            progress.complete = True
 
 
 def _append_service_log(entry: Dict[str, Any]) -> None:
     try:
-        entry_line = json.dumps(entry, ensure_ascii=False)
+        entry_line = json_dumps(entry)
     except Exception:
         entry_line = str(entry)
     with SERVICE_LOG.open("a", encoding="utf-8") as fp:
@@ -148,6 +211,8 @@ class PollingSettings:
     limit: int | None
     where_clause: str | None
     view_names: Sequence[str] | None
+    watermarks: WatermarkStore | None = None
+    ledger: SendLedger | None = None
 
 
 def _load_polling_settings() -> PollingSettings:
@@ -173,48 +238,153 @@ def _load_polling_settings() -> PollingSettings:
     env_views = _env_default_views()
     if env_views:
         explicit_views = env_views
-    return PollingSettings(interval_minutes=interval, limit=limit, where_clause=where, view_names=explicit_views)
+    return PollingSettings(
+        interval_minutes=interval,
+        limit=limit,
+        where_clause=where,
+        view_names=explicit_views,
+        watermarks=WatermarkStore(),
+        ledger=open_send_ledger(),
+    )
 
 
 async def _run_cycle(settings: PollingSettings) -> None:
     try:
-        records = await asyncio.to_thread(_collect_records, settings.limit, settings.where_clause, settings.view_names)
+        polls = await asyncio.to_thread(_plan_views, settings.limit, settings.view_names, settings.watermarks)
     except Exception as exc:
         LOGGER.exception("Erro ao coletar registros Oracle: %s", exc)
         _append_service_log({"stage": "collect", "status": "failure", "error": str(exc)})
         return
 
-    if not records:
+    # views em paralelo, cada uma lida e enviada fatia a fatia
+    totals = await asyncio.gather(*(_poll_view(settings, poll) for poll in polls))
+    if not sum(totals):
         LOGGER.info("Nenhum registro retornado pelas views configuradas.")
         _append_service_log({"stage": "collect", "status": "empty"})
-        return
+    # o high-water mark avança até o primeiro registro que ainda precisa ser reenviado
+    updates = [update for update in (poll.watermark_update() for poll in polls) if update is not None]
+    await _commit_watermarks(settings, updates)
+
 
-    payloads = [build_visit_payload(record) for record in records]
+async def _poll_view(settings: PollingSettings, poll: _ViewPoll) -> int:
+    """Lê a view em fatias e envia cada uma antes de buscar a próxima."""
+    slices = _view_slices(poll, settings.where_clause)
+    try:
+        while True:
+            try:
+                batch = await asyncio.to_thread(next, slices, None)
+            except Exception as exc:
+                LOGGER.exception("Erro ao coletar registros Oracle da view %s: %s", poll.view, exc)
+                _append_service_log({"stage": "collect", "status": "failure", "view": poll.view, "error": str(exc)})
+                if poll.progress is not None:
+                    poll.progress.complete = False
+                break
+            if batch is None:
+                break
+            poll.records += len(batch)
+            settled = await _send_records(settings, batch)
+            if settled is None:
+                # SimpliRoute inacessível: o resto da view fica para o próximo ciclo
+                break
+            if poll.progress is not None:
+                poll.progress.settle(settled)
+    finally:
+        await asyncio.to_thread(slices.close)
+    if poll.progress is not None:
+        LOGGER.info(
+            "View %s: %s (%s > %s), %s registro(s)",
+            poll.view,
+            "reconciliação completa" if poll.full else "incremental",
+            poll.progress.column,
+            poll.current,
+            poll.records,
+        )
+    return poll.records
+
+
+async def _send_records(settings: PollingSettings, records: List[Dict[str, Any]]) -> List[bool] | None:
+    """Monta, filtra pelo ledger e envia uma fatia de registros.
+
+    Retorna, por registro, se nada ficou pendente de reenvio (aceito, recusado pela
+    validação ou já presente no ledger); `None` quando o SimpliRoute não respondeu.
+    """
+    payloads = await asyncio.to_thread(build_visit_payloads, records)
+    settled = [False] * len(records)
+    pending = list(range(len(records)))
+    if settings.ledger is not None:
+        sent = await asyncio.to_thread(settings.ledger.sent_mask, payloads)
+        skipped = sum(sent)
+        if skipped:
+            pending = [idx for idx in pending if not sent[idx]]
+            for idx, done in enumerate(sent):
+                settled[idx] = done
+            LOGGER.info("%s visita(s) já enviada(s) ignorada(s) pelo ledger de envios", skipped)
+            _append_service_log({"stage": "ledger", "status": "skipped", "skipped": skipped})
+        if not pending:
+            return settled
+    records = [records[idx] for idx in pending]
+    payloads = [payloads[idx] for idx in pending]
     LOGGER.info("Enviando %s payload(s) para o SimpliRoute", len(payloads))
 
     try:
-        response = await post_simpliroute(payloads)
+        result = await post_simpliroute(payloads)
     except Exception as exc:
         LOGGER.exception("Falha ao enviar payloads ao SimpliRoute: %s", exc)
         _append_service_log({"stage": "http_request", "status": "failure", "error": str(exc), "payload_count": len(payloads)})
-        return
-
-    if response is None:
-        LOGGER.error("Cliente HTTP retornou resposta vazia.")
-        _append_service_log({"stage": "http_request", "status": "failure", "error": "response_none", "payload_count": len(payloads)})
-        return
-
-    body_text = response.text if hasattr(response, "text") else ""
-    LOGGER.info("SimpliRoute respondeu HTTP %s", response.status_code)
+        return None
+
+    accepted = result.accepted
+    if result.status_code is None and not any(accepted):
+        LOGGER.error("SimpliRoute sem resposta: %s", result.error)
+        _append_service_log(
+            {"stage": "http_request", "status": "failure", "error": result.error or "response_none", "payload_count": len(payloads)}
+        )
+        return None
+
+    LOGGER.info("SimpliRoute respondeu HTTP %s", result.status_code)
+    failures = result.failures
+    if failures:
+        LOGGER.warning(
+            "%s de %s visita(s) não aceita(s) pelo SimpliRoute: %s",
+            len(failures),
+            len(payloads),
+            [(outcome.reference, outcome.status_code) for outcome in failures[:20]],
+        )
+    if any(accepted):
+        sent_records = [record for record, done in zip(records, accepted) if done]
+        sent_payloads = [payload for payload, done in zip(payloads, accepted) if done]
+        # os webhooks das visitas recém-enviadas resolvem identificadores sem ir ao Oracle
+        remember_sent_identifiers(sent_records, sent_payloads)
+        if settings.ledger is not None and not result.dry_run:
+            visit_ids = [visit_id for visit_id, done in zip(result.visit_ids, accepted) if done]
+            await asyncio.to_thread(settings.ledger.record, sent_payloads, visit_ids)
+    for idx, outcome in zip(pending, result.outcomes):
+        settled[idx] = outcome.ok or outcome.rejected
     _append_service_log(
         {
             "stage": "http_request",
-            "status": "success" if 200 <= response.status_code < 400 else "failure",
-            "http_status": response.status_code,
+            "status": "success" if result.ok else "failure",
+            "http_status": result.status_code,
             "payload_count": len(payloads),
-            "body_preview": body_text[:400],
+            "accepted_count": sum(accepted),
+            "rejected": [
+                {"reference": outcome.reference, "http_status": outcome.status_code, "error": (outcome.error or "")[:200]}
+                for outcome in failures[:50]
+            ],
+            "chunks": result.chunks,
+            "body_preview": result.text[:400],
         }
     )
+    return settled
+
+
+async def _commit_watermarks(settings: PollingSettings, updates: List[WatermarkUpdate]) -> None:
+    if settings.watermarks is None or not updates:
+        return
+    try:
+        await asyncio.to_thread(settings.watermarks.commit, updates)
+    except Exception as exc:
+        LOGGER.warning("Falha ao gravar o high-water mark do polling: %s", exc)
 
 
 async def polling_task(settings: PollingSettings):
@@ -233,22 +403,153 @@ async def polling_task(settings: PollingSettings):
             break
 
 
+def _webhook_queue_settings() -> tuple[str, int, float, int]:
+    path = os.getenv("SIMPLIROUTE_WEBHOOK_QUEUE_PATH", "data/work/webhook_queue.sqlite3")
+    try:
+        batch_size = max(1, int(os.getenv("SIMPLIROUTE_WEBHOOK_BATCH_SIZE", "200")))
+    except ValueError:
+        batch_size = 200
+    try:
+        poll_seconds = max(0.05, float(os.getenv("SIMPLIROUTE_WEBHOOK_POLL_SECONDS", "1")))
+    except ValueError:
+        poll_seconds = 1.0
+    max_attempts = max(1, env_int("SIMPLIROUTE_WEBHOOK_MAX_ATTEMPTS", 20))
+    return path, batch_size, poll_seconds, max_attempts
+
+
+def _archive_webhook(queue_id: int, item: Dict[str, Any]) -> str:
+    # nome derivado do id da fila: reprocessar o mesmo item sobrescreve o mesmo arquivo
+    received_at = int(item.get("received_at") or time.time())
+    filename = WEBHOOK_ARCHIVE_DIR / f"webhook_{received_at}_{queue_id}.json"
+    WEBHOOK_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    filename.write_bytes(dumps_bytes(item.get("payload"), indent=True))
+    _append_service_log(
+        {
+            "stage": "webhook_received",
+            "filename": str(filename),
+            "timestamp": received_at,
+            "payload_preview": str(item.get("payload"))[:200],
+        }
+    )
+    return str(filename)
+
+
+def _persist_webhooks(queue: SQLiteQueue, claimed: Sequence[Tuple[int, int, Dict[str, Any]]]) -> None:
+    events: List[Dict[str, Any]] = []
+    for _, _, item in claimed:
+        events.extend(_extract_webhook_events(item.get("payload")))
+    if events:
+        rejected: List[Tuple[Dict[str, Any], str]] = []
+        summary = persist_status_updates(events, rejected)
+        LOGGER.info("Webhooks processados: %s payload(s), %s evento(s) — %s", len(claimed), len(events), summary)
+        if rejected:
+            queue.dead_letter(rejected)
+            LOGGER.warning("%s evento(s) recusado(s) pelo Oracle enviados à dead-letter da fila", len(rejected))
+            _append_service_log({"stage": "webhook_persist", "status": "dead_letter", "events": len(rejected)})
+    queue.ack([queue_id for queue_id, _, _ in claimed])
+
+
+def _drain_webhook_batch(queue: SQLiteQueue, batch_size: int, max_attempts: int) -> int:
+    """Processa um micro-lote da fila: arquiva os payloads, grava no Oracle e confirma.
+
+    O payload bruto é arquivado só na primeira tentativa. Se a gravação do lote falhar,
+    os itens são gravados um a um: os que passam são confirmados e os demais voltam no
+    próximo `claim`. Um item que já falhou `max_attempts` vezes vai para a dead-letter
+    da fila em vez de travar a cabeça da fila; eventos recusados linha a linha pelo
+    Oracle também vão para a dead-letter antes do ack.
+    """
+    claimed = queue.claim(batch_size)
+    if not claimed:
+        return 0
+    exhausted = [(queue_id, item) for queue_id, attempts, item in claimed if attempts > max_attempts]
+    if exhausted:
+        queue.bury((queue_id, item, f"excedeu {max_attempts} tentativa(s)") for queue_id, item in exhausted)
+        LOGGER.warning("%s webhook(s) enviados à dead-letter após %s tentativa(s)", len(exhausted), max_attempts)
+        _append_service_log({"stage": "webhook_persist", "status": "dead_letter", "payloads": len(exhausted)})
+    pending = [entry for entry in claimed if entry[1] <= max_attempts]
+    for queue_id, attempts, item in pending:
+        if attempts == 1:
+            _archive_webhook(queue_id, item)
+    if not pending:
+        return len(claimed)
+    try:
+        _persist_webhooks(queue, pending)
+        return len(claimed)
+    except Exception as exc:
+        if len(pending) == 1:
+            raise
+        LOGGER.warning("Falha ao gravar lote de %s webhook(s) (%s); gravando um a um", len(pending), exc)
+    failure: Exception | None = None
+    persisted = 0
+    for entry in pending:
+        try:
+            _persist_webhooks(queue, [entry])
+            persisted += 1
+        except Exception as exc:
+            failure = exc
+            LOGGER.warning("Webhook %s (tentativa %s) falhou: %s", entry[0], entry[1], exc)
+    if failure is not None and not persisted:
+        # nenhum item passou (ex.: Oracle fora do ar): o worker aplica o backoff
+        raise failure
+    return len(exhausted) + persisted
+
+
+async def webhook_worker(
+    queue: SQLiteQueue, batch_size: int, poll_seconds: float, max_attempts: int, wakeup: asyncio.Event
+) -> None:
+    backoff = poll_seconds
+    while True:
+        try:
+            processed = await asyncio.to_thread(_drain_webhook_batch, queue, batch_size, max_attempts)
+            backoff = poll_seconds
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            # os itens continuam na fila e serão reprocessados
+            LOGGER.exception("Falha ao processar fila de webhooks: %s", exc)
+            _append_service_log({"stage": "webhook_persist", "status": "failure", "error": str(exc)})
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+            continue
+        if processed >= batch_size:
+            continue
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # abre o pool HTTP antes do primeiro ciclo para reaproveitar conexões quentes
+    get_http_client(simpliroute_base_url())
     settings = _load_polling_settings()
     poll_task = asyncio.create_task(polling_task(settings))
     app.state._polling_task = poll_task
     app.state.polling_settings = settings
+    queue_path, batch_size, poll_seconds, max_attempts = _webhook_queue_settings()
+    app.state.webhook_queue = await asyncio.to_thread(SQLiteQueue, queue_path)
+    app.state.webhook_wakeup = asyncio.Event()
+    app.state._webhook_task = asyncio.create_task(
+        webhook_worker(app.state.webhook_queue, batch_size, poll_seconds, max_attempts, app.state.webhook_wakeup)
+    )
     try:
         yield
     finally:
-        task = getattr(app.state, "_polling_task", None)
-        if task:
-            task.cancel()
-            try:
-                await task
-            except Exception:
-                pass
+        for attr in ("_polling_task", "_webhook_task"):
+            task = getattr(app.state, attr, None)
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        app.state.webhook_queue.close()
+        if settings.ledger is not None:
+            settings.ledger.close()
+        await close_http_clients()
+        await asyncio.to_thread(close_pool)
 
 
 app = FastAPI(title="SimpliRoute Integration Service", lifespan=lifespan)
@@ -273,6 +574,24 @@ async def live() -> JSONResponse:
     return JSONResponse({"status": "alive"})
 
 
+def _webhook_queue_stats() -> Dict[str, Any]:
+    queue = getattr(app.state, "webhook_queue", None)
+    if queue is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "pending": len(queue),
+        "oldest_age_seconds": queue.oldest_age_seconds(),
+        "dead_letter": queue.dead_letter_count(),
+    }
+
+
+def _polling_watermarks() -> Dict[str, Any]:
+    settings = getattr(app.state, "polling_settings", None)
+    store = getattr(settings, "watermarks", None)
+    return store.snapshot() if store is not None else {}
+
+
 @app.get("/health/ready")
 async def ready() -> JSONResponse:
     polling_ok = getattr(app.state, "_polling_task", None) is not None
@@ -285,6 +604,11 @@ async def ready() -> JSONResponse:
             "polling_task": polling_ok,
             "oracle_ready": oracle_ready,
             "has_token": has_token,
+            "oracle_pool": pool_stats(),
+            "identifier_cache": identifier_cache_stats(),
+            "polling_watermarks": _polling_watermarks(),
+            "send_chunker": get_chunker("simpliroute").stats(),
+            "webhook_queue": await asyncio.to_thread(_webhook_queue_stats),
         }
     )
 
@@ -305,7 +629,7 @@ def _extract_webhook_events(body: Any) -> List[Dict[str, Any]]:
 
 
 @app.post("/webhook/simpliroute")
-async def webhook_simpliroute(request: Request, background: BackgroundTasks):
+async def webhook_simpliroute(request: Request):
     try:
         payload = await request.json()
         LOGGER.info(f"Payload recebido: {payload}")
@@ -319,28 +643,15 @@ async def webhook_simpliroute(request: Request, background: BackgroundTasks):
         if token_val != expected:
             return JSONResponse({"error": "unauthorized webhook"}, status_code=401)
 
-    os.makedirs("data/work/webhooks", exist_ok=True)
-    filename = f"data/work/webhooks/webhook_{int(time.time())}.json"
+    # arquivamento e gravação no Oracle ficam com o webhook_worker
     try:
-        with open(filename, "w", encoding="utf-8") as handler:
-            json.dump(payload, handler, ensure_ascii=False, indent=2)
-        # Log de recebimento de webhook
-        with open("data/work/service_events.log", "a", encoding="utf-8") as log_fp:
-            log_fp.write(json.dumps({
-                "stage": "webhook_received",
-                "filename": filename,
-                "timestamp": int(time.time()),
-                "payload_preview": str(payload)[:200]
-            }, ensure_ascii=False) + "\n")
+        await asyncio.to_thread(app.state.webhook_queue.enqueue, {"received_at": int(time.time()), "payload": payload})
     except Exception as exc:
-        LOGGER.error("Falha ao persistir payload do webhook: %s", exc)
+        LOGGER.error("Falha ao enfileirar payload do webhook: %s", exc)
         return JSONResponse({"error": "io_failure"}, status_code=500)
+    app.state.webhook_wakeup.set()
 
-    events = _extract_webhook_events(payload)
-    if events:
-        background.add_task(persist_status_updates, events)
-
-    return JSONResponse({"status": "received", "logged": filename})
+    return JSONResponse({"status": "accepted", "events": len(_extract_webhook_events(payload))}, status_code=202)
 
 
 if __name__ == "__main__":
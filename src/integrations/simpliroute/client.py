@@ -1,8 +1,50 @@
+import asyncio
+import json
+import logging
 import os
-from typing import Any, Dict, Iterable, List, Optional
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
 import httpx
-from src.core.encoding import dumps_utf8
+from src.core.batching import get_chunker
+from src.core.config import env_int
+from src.core.encoding import PruneRule, dumps_utf8
+from src.core.rate_limit import get_rate_limiter, parse_retry_after
+
+LOGGER = logging.getLogger("simpliroute.client")
+
+
+# campos aceitos pelo SimpliRoute; o restante do payload não é enviado
+ALLOWED_VISIT_FIELDS = (
+    "order","tracking_id","status","title","address","latitude","longitude",
+    "load","load_2","load_3","window_start","window_end","window_start_2","window_end_2",
+    "duration","contact_name","contact_phone","contact_email","reference","notes",
+    "skills_required","skills_optional","tags","planned_date","programmed_date","route",
+    "estimated_time_arrival","estimated_time_departure","checkin_time","checkout_time",
+    "checkout_latitude","checkout_longitude","checkout_comment","checkout_observation",
+    "signature","pictures","created","modified","eta_predicted","eta_current",
+    "priority","has_alert","priority_level","extra_field_values","geocode_alert",
+    "visit_type","current_eta","fleet","seller","properties","items","on_its_way",
+)
+
+ALLOWED_ITEM_FIELDS = (
+    "id","title","status","load","load_2","load_3","reference","visit",
+    "notes","quantity_planned","quantity_delivered",
+)
+
+# preserva TIPOVISITA, além das outras chaves de properties
+ALLOWED_PROPERTY_FIELDS = ("PROFISSIONAL", "ESPECIALIDADE", "PERIODICIDADE", "TIPOVISITA")
+
+VISIT_PRUNE_RULE = PruneRule(
+    fields=ALLOWED_VISIT_FIELDS,
+    children={
+        "properties": PruneRule(fields=ALLOWED_PROPERTY_FIELDS, source_order=True, skip_none=False, drop_empty=True),
+        "items": PruneRule(fields=ALLOWED_ITEM_FIELDS, drop_empty=True),
+    },
+)
 
 
 def _get_token(names: Iterable[str]) -> str:
@@ -13,15 +55,162 @@ def _get_token(names: Iterable[str]) -> str:
     return ""
 
 
-async def post_simpliroute(route_payload: Dict[str, Any]) -> Optional[httpx.Response]:
+# Um AsyncClient por base URL, reaproveitando conexões keep-alive entre chamadas.
+# O client fica preso ao event loop em que foi criado (o CLI usa um loop por comando).
+_HTTP_CLIENTS: Dict[str, Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+_HTTP_CLIENTS_LOCK = threading.Lock()
+
+
+def _http2_enabled() -> bool:
+    if os.getenv("SIMPLIROUTE_HTTP2", "0") != "1":
+        return False
+    try:
+        import h2  # noqa: F401  # type: ignore
+    except ImportError:
+        return False
+    return True
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=env_int("SIMPLIROUTE_HTTP_MAX_CONNECTIONS", 20),
+        max_keepalive_connections=env_int("SIMPLIROUTE_HTTP_MAX_KEEPALIVE", 10),
+        keepalive_expiry=float(env_int("SIMPLIROUTE_HTTP_KEEPALIVE_EXPIRY", 60)),
+    )
+    timeout = httpx.Timeout(float(env_int("SIMPLIROUTE_HTTP_TIMEOUT", 30)), connect=10.0)
+    return httpx.AsyncClient(timeout=timeout, limits=limits, http2=_http2_enabled())
+
+
+def get_http_client(base_url: str) -> httpx.AsyncClient:
+    """Retorna o AsyncClient compartilhado para `base_url` no event loop corrente."""
+    loop = asyncio.get_running_loop()
+    key = base_url.rstrip("/")
+    with _HTTP_CLIENTS_LOCK:
+        entry = _HTTP_CLIENTS.get(key)
+        if entry is not None:
+            owner_loop, client = entry
+            if owner_loop is loop and not client.is_closed:
+                return client
+        client = _build_http_client()
+        _HTTP_CLIENTS[key] = (loop, client)
+        return client
+
+
+async def close_http_clients() -> None:
+    """Fecha os clients do loop corrente e descarta os que pertencem a loops encerrados."""
+    loop = asyncio.get_running_loop()
+    to_close: List[httpx.AsyncClient] = []
+    with _HTTP_CLIENTS_LOCK:
+        for key, (owner_loop, client) in list(_HTTP_CLIENTS.items()):
+            if owner_loop is loop:
+                to_close.append(client)
+                del _HTTP_CLIENTS[key]
+            elif owner_loop.is_closed():
+                del _HTTP_CLIENTS[key]
+    for client in to_close:
+        await client.aclose()
+
+
+def simpliroute_base_url() -> str:
+    return os.getenv("SIMPLIROUTE_API_BASE") or os.getenv("SIMPLIR_ROUTE_BASE_URL") or os.getenv("SIMPLIROUTE_API_BASE_URL") or "https://api.simpliroute.com"
+
+
+def gnexum_base_url() -> str:
+    return os.getenv("GNEXUM_BASE_URL", "https://api.gnexum.local")
+
+
+@dataclass
+class VisitOutcome:
+    """Resultado do envio de uma visita (posição na lista recebida por `post_simpliroute`)."""
+
+    index: int
+    reference: Optional[str]
+    status_code: Optional[int] = None
+    visit_id: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code is not None and 200 <= self.status_code < 300
+
+    @property
+    def rejected(self) -> bool:
+        """Recusada pela API (4xx de validação): reenviar sem corrigir os dados não adianta."""
+        return self.status_code is not None and 400 <= self.status_code < 500 and self.status_code not in _RETRY_STATUSES
+
+
+@dataclass
+class SendResult:
+    """Resultado de `post_simpliroute`: um `VisitOutcome` por visita, na ordem do envio.
+
+    `status_code` é o do primeiro lote quando tudo foi aceito, senão o da primeira
+    visita com falha (`None` se ela ficou sem resposta). `text` junta as visitas
+    devolvidas pelos lotes aceitos; `chunks` descreve cada requisição feita.
+    """
+
+    outcomes: List[VisitOutcome]
+    status_code: Optional[int] = None
+    text: str = ""
+    chunks: List[Dict[str, Any]] = field(default_factory=list)
+    dry_run: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return all(outcome.ok for outcome in self.outcomes)
+
+    @property
+    def settled(self) -> bool:
+        """Nada a reenviar: cada visita foi aceita ou recusada pela validação da API."""
+        return all(outcome.ok or outcome.rejected for outcome in self.outcomes)
+
+    @property
+    def accepted(self) -> List[bool]:
+        return [outcome.ok for outcome in self.outcomes]
+
+    @property
+    def visit_ids(self) -> List[Optional[str]]:
+        return [outcome.visit_id for outcome in self.outcomes]
+
+    @property
+    def failures(self) -> List[VisitOutcome]:
+        return [outcome for outcome in self.outcomes if not outcome.ok]
+
+    @property
+    def error(self) -> Optional[str]:
+        return next((outcome.error for outcome in self.outcomes if outcome.error), None)
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+# falhas transitórias: repetidas com backoff (429/503 respeitam o Retry-After via rate limiter)
+_RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+# recusas de validação/tamanho: o lote é dividido ao meio para isolar as visitas ruins
+_BISECT_STATUSES = frozenset({400, 413, 422})
+
+
+def _retry_settings() -> Tuple[int, float, float]:
+    attempts = max(1, env_int("SIMPLIROUTE_RETRY_ATTEMPTS", 4))
+    try:
+        base = max(0.0, float(os.getenv("SIMPLIROUTE_RETRY_BASE_SECONDS", "0.5")))
+        cap = max(base, float(os.getenv("SIMPLIROUTE_RETRY_MAX_SECONDS", "30")))
+    except ValueError:
+        base, cap = 0.5, 30.0
+    return attempts, base, cap
+
+
+async def post_simpliroute(route_payload: Dict[str, Any]) -> SendResult:
     """Envia um ou vários visits ao endpoint `/v1/routes/visits/`.
 
     Aceita tanto um dict (será embrulhado em lista) quanto uma lista.
     Usa header `Authorization: Token <token>` conforme documentação.
     Procura por várias variações de variável de ambiente para compatibilidade.
+    Timeouts, 408/429/5xx são repetidos com backoff exponencial e jitter; um lote
+    recusado com 400/413/422 é dividido ao meio até isolar as visitas inválidas.
     """
     # suportar múltiplos nomes de env para compatibilidade
-    base = os.getenv("SIMPLIROUTE_API_BASE") or os.getenv("SIMPLIR_ROUTE_BASE_URL") or os.getenv("SIMPLIROUTE_API_BASE_URL") or "https://api.simpliroute.com"
+    base = simpliroute_base_url()
     token = _get_token(["SIMPLIROUTE_TOKEN", "SIMPLIR_ROUTE_TOKEN", "SIMPLIROUTE_API_TOKEN"])
 
     headers = {"Content-Type": "application/json; charset=utf-8"}
@@ -34,6 +223,9 @@ async def post_simpliroute(route_payload: Dict[str, Any]) -> Optional[httpx.Resp
         body = route_payload
     else:
         body = [route_payload]
+    outcomes = [
+        VisitOutcome(index=idx, reference=_reference(visit)) for idx, visit in enumerate(body)
+    ]
 
     # Test-mode / dry-run support:
     # - `SIMPLIROUTE_DISABLE_SEND=1` will block all HTTP POSTs and return a fake
@@ -41,88 +233,195 @@ async def post_simpliroute(route_payload: Dict[str, Any]) -> Optional[httpx.Resp
     # - For backward compatibility, `SIMPLIROUTE_DRY_RUN=1` is also respected.
     # Removing these variables (or setting to '0') restores normal behavior.
     if os.getenv("SIMPLIROUTE_DISABLE_SEND", "0") == "1" or os.getenv("SIMPLIROUTE_DRY_RUN", "0") == "1":
-        class _FakeResp:
-            def __init__(self):
-                self.status_code = 200
-                self.text = "DRY_RUN"
+        for outcome in outcomes:
+            outcome.status_code = 200
+        # nada foi criado no SimpliRoute: não registrar no ledger de envios
+        return SendResult(outcomes=outcomes, status_code=200, text="DRY_RUN", dry_run=True)
+
+    sender = _ChunkSender(body, outcomes, headers, base)
+    try:
+        # poda, normalização NFC e serialização em uma única passada, visita a visita,
+        # para dividir a lista por quantidade e bytes sem serializar de novo
+        sender.parts = [dumps_utf8(visit, VISIT_PRUNE_RULE) for visit in body]
+        ranges = sender.chunker.split([len(part) for part in sender.parts])
+        await asyncio.gather(*(sender.send_range(start, end) for start, end in ranges))
+    except Exception as exc:
+        LOGGER.exception("Erro inesperado ao enviar visitas ao SimpliRoute: %s", exc)
+        for outcome in outcomes:
+            if outcome.status_code is None and outcome.error is None:
+                outcome.error = str(exc)
+    return sender.result()
+
+
+def _reference(visit: Any) -> Optional[str]:
+    reference = visit.get("reference") if isinstance(visit, dict) else None
+    return None if reference in (None, "") else str(reference)
+
 
-            def json(self):
-                return {}
+class _ChunkSender:
+    """Envio de uma lista de visitas em lotes: retries, bissecção e resultado por visita."""
 
-        return _FakeResp()
+    def __init__(self, body: List[Dict[str, Any]], outcomes: List[VisitOutcome], headers: Dict[str, str], base: str) -> None:
+        self.body = body
+        self.outcomes = outcomes
+        self.headers = headers
+        self.url = f"{base.rstrip('/')}/v1/routes/visits/"
+        self.client = get_http_client(base)
+        self.limiter = get_rate_limiter("simpliroute")
+        self.chunker = get_chunker("simpliroute")
+        self.semaphore = asyncio.Semaphore(self.chunker.concurrency)
+        self.attempts, self.backoff_base, self.backoff_cap = _retry_settings()
+        self.parts: List[bytes] = []
+        self.chunks: List[Dict[str, Any]] = []
+        self.visits: Dict[int, List[Any]] = {}
 
+    async def send_range(self, start: int, end: int) -> None:
+        resp, error, attempts = await self._post_with_retry(start, end)
+        status = resp.status_code if resp is not None else None
+        chunk = {"start": start, "end": end, "status_code": status, "attempts": attempts}
+        self.chunks.append(chunk)
+        if status is not None and status in _BISECT_STATUSES and end - start > 1:
+            chunk["bisected"] = True
+            mid = (start + end) // 2
+            LOGGER.info("Lote [%s, %s) recusado com HTTP %s; dividindo em [%s, %s) e [%s, %s)", start, end, status, start, mid, mid, end)
+            for outcome in self.outcomes[start:end]:
+                outcome.attempts += attempts
+            await asyncio.gather(self.send_range(start, mid), self.send_range(mid, end))
+            return
+        if status is not None and 200 <= status < 300:
+            self.visits[start] = _response_visits(resp)
+            ids = extract_visit_ids(resp.text, self.body[start:end])
+        else:
+            ids = [None] * (end - start)
+            if error is None and resp is not None:
+                error = (resp.text or "")[:500] or f"HTTP {status}"
+        for outcome, visit_id in zip(self.outcomes[start:end], ids):
+            outcome.status_code = status
+            outcome.visit_id = visit_id
+            outcome.error = error
+            outcome.attempts += attempts
+
+    async def _post_with_retry(self, start: int, end: int) -> Tuple[Optional[httpx.Response], Optional[str], int]:
+        parts = self.parts[start:end]
+        content = b"[" + b",".join(parts) + b"]"
+        resp: Optional[httpx.Response] = None
+        error: Optional[str] = None
+        attempt = 0
+        while attempt < self.attempts:
+            attempt += 1
+            # o rate limiter segura a próxima tentativa quando a API mandou Retry-After
+            await self.limiter.acquire_async()
+            started = time.perf_counter()
+            try:
+                async with self.semaphore:
+                    resp = await self.client.post(self.url, content=content, headers=self.headers)
+                error = None
+            except httpx.HTTPError as exc:
+                resp, error = None, f"{type(exc).__name__}: {exc}"
+            elapsed = time.perf_counter() - started
+            status = resp.status_code if resp is not None else None
+            self.chunker.observe(len(parts), len(content), status, elapsed)
+            if resp is not None:
+                self.limiter.observe(status, resp.headers)
+            if status is not None and status not in _RETRY_STATUSES:
+                break
+            if attempt >= self.attempts:
+                break
+            throttled = resp is not None and parse_retry_after(resp.headers.get("Retry-After")) is not None
+            delay = 0.0 if throttled else random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** (attempt - 1)))
+            LOGGER.warning(
+                "Lote [%s, %s) falhou (%s); tentativa %s/%s em %.2fs",
+                start,
+                end,
+                status if status is not None else error,
+                attempt + 1,
+                self.attempts,
+                delay,
+            )
+            if delay:
+                await asyncio.sleep(delay)
+        return resp, error, attempt
+
+    def result(self) -> SendResult:
+        visits = [visit for start in sorted(self.visits) for visit in self.visits[start]]
+        failures = [outcome for outcome in self.outcomes if not outcome.ok]
+        if failures:
+            status_code = failures[0].status_code
+        else:
+            # só os lotes finais: um lote dividido ao meio tem o status da recusa (400/413)
+            leaves = [chunk for chunk in self.chunks if not chunk.get("bisected")]
+            first = min(leaves, key=lambda chunk: (chunk["start"], chunk["end"]), default=None)
+            status_code = first["status_code"] if first else None
+        return SendResult(
+            outcomes=self.outcomes,
+            status_code=status_code,
+            text=json.dumps(visits, ensure_ascii=False),
+            chunks=sorted(self.chunks, key=lambda chunk: (chunk["start"], -chunk["end"])),
+        )
+
+
+def _response_visits(resp: httpx.Response) -> List[Any]:
+    try:
+        parsed = json.loads(resp.text or "")
+    except ValueError:
+        return []
+    if isinstance(parsed, dict):
+        for key in ("visits", "data", "results"):
+            if isinstance(parsed.get(key), list):
+                return parsed[key]
+        return [parsed]
+    return parsed if isinstance(parsed, list) else []
+
+
+def extract_visit_ids(body: Optional[str], payloads: Sequence[Dict[str, Any]]) -> List[Optional[str]]:
+    """Associa os IDs devolvidos pelo SimpliRoute a cada payload do lote.
+
+    A API responde com a lista de visitas criadas na mesma ordem do envio; quando o
+    tamanho não bate, a associação é feita pelo campo `reference`.
+    """
+    ids: List[Optional[str]] = [None] * len(payloads)
     try:
-        # prune body to only fields expected by SimpliRoute to avoid sending extra info
-        allowed_visit_fields = [
-            "order","tracking_id","status","title","address","latitude","longitude",
-            "load","load_2","load_3","window_start","window_end","window_start_2","window_end_2",
-            "duration","contact_name","contact_phone","contact_email","reference","notes",
-            "skills_required","skills_optional","tags","planned_date","programmed_date","route",
-            "estimated_time_arrival","estimated_time_departure","checkin_time","checkout_time",
-            "checkout_latitude","checkout_longitude","checkout_comment","checkout_observation",
-            "signature","pictures","created","modified","eta_predicted","eta_current",
-            "priority","has_alert","priority_level","extra_field_values","geocode_alert",
-            "visit_type","current_eta","fleet","seller","properties","items","on_its_way"
-        ]
-
-        allowed_item_fields = [
-            "id","title","status","load","load_2","load_3","reference","visit",
-            "notes","quantity_planned","quantity_delivered"
-        ]
-
-        def prune_visit(v: dict) -> dict:
-            out = {}
-            for k in allowed_visit_fields:
-                if k in v and v[k] is not None:
-                    # copy only allowed keys
-                    out[k] = v[k]
-            # prune properties subkeys if present: keep only expected property keys
-            if "properties" in out and isinstance(out["properties"], dict):
-                props = out["properties"]
-                # preserve TIPOVISITA as requested, além das outras chaves
-                kept = {k: props[k] for k in props if k in ("PROFISSIONAL", "ESPECIALIDADE", "PERIODICIDADE", "TIPOVISITA")}
-                if kept:
-                    out["properties"] = kept
-                else:
-                    out.pop("properties", None)
-            # prune items
-            if "items" in out and isinstance(out["items"], list):
-                items = []
-                for it in out["items"]:
-                    if not isinstance(it, dict):
-                        continue
-                    newi = {k: it[k] for k in allowed_item_fields if k in it and it[k] is not None}
-                    if newi:
-                        items.append(newi)
-                if items:
-                    out["items"] = items
-                else:
-                    out.pop("items", None)
-            return out
-
-        if isinstance(body, list):
-            pruned = [prune_visit(v) for v in body]
+        parsed = json.loads(body or "")
+    except ValueError:
+        return ids
+
+    if isinstance(parsed, dict):
+        for key in ("visits", "data", "results"):
+            if isinstance(parsed.get(key), list):
+                parsed = parsed[key]
+                break
         else:
-            pruned = prune_visit(body)
+            parsed = [parsed]
+    if not isinstance(parsed, list):
+        return ids
 
-        content = dumps_utf8(pruned)
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.post(f"{base.rstrip('/')}/v1/routes/visits/", content=content, headers=headers)
-        return resp
-    except Exception:
-        return None
+    visits = [v for v in parsed if isinstance(v, dict)]
+    if len(visits) == len(payloads):
+        for idx, visit in enumerate(visits):
+            if visit.get("id") is not None:
+                ids[idx] = str(visit["id"])
+        return ids
+
+    by_reference: Dict[str, str] = {}
+    for visit in visits:
+        ref = visit.get("reference")
+        if ref not in (None, "") and visit.get("id") is not None:
+            by_reference.setdefault(str(ref), str(visit["id"]))
+    for idx, payload in enumerate(payloads):
+        ids[idx] = by_reference.get(str(payload.get("reference") or ""))
+    return ids
 
 
 async def post_gnexum_update(payload: Dict[str, Any]) -> Optional[httpx.Response]:
     # Placeholder: Gnexum endpoint must be configured by the user
-    url = os.getenv("GNEXUM_BASE_URL", "https://api.gnexum.local")
+    url = gnexum_base_url()
     token = _get_token(["GNEXUM_TOKEN"])
     headers = {"Content-Type": "application/json; charset=utf-8"}
     if token:
         headers["Authorization"] = f"Bearer {token}"
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            resp = await client.post(f"{url.rstrip('/')}/updates/status", json=payload, headers=headers)
+        client = get_http_client(url)
+        resp = await client.post(f"{url.rstrip('/')}/updates/status", json=payload, headers=headers)
         return resp
     except Exception:
         # Em ambiente de teste/sem configuração, falhas de rede não devem
@@ -1,12 +1,22 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Sequence, Tuple
 import os
+import logging
+import multiprocessing
+import pickle
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
 import unicodedata
 from datetime import datetime, date
 import textwrap
 import re
 import math
 
+from src.core.config import env_int
+from src.core.encoding import prune_normalize
+
+LOGGER = logging.getLogger(__name__)
 
 DEFAULT_DURATION_MINUTES = {
     "delivery": 30,
@@ -178,6 +188,130 @@ def _sanitize_email(value: Any) -> str | None:
     return text
 
 
+# fallback de aliases usado por `_get` (ex.: ITEM_TITLE -> title)
+_KEY_ALIASES = {
+    'item_title': ('item_title', 'produto', 'nome', 'title'),
+    'quantity_planned': ('quantity_planned', 'quantidade', 'qty'),
+    'planned_date': ('planned_date', 'dt_visita', 'eventdate'),
+    'address': ('address', 'endereco', 'endereco_geolocalizacao'),
+    'contact_phone': ('contact_phone', 'telefones', 'contact_phone'),
+}
+
+
+@lru_cache(maxsize=8192)
+def _normalize_key_name(s: Any) -> str:
+    """Normaliza nomes de coluna (caixa, acentos, pontuação) para comparação.
+
+    Suporta chaves vindas do Gnexum que podem estar em CAIXA ALTA.
+    """
+    try:
+        s = str(s)
+    except Exception:
+        return str(s)
+    s = s.strip().lower()
+    # remove accents
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(c for c in s if unicodedata.category(c) != "Mn")
+    # keep only alnum and underscore
+    s = "".join(c for c in s if c.isalnum() or c == "_")
+    return s
+
+
+@lru_cache(maxsize=512)
+def _normalized_key_table(keys: Tuple[Any, ...]) -> Tuple[str, ...]:
+    """Nomes normalizados de uma lista de colunas; todas as rows de uma view compartilham a mesma."""
+    return tuple(_normalize_key_name(k) for k in keys)
+
+
+class _MappingPlan:
+    """Plano de resolução de campos para uma lista de colunas (uma view).
+
+    Cada assinatura de `_get(k, *alts)` é compilada, na primeira chamada, em
+    cadeias de colunas concretas — chaves exatas, colunas com o mesmo nome
+    normalizado (na ordem do registro) e colunas dos aliases — e reaproveitada
+    em todas as rows com o mesmo `cur.description`.
+    """
+
+    __slots__ = ("columns", "_column_set", "_columns_by_norm", "_chains")
+
+    def __init__(self, columns: Tuple[Any, ...]) -> None:
+        self.columns = columns
+        self._column_set = frozenset(columns)
+        columns_by_norm: Dict[str, List[Any]] = {}
+        for key, norm in zip(columns, _normalized_key_table(columns)):
+            columns_by_norm.setdefault(norm, []).append(key)
+        self._columns_by_norm = columns_by_norm
+        self._chains: Dict[Tuple[Any, ...], Tuple[Tuple[Any, ...], Tuple[Any, ...], Tuple[Any, ...]]] = {}
+
+    def _compile(self, signature: Tuple[Any, ...]):
+        exact = tuple(key for key in signature if key in self._column_set)
+        target_norms = {_normalize_key_name(str(x)) for x in signature if x}
+        fuzzy = tuple(
+            key for key, norm in zip(self.columns, _normalized_key_table(self.columns)) if norm in target_norms
+        )
+        alias: List[Any] = []
+        for c in _KEY_ALIASES.get(_normalize_key_name(signature[0]), ()):
+            alias.extend(self._columns_by_norm.get(_normalize_key_name(c), ()))
+        chain = (exact, fuzzy, tuple(alias))
+        self._chains[signature] = chain
+        return chain
+
+    def lookup(self, record: Dict[str, Any], signature: Tuple[Any, ...], default: Any = None) -> Any:
+        chain = self._chains.get(signature) or self._compile(signature)
+        exact, fuzzy, alias = chain
+        for key in exact:
+            value = record[key]
+            if value is not None:
+                return value
+        for key in fuzzy:
+            value = record[key]
+            if value is not None:
+                return value
+        for key in alias:
+            value = record[key]
+            if value not in (None, ''):
+                return value
+        return default
+
+
+@lru_cache(maxsize=128)
+def _mapping_plan(view_name: Any, columns: Tuple[Any, ...]) -> _MappingPlan:
+    return _MappingPlan(columns)
+
+
+# colunas (nome normalizado) lidas por `build_visit_payload`; mantenha em sincronia ao
+# adicionar novas buscas por `_get`/`row.get`. Usada na projeção `auto` das views.
+MAPPED_FIELDS = frozenset(
+    """
+    address checkin_time checkout_comment checkout_latitude checkout_longitude checkout_observation
+    checkout_time contact_email contact_name contact_phone cpf created created_at current_eta desc_tipo
+    descricao driver dt_entrega dt_visita duration email endereco endereco_geolocalizacao especialidade
+    estimated_time_arrival estimated_time_departure eta_current eta_predicted eventdate extra_field_values
+    fleet frequencia geocode_alert has_alert id id_atendimento id_item id_material id_prescricao
+    id_protocolo idregistro idresupply is_route_completed lat latitude load load_2 load_3 lon longitude
+    modified motivo nome nome_material nome_paciente nome_profissional notes on_its_way order
+    periodicidade periodicidade_visita pessoacontato pictures planned_date priority priority_level produto
+    profissional programmed programmed_date qtd_entregue qtd_item_entregue qtd_item_enviado
+    qtd_item_solicitado qtd_separada qtd_solicitada qtde_atendida qtde_solicitada qty quantidade
+    quantity_delivered quantity_planned record_type ref reference route route_estimated_time_start
+    route_status seller service_time signature status subtipo telefones tipo tipo_entrega tipo_movimentacao
+    tipo_movimento tipovisita title item_title tp_entrega tpregistro tracking tracking_id updated_at vehicle visit_type
+    volume window_end window_end_2 window_start window_start_2
+    """.split()
+)
+# a periodicidade também é procurada por substring em qualquer coluna
+_PERIOD_TOKENS = ("period", "frequ")
+
+
+def select_mapped_columns(columns: Sequence[Any]) -> List[Any]:
+    """Subconjunto de `columns` (na ordem original) que o mapper pode ler."""
+    selected = []
+    for column, norm in zip(columns, _normalized_key_table(tuple(columns))):
+        if norm in MAPPED_FIELDS or any(token in norm for token in _PERIOD_TOKENS):
+            selected.append(column)
+    return selected
+
+
 def build_visit_payload(record: Dict[str, Any]) -> Dict[str, Any]:
     """Constrói payload compatível com SimpliRoute para criação de visita.
 
@@ -189,49 +323,11 @@ def build_visit_payload(record: Dict[str, Any]) -> Dict[str, Any]:
     - `items` convertido para o shape esperado pela API
     - adiciona `properties.source` e `properties.source_ident` para rastreabilidade
     """
-    # suportar chaves vindas do Gnexum que podem estar em CAIXA ALTA
-    def _normalize_key_name(s: str) -> str:
-        try:
-            s = str(s)
-        except Exception:
-            return str(s)
-        s = s.strip().lower()
-        # remove accents
-        s = unicodedata.normalize("NFKD", s)
-        s = "".join(c for c in s if unicodedata.category(c) != "Mn")
-        # keep only alnum and underscore
-        s = "".join(c for c in s if c.isalnum() or c == "_")
-        return s
+    # plano compilado uma vez por (view, colunas) e compartilhado pelas rows da view
+    plan = _mapping_plan(record.get("_source_view"), tuple(record))
 
     def _get(k, *alts, default=None):
-        # try exact keys first
-        for key in (k,) + alts:
-            if key in record and record.get(key) is not None:
-                return record.get(key)
-        # case/format-insensitive lookup: normalize keys and compare
-        target_names = [str(x) for x in (k,) + alts if x]
-        target_norms = {_normalize_key_name(t): t for t in target_names}
-        for rec_key, rec_val in record.items():
-            if rec_val is None:
-                continue
-            rn = _normalize_key_name(rec_key)
-            if rn in target_norms:
-                return rec_val
-        # fallback: try to match by common aliases (e.g., ITEM_TITLE -> title)
-        aliases = {
-            'item_title': ('item_title', 'produto', 'nome', 'title'),
-            'quantity_planned': ('quantity_planned', 'quantidade', 'qty'),
-            'planned_date': ('planned_date', 'dt_visita', 'eventdate'),
-            'address': ('address', 'endereco', 'endereco_geolocalizacao'),
-            'contact_phone': ('contact_phone', 'telefones', 'contact_phone'),
-        }
-        for alias_key, candidates in aliases.items():
-            if _normalize_key_name(k) == alias_key:
-                for c in candidates:
-                    for rec_key, rec_val in record.items():
-                        if _normalize_key_name(rec_key) == _normalize_key_name(c) and rec_val not in (None, ''):
-                            return rec_val
-        return default
+        return plan.lookup(record, (k,) + alts, default)
 
     tp = int(_get("tpregistro", "TPREGISTRO", default=1) or 1)
 
@@ -713,30 +809,6 @@ def build_visit_payload(record: Dict[str, Any]) -> Dict[str, Any]:
             payload["items"] = items
 
     # assemble final payload as OrderedDict to respect the exact field order required
-    def _norm_str(s: Any) -> Any:
-        if isinstance(s, str):
-            try:
-                return unicodedata.normalize("NFC", s)
-            except Exception:
-                return s
-        return s
-
-    def _normalize_obj(obj: Any):
-        # preserve OrderedDict type when normalizing
-        if isinstance(obj, OrderedDict):
-            new = OrderedDict()
-            for k, v in obj.items():
-                new[k] = _normalize_obj(v)
-            return new
-        if isinstance(obj, dict):
-            new = {}
-            for k, v in obj.items():
-                new[k] = _normalize_obj(v)
-            return new
-        if isinstance(obj, list):
-            return [_normalize_obj(v) for v in obj]
-        return _norm_str(obj)
-
     ordered = OrderedDict()
     ordered["id"] = None
     ordered["order"] = payload.get("order")
@@ -977,8 +1049,11 @@ def build_visit_payload(record: Dict[str, Any]) -> Dict[str, Any]:
         except Exception:
             ordered["notes"] = _prefix_notes(ordered.get("notes") or "ENTREGA")
 
-    # Normalize strings throughout the ordered payload (NFC)
-    ordered = _normalize_obj(ordered)
+    # strings em NFC já no payload: arquivo/dry-run do CLI iguais ao corpo enviado.
+    # prune_normalize não copia o que já está conforme (strings ASCII, por exemplo).
+    normalized = prune_normalize(ordered)
+    if normalized is not ordered:
+        ordered = OrderedDict(normalized)
 
     # Ensure all keys from the example JSON remain present. For missing values, use
     # sensible empty defaults (no literal 'None'/'NULL' strings):
@@ -1061,3 +1136,43 @@ def build_items_from_rows(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
             "quantity_planned": float(r.get("quantidade", 1) or 1),
         })
     return items
+
+
+def _is_pickling_error(exc: BaseException) -> bool:
+    return isinstance(exc, pickle.PicklingError) or (isinstance(exc, TypeError) and "pickle" in str(exc))
+
+
+def build_visit_payloads(
+    records: List[Dict[str, Any]],
+    workers: int | None = None,
+    min_records: int | None = None,
+) -> List[Dict[str, Any]]:
+    """Monta os payloads de vários registros, preservando a ordem de entrada.
+
+    Com `workers > 1` (padrão `SIMPLIROUTE_MAPPER_WORKERS`, desativado) e ao menos
+    `min_records` registros (padrão `SIMPLIROUTE_MAPPER_MIN_RECORDS`), os registros
+    são distribuídos em blocos por um `ProcessPoolExecutor`. Entradas pequenas,
+    registros não serializáveis ou falha do pool voltam ao modo serial.
+    """
+    records = list(records)
+    if workers is None:
+        workers = env_int("SIMPLIROUTE_MAPPER_WORKERS", 0)
+    if min_records is None:
+        min_records = env_int("SIMPLIROUTE_MAPPER_MIN_RECORDS", 2000)
+    workers = min(workers, os.cpu_count() or 1)
+    if workers <= 1 or len(records) < max(min_records, 2):
+        return [build_visit_payload(record) for record in records]
+
+    chunksize = max(1, math.ceil(len(records) / (workers * 4)))
+    # spawn: o serviço roda com threads e event loop ativos, onde fork não é seguro
+    context = multiprocessing.get_context(os.getenv("SIMPLIROUTE_MAPPER_START_METHOD", "spawn"))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            return list(executor.map(build_visit_payload, records, chunksize=chunksize))
+    except BrokenProcessPool as exc:
+        LOGGER.warning("Pool de processos do mapper falhou (%s); montando payloads em série", exc)
+    except Exception as exc:
+        if not _is_pickling_error(exc):
+            raise
+        LOGGER.warning("Registros não serializáveis para o pool (%s); montando payloads em série", exc)
+    return [build_visit_payload(record) for record in records]
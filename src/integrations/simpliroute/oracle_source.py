@@ -1,15 +1,27 @@
 import logging
 import os
+import threading
+import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
 
 import oracledb
 from dotenv import load_dotenv
 
+from src.core.config import env_int
+
+from .mapper import select_mapped_columns
+
 LOGGER = logging.getLogger(__name__)
 _ENV_READY = False
 _CLIENT_READY = False
+_POOL: Optional[oracledb.ConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+_VIEW_COLUMNS: Dict[str, List[str]] = {}
+_VIEW_COLUMNS_LOCK = threading.Lock()
 
 
 def _project_root() -> Path:
@@ -74,7 +86,7 @@ def _require_env(name: str) -> str:
     return value
 
 
-def _build_connection() -> oracledb.Connection:
+def _connect_params() -> Dict[str, Any]:
     _init_oracle_client()
     host = _require_env("ORACLE_HOST")
     port = int(os.getenv("ORACLE_PORT", "1521"))
@@ -83,11 +95,74 @@ def _build_connection() -> oracledb.Connection:
     password = _require_env("ORACLE_PASS")
 
     dsn = oracledb.makedsn(host, port, service_name=service)
-    return oracledb.connect(user=user, password=password, dsn=dsn)
+    return {"user": user, "password": password, "dsn": dsn}
+
+
+def _build_connection() -> oracledb.Connection:
+    return oracledb.connect(**_connect_params())
+
+
+def _pool_enabled() -> bool:
+    return os.getenv("ORACLE_POOL_ENABLED", "1") != "0"
+
+
+def _get_pool() -> oracledb.ConnectionPool:
+    """Cria (uma única vez) o pool de sessões usado por `get_connection`."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            pool_min = max(0, env_int("ORACLE_POOL_MIN", 1))
+            pool_max = max(1, pool_min, env_int("ORACLE_POOL_MAX", 4))
+            _POOL = oracledb.create_pool(
+                **_connect_params(),
+                min=pool_min,
+                max=pool_max,
+                increment=max(1, env_int("ORACLE_POOL_INCREMENT", 1)),
+                ping_interval=env_int("ORACLE_POOL_PING_INTERVAL", 60),
+                stmtcachesize=env_int("ORACLE_STMT_CACHE_SIZE", 20),
+                getmode=oracledb.POOL_GETMODE_WAIT,
+            )
+            LOGGER.info("Pool Oracle criado (min=%s, max=%s)", pool_min, pool_max)
+        return _POOL
+
+
+def close_pool(force: bool = False) -> None:
+    """Fecha o pool de sessões, se existir. Chamado no shutdown do serviço."""
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is None:
+        return
+    try:
+        pool.close(force=force)
+    except oracledb.Error as exc:  # type: ignore[attr-defined]
+        LOGGER.warning("Falha ao fechar pool Oracle: %s", exc)
+
+
+def pool_stats() -> Dict[str, Any]:
+    pool = _POOL
+    if pool is None:
+        return {"enabled": _pool_enabled(), "created": False}
+    return {
+        "enabled": True,
+        "created": True,
+        "open": pool.opened,
+        "busy": pool.busy,
+        "min": pool.min,
+        "max": pool.max,
+    }
+
+
+def _group_field() -> str:
+    return os.getenv("ORACLE_GROUP_FIELD", "ID_ATENDIMENTO")
+
+
+# lidos fora do mapper (agrupamento, cache de identificadores, status)
+_IDENTIFIER_COLUMNS = ("ID_REGISTRO", "ID_PROTOCOLO", "ID_PRESCRICAO", "ID_ATENDIMENTO", "ID_VISITA", "TPREGISTRO")
 
 
 def _group_key(row: Dict[str, Any]) -> str:
-    preferred = os.getenv("ORACLE_GROUP_FIELD", "ID_ATENDIMENTO")
+    preferred = _group_field()
     candidates = [preferred, "ID_REGISTRO", "ID_PROTOCOLO", "ID_PRESCRICAO", "ID_VISITA"]
     for cand in candidates:
         if not cand:
@@ -120,33 +195,273 @@ def resolve_where_clause(view_name: Optional[str], explicit_where: Optional[str]
     return base_where
 
 
-def fetch_view_rows(
-    limit: Optional[int] = None,
-    where_clause: Optional[str] = None,
-    view_name: Optional[str] = None,
-    order_by: Optional[str] = None,
-) -> List[Dict[str, Any]]:
-    """Retorna rows cruas da view Oracle como lista de dicts."""
+def view_columns(view_name: Optional[str] = None) -> List[str]:
+    """Colunas da view (via `cur.description`, sem ler linhas), em cache por processo."""
+    schema = _require_env("ORACLE_SCHEMA")
+    view = view_name or _require_env("ORACLE_VIEW")
+    key = f"{schema}.{view}".upper()
+    with _VIEW_COLUMNS_LOCK:
+        cached = _VIEW_COLUMNS.get(key)
+    if cached is not None:
+        return list(cached)
+    with get_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT * FROM {schema}.{view} WHERE 1 = 0")
+            columns = [col[0] for col in cur.description]
+    with _VIEW_COLUMNS_LOCK:
+        _VIEW_COLUMNS[key] = columns
+    return list(columns)
+
+
+def _projection_spec(view_name: Optional[str], configured: Any = None, explicit: Any = None) -> Any:
+    view_upper = (view_name or "").upper()
+    env_view = os.getenv(f"ORACLE_SELECT_COLUMNS_{view_upper}") if view_upper else None
+    for spec in (explicit, env_view, configured, os.getenv("ORACLE_SELECT_COLUMNS")):
+        if spec is None:
+            continue
+        if isinstance(spec, str):
+            spec = spec.strip()
+            if not spec:
+                continue
+            if spec.lower() in ("auto", "*"):
+                return spec.lower()
+            spec = [token for token in spec.replace(";", ",").replace(" ", ",").split(",") if token]
+        if isinstance(spec, (list, tuple)):
+            return [str(column).strip() for column in spec if str(column).strip()]
+    return None
+
+
+def resolve_projection(
+    view_name: Optional[str],
+    configured: Any = None,
+    required: Sequence[str] = (),
+    explicit: Any = None,
+) -> Optional[List[str]]:
+    """Colunas a buscar na view, ou `None` para `SELECT *`.
+
+    Ordem: `ORACLE_SELECT_COLUMNS_<VIEW>`, `configured` (`oracle.projections.<VIEW>`
+    do config.yaml) e `ORACLE_SELECT_COLUMNS`. Aceita uma lista de colunas, `auto`
+    (colunas da view que o mapper lê) ou `*`. Identificadores usados no
+    agrupamento e na sincronização de status, além de `required`, são sempre
+    incluídos quando existem na view. `explicit` (ex.: opção do CLI) tem precedência.
+    """
+    view_name = view_name or _require_env("ORACLE_VIEW")
+    spec = _projection_spec(view_name, configured, explicit)
+    if spec is None or spec == "*":
+        return None
+    available = view_columns(view_name)
+    by_upper = {column.upper(): column for column in available}
+    if spec == "auto":
+        selected = select_mapped_columns(available)
+    else:
+        selected = []
+        for column in spec:
+            actual = by_upper.get(column.upper())
+            if actual is None:
+                LOGGER.warning("Coluna %s não existe na view %s; ignorada na projeção", column, view_name)
+                continue
+            selected.append(actual)
+    extras = [_group_field(), *_IDENTIFIER_COLUMNS, *required]
+    for column in extras:
+        actual = by_upper.get(str(column).upper())
+        if actual is not None and actual not in selected:
+            selected.append(actual)
+    return selected or None
+
+
+def config_projections(cfg: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """`oracle.projections` do config.yaml (view -> lista de colunas ou `auto`), com as views em caixa alta."""
+    oracle_cfg = (cfg or {}).get("oracle") or {}
+    configured = oracle_cfg.get("projections") or {}
+    if not isinstance(configured, Mapping):
+        return {}
+    return {str(view).upper(): spec for view, spec in configured.items()}
+
+
+def _quote_column(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _build_select(
+    limit: Optional[int],
+    where_clause: Optional[str],
+    view_name: Optional[str],
+    order_by: Optional[str],
+    params: Optional[Dict[str, Any]],
+    columns: Optional[Sequence[str]],
+) -> Tuple[str, Dict[str, Any]]:
     schema = _require_env("ORACLE_SCHEMA")
     view = view_name or _require_env("ORACLE_VIEW")
-    sql = f"SELECT * FROM {schema}.{view}"
+    projection = ", ".join(_quote_column(c) for c in columns) if columns else "*"
+    sql = f"SELECT {projection} FROM {schema}.{view}"
     if where_clause:
         sql += f" WHERE {where_clause}"
     if order_by:
         sql += f" ORDER BY {order_by}"
-    params: Dict[str, Any] = {}
+    binds = dict(params or {})
     if limit and limit > 0:
         sql = f"SELECT * FROM ({sql}) WHERE ROWNUM <= :limit"
-        params["limit"] = int(limit)
+        binds["limit"] = int(limit)
+    return sql, binds
+
+
+def _prepare_cursor(cur: Any) -> None:
+    arraysize = max(1, env_int("ORACLE_FETCH_ARRAYSIZE", 500))
+    cur.arraysize = arraysize
+    cur.prefetchrows = max(2, env_int("ORACLE_PREFETCH_ROWS", arraysize))
+
+
+def iter_view_rows(
+    limit: Optional[int] = None,
+    where_clause: Optional[str] = None,
+    view_name: Optional[str] = None,
+    order_by: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+    columns: Optional[Sequence[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Itera as rows cruas da view Oracle sem materializar o resultado inteiro.
+
+    O cursor busca em lotes de `ORACLE_FETCH_ARRAYSIZE` linhas (default 500), com
+    `ORACLE_PREFETCH_ROWS` linhas já no primeiro round-trip. `params` são os binds
+    usados em `where_clause`; `columns` restringe o SELECT (padrão `*`).
+
+    A conexão fica presa ao iterador até o fim da leitura: quem abandona o
+    iterador antes disso deve fechá-lo (`contextlib.closing`) para devolvê-la ao pool.
+    """
+    sql, binds = _build_select(limit, where_clause, view_name, order_by, params, columns)
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        try:
+            _prepare_cursor(cur)
+            cur.execute(sql, binds)
+            names = [col[0] for col in cur.description]
+            for raw in cur:
+                yield dict(zip(names, raw))
+        finally:
+            cur.close()
+    finally:
+        conn.close()
 
-    with _build_connection() as conn:
+
+_NET_BYTES_SQL = (
+    "SELECT s.value FROM v$mystat s JOIN v$statname n ON n.statistic# = s.statistic# "
+    "WHERE n.name = 'bytes sent via SQL*Net to client'"
+)
+
+
+def _session_net_bytes(conn: Any) -> Optional[int]:
+    try:
         with conn.cursor() as cur:
-            cur.execute(sql, params)
-            columns = [col[0] for col in cur.description]
-            rows = []
-            for raw in cur.fetchall():
-                rows.append({col: raw[idx] for idx, col in enumerate(columns)})
-    return rows
+            cur.execute(_NET_BYTES_SQL)
+            row = cur.fetchone()
+        return int(row[0]) if row else None
+    except oracledb.Error:  # type: ignore[attr-defined]
+        return None
+
+
+def measure_view_fetch(
+    limit: Optional[int] = None,
+    where_clause: Optional[str] = None,
+    view_name: Optional[str] = None,
+    order_by: Optional[str] = None,
+    columns: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """Executa a consulta da view e mede tempo, colunas e bytes trafegados.
+
+    `net_bytes` vem de `v$mystat` ("bytes sent via SQL*Net to client") e fica
+    `None` sem permissão de leitura; `value_bytes` estima o tamanho dos valores
+    recebidos (texto em UTF-8) e serve de comparação nesse caso.
+    """
+    sql, binds = _build_select(limit, where_clause, view_name, order_by, None, columns)
+    with get_connection() as conn:
+        before = _session_net_bytes(conn)
+        started = time.perf_counter()
+        rows = 0
+        value_bytes = 0
+        with conn.cursor() as cur:
+            _prepare_cursor(cur)
+            cur.execute(sql, binds)
+            column_count = len(cur.description)
+            for raw in cur:
+                rows += 1
+                for value in raw:
+                    if value is None:
+                        continue
+                    value_bytes += len(value.encode("utf-8")) if isinstance(value, str) else len(str(value))
+        elapsed = time.perf_counter() - started
+        after = _session_net_bytes(conn)
+    net_bytes = after - before if before is not None and after is not None else None
+    return {
+        "columns": column_count,
+        "rows": rows,
+        "seconds": elapsed,
+        "net_bytes": net_bytes,
+        "value_bytes": value_bytes,
+    }
+
+
+def fetch_view_rows(
+    limit: Optional[int] = None,
+    where_clause: Optional[str] = None,
+    view_name: Optional[str] = None,
+    order_by: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+    columns: Optional[Sequence[str]] = None,
+) -> List[Dict[str, Any]]:
+    """Retorna rows cruas da view Oracle como lista de dicts."""
+    return list(
+        iter_view_rows(
+            limit=limit,
+            where_clause=where_clause,
+            view_name=view_name,
+            order_by=order_by,
+            params=params,
+            columns=columns,
+        )
+    )
+
+
+def iter_grouped_records(
+    limit: Optional[int] = None,
+    where_clause: Optional[str] = None,
+    view_name: Optional[str] = None,
+    order_by: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+    columns: Optional[Sequence[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Agrupa rows consecutivas por `_group_key` e emite cada registro assim que fecha.
+
+    A consulta é ordenada pelo campo de agrupamento (ORACLE_GROUP_FIELD) quando
+    `order_by` não é informado, garantindo que rows do mesmo registro venham juntas.
+    A memória fica limitada a um registro por vez, independente do tamanho da view.
+    """
+    effective_view = view_name or _require_env("ORACLE_VIEW")
+    rows = iter_view_rows(
+        limit=limit,
+        where_clause=where_clause,
+        view_name=effective_view,
+        order_by=order_by or _group_field(),
+        params=params,
+        columns=columns,
+    )
+    record: Optional[Dict[str, Any]] = None
+    current_key: Optional[str] = None
+    try:
+        for row in rows:
+            row["_source_view"] = effective_view
+            key = _group_key(row)
+            if record is None or key != current_key:
+                if record is not None:
+                    yield record
+                record = dict(row)
+                record["items"] = []
+                current_key = key
+            record["items"].append(row)
+    finally:
+        rows.close()
+    if record is not None:
+        yield record
 
 
 def fetch_grouped_records(
@@ -154,27 +469,163 @@ def fetch_grouped_records(
     where_clause: Optional[str] = None,
     view_name: Optional[str] = None,
     order_by: Optional[str] = None,
+    params: Optional[Dict[str, Any]] = None,
+    columns: Optional[Sequence[str]] = None,
 ) -> List[Dict[str, Any]]:
     effective_view = view_name or _require_env("ORACLE_VIEW")
-    rows = fetch_view_rows(limit=limit, where_clause=where_clause, view_name=effective_view, order_by=order_by)
+    rows = iter_view_rows(
+        limit=limit,
+        where_clause=where_clause,
+        view_name=effective_view,
+        order_by=order_by,
+        params=params,
+        columns=columns,
+    )
     grouped: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
     for row in rows:
+        row["_source_view"] = effective_view
         key = _group_key(row)
         record = grouped.get(key)
         if record is None:
             record = dict(row)
             record["items"] = []
-            record["_source_view"] = effective_view
             grouped[key] = record
-        record.setdefault("items", [])
-        row_copy = dict(row)
-        row_copy["_source_view"] = effective_view
-        record["items"].append(row_copy)
+        # a própria row vira o item; o registro já é uma cópia independente
+        record["items"].append(row)
     return list(grouped.values())
 
 
-def get_connection() -> oracledb.Connection:
-    return _build_connection()
+@dataclass
+class ViewFilter:
+    """Condição extra (com binds) e ordenação aplicadas à consulta de uma view."""
+
+    condition: Optional[str] = None
+    params: Dict[str, Any] = field(default_factory=dict)
+    order_by: Optional[str] = None
+    # colunas que precisam vir mesmo com projeção (ex.: coluna do high-water mark)
+    columns: Tuple[str, ...] = ()
+
+
+def _view_query(
+    view_name: Optional[str],
+    where_clause: Optional[str],
+    order_by: Optional[str],
+    view_filter: Optional[ViewFilter],
+    projections: Optional[Mapping[str, Any]],
+) -> Tuple[Optional[str], Optional[str], Optional[Dict[str, Any]], Optional[List[str]]]:
+    """(where, order by, binds, colunas) da consulta de uma view."""
+    effective_where = resolve_where_clause(view_name, where_clause)
+    effective_order = order_by
+    params: Optional[Dict[str, Any]] = None
+    if view_filter is not None:
+        if view_filter.condition:
+            condition = view_filter.condition
+            effective_where = f"({effective_where}) AND {condition}" if effective_where else condition
+        effective_order = view_filter.order_by or order_by
+        params = view_filter.params
+    configured = (projections or {}).get((view_name or os.getenv("ORACLE_VIEW") or "").upper())
+    columns = resolve_projection(view_name, configured, required=view_filter.columns if view_filter is not None else ())
+    return effective_where, effective_order, params, columns
+
+
+def iter_view_records(
+    view_name: Optional[str],
+    limit: Optional[int] = None,
+    where_clause: Optional[str] = None,
+    order_by: Optional[str] = None,
+    view_filter: Optional[ViewFilter] = None,
+    projections: Optional[Mapping[str, Any]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Registros de uma view com o filtro e a projeção de `fetch_grouped_records_by_view`.
+
+    Sem ordenação pedida a view é lida em streaming (`iter_grouped_records`) e a
+    memória fica limitada a um registro. Com `order_by` os registros seguem essa
+    ordem, então rows do mesmo registro podem vir separadas e a consulta é agrupada
+    inteira (`fetch_grouped_records`); combine com `limit` para limitar a página.
+    Feche o iterador (`contextlib.closing`) ao abandoná-lo antes do fim.
+    """
+    where, order, params, columns = _view_query(view_name, where_clause, order_by, view_filter, projections)
+    if order:
+        yield from fetch_grouped_records(
+            limit=limit, where_clause=where, view_name=view_name, order_by=order, params=params, columns=columns
+        )
+        return
+    records = iter_grouped_records(
+        limit=limit, where_clause=where, view_name=view_name, params=params, columns=columns
+    )
+    try:
+        yield from records
+    finally:
+        records.close()
 
 
-__all__ = ["fetch_view_rows", "fetch_grouped_records", "get_connection", "resolve_where_clause"]
+def fetch_grouped_records_by_view(
+    view_names: Sequence[Optional[str]],
+    limit: Optional[int] = None,
+    where_clause: Optional[str] = None,
+    order_by: Optional[str] = None,
+    view_filters: Optional[Mapping[Optional[str], ViewFilter]] = None,
+    projections: Optional[Mapping[str, Any]] = None,
+) -> List[List[Dict[str, Any]]]:
+    """Consulta várias views em paralelo (uma conexão do pool por view).
+
+    O filtro de cada view passa por `resolve_where_clause` e é combinado (AND) com
+    o `ViewFilter` da view, quando houver; as colunas seguem `resolve_projection`
+    (com `projections` vindo do config.yaml). Retorna os registros na mesma ordem
+    de `view_names`; o tempo de cada consulta é registrado no log. Materializa
+    todos os registros: para views grandes prefira `iter_view_records`.
+    """
+
+    def _fetch(view_name: Optional[str]) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        where, order, params, columns = _view_query(
+            view_name, where_clause, order_by, (view_filters or {}).get(view_name), projections
+        )
+        records = fetch_grouped_records(
+            limit=limit,
+            where_clause=where,
+            view_name=view_name,
+            order_by=order,
+            params=params,
+            columns=columns,
+        )
+        LOGGER.info(
+            "View %s: %s registro(s) em %.2fs",
+            view_name or os.getenv("ORACLE_VIEW"),
+            len(records),
+            time.perf_counter() - started,
+        )
+        return records
+
+    targets = list(view_names)
+    if len(targets) <= 1:
+        return [_fetch(view) for view in targets]
+    workers = max(1, min(len(targets), env_int("ORACLE_FETCH_WORKERS", len(targets))))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="oracle-view") as executor:
+        return list(executor.map(_fetch, targets))
+
+
+def get_connection() -> oracledb.Connection:
+    """Conexão do pool (devolvida ao pool ao sair do `with`) ou avulsa com ORACLE_POOL_ENABLED=0."""
+    if not _pool_enabled():
+        return _build_connection()
+    return _get_pool().acquire()
+
+
+__all__ = [
+    "close_pool",
+    "config_projections",
+    "fetch_view_rows",
+    "fetch_grouped_records",
+    "fetch_grouped_records_by_view",
+    "get_connection",
+    "iter_grouped_records",
+    "iter_view_records",
+    "iter_view_rows",
+    "measure_view_fetch",
+    "pool_stats",
+    "resolve_projection",
+    "resolve_where_clause",
+    "view_columns",
+    "ViewFilter",
+]
@@ -2,7 +2,10 @@ import json
 import logging
 import os
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional, Sequence
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.core.cache import TTLCache
 
 from .oracle_source import get_connection
 
@@ -13,6 +16,11 @@ EVENTDATE_COLUMN = "EVENTDATE"
 IDADMISSION_COLUMN = "IDADMISSION"
 IDREGISTRO_COLUMN = "IDREGISTRO"
 TPREGISTRO_COLUMN = "TPREGISTRO"
+# Oracle limita listas IN a 1000 expressões
+IN_CHUNK_SIZE = 500
+
+_ID_CACHE: Optional[TTLCache] = None
+_ID_CACHE_LOCK = threading.Lock()
 
 
 def _status_schema() -> str:
@@ -190,69 +198,217 @@ def _resolve_record_identifier(entry: Dict[str, Any]) -> Optional[int]:
     return _to_int_or_none(record_id)
 
 
-def _fetch_base_identifiers(cur, schema: str, table: str, record_id: int, primary_column: str) -> Dict[str, Any]:
+def _chunked(values: Sequence[int], size: int = IN_CHUNK_SIZE) -> Iterator[Sequence[int]]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _bind_list(values: Sequence[int], prefix: str = "rid") -> Tuple[str, Dict[str, Any]]:
+    names = [f"{prefix}{idx}" for idx in range(len(values))]
+    return ", ".join(f":{name}" for name in names), dict(zip(names, values))
+
+
+def _fetch_base_identifiers(
+    cur, schema: str, table: str, record_ids: Sequence[int], primary_column: str
+) -> Dict[int, Dict[str, Any]]:
+    """Resolve, em lote, a linha mais recente da tabela de status para cada ID.
+
+    Cada coluna candidata é consultada uma vez por bloco de até IN_CHUNK_SIZE IDs
+    (ROW_NUMBER para ficar com o EVENTDATE mais recente), apenas para os IDs
+    ainda não resolvidos pelas colunas anteriores.
+    """
     candidates = [primary_column, IDREGISTRO_COLUMN, IDADMISSION_COLUMN, REFERENCE_COLUMN]
+    resolved: Dict[int, Dict[str, Any]] = {}
     seen = set()
     for column in candidates:
         if not column or column in seen:
             continue
         seen.add(column)
+        pending = [rid for rid in record_ids if rid not in resolved]
+        if not pending:
+            break
+        for chunk in _chunked(pending):
+            placeholders, params = _bind_list(chunk)
+            try:
+                cur.execute(
+                    f"""
+                    SELECT LOOKUP_ID, {REFERENCE_COLUMN}, {IDADMISSION_COLUMN}, {IDREGISTRO_COLUMN}, {TPREGISTRO_COLUMN}
+                    FROM (
+                        SELECT {column} AS LOOKUP_ID,
+                               {REFERENCE_COLUMN}, {IDADMISSION_COLUMN}, {IDREGISTRO_COLUMN}, {TPREGISTRO_COLUMN},
+                               ROW_NUMBER() OVER (PARTITION BY {column} ORDER BY {EVENTDATE_COLUMN} DESC) AS RN
+                        FROM {schema}.{table}
+                        WHERE {column} IN ({placeholders})
+                    )
+                    WHERE RN = 1
+                    """,
+                    params,
+                )
+            except Exception as exc:
+                LOGGER.debug("Falha ao consultar %s.%s via coluna %s: %s", schema, table, column, exc)
+                break
+            for row in cur.fetchall():
+                lookup = _to_int_or_none(row[0])
+                if lookup is None or lookup in resolved:
+                    continue
+                resolved[lookup] = {
+                    REFERENCE_COLUMN: _to_int_or_none(row[1]) or row[1],
+                    IDADMISSION_COLUMN: _to_int_or_none(row[2]) or row[2],
+                    IDREGISTRO_COLUMN: _to_int_or_none(row[3]) or row[3],
+                    TPREGISTRO_COLUMN: _to_int_or_none(row[4]) or row[4],
+                }
+    return resolved
+
+
+def _fetch_source_identifiers(cur, schema: str, record_ids: Sequence[int]) -> Dict[int, Dict[str, Any]]:
+    """Resolve, em lote, protocolo/atendimento/prescrição na view de origem."""
+    view_name = _deliveries_view_name()
+    wanted = {rid for rid in record_ids if rid}
+    if not (view_name and schema and wanted):
+        return {}
+
+    resolved: Dict[int, Dict[str, Any]] = {}
+    for chunk in _chunked(sorted(wanted)):
+        placeholders, params = _bind_list(chunk)
         try:
             cur.execute(
                 f"""
-                SELECT {REFERENCE_COLUMN}, {IDADMISSION_COLUMN}, {IDREGISTRO_COLUMN}, {TPREGISTRO_COLUMN}
-                FROM {schema}.{table}
-                WHERE {column} = :record_id
-                ORDER BY {EVENTDATE_COLUMN} DESC FETCH FIRST 1 ROWS ONLY
+                SELECT DISTINCT ID_PROTOCOLO, ID_ATENDIMENTO, ID_PRESCRICAO
+                FROM {schema}.{view_name}
+                WHERE ID_ATENDIMENTO IN ({placeholders})
+                   OR ID_PROTOCOLO IN ({placeholders})
+                   OR ID_PRESCRICAO IN ({placeholders})
                 """,
-                {"record_id": record_id},
+                params,
             )
         except Exception as exc:
-            LOGGER.debug("Falha ao consultar %s.%s via coluna %s: %s", schema, table, column, exc)
-            continue
-        row = cur.fetchone()
-        if row:
-            return {
+            LOGGER.debug("Falha ao consultar view de origem %s: %s", view_name, exc)
+            return resolved
+
+        for row in cur.fetchall():
+            identifiers = {
                 REFERENCE_COLUMN: _to_int_or_none(row[0]) or row[0],
                 IDADMISSION_COLUMN: _to_int_or_none(row[1]) or row[1],
                 IDREGISTRO_COLUMN: _to_int_or_none(row[2]) or row[2],
-                TPREGISTRO_COLUMN: _to_int_or_none(row[3]) or row[3],
             }
-    return {}
+            for value in (row[1], row[0], row[2]):
+                rid = _to_int_or_none(value)
+                if rid in wanted:
+                    resolved.setdefault(rid, identifiers)
+    return resolved
+
+
+def _identifier_cache() -> TTLCache:
+    """Cache de identificadores por ID de registro (`SIMPLIROUTE_ID_CACHE_SIZE`/`_TTL_SECONDS`)."""
+    global _ID_CACHE
+    with _ID_CACHE_LOCK:
+        if _ID_CACHE is None:
+            try:
+                size = int(os.getenv("SIMPLIROUTE_ID_CACHE_SIZE", "10000"))
+            except ValueError:
+                size = 10000
+            try:
+                ttl = float(os.getenv("SIMPLIROUTE_ID_CACHE_TTL_SECONDS", "86400"))
+            except ValueError:
+                ttl = 86400.0
+            _ID_CACHE = TTLCache(maxsize=size, ttl=ttl)
+        return _ID_CACHE
 
 
-def _fetch_source_identifiers(cur, schema: str, record_id: int) -> Dict[str, Any]:
-    view_name = _deliveries_view_name()
-    if not (view_name and schema and record_id):
-        return {}
-    try:
-        cur.execute(
-            f"""
-            SELECT ID_PROTOCOLO, ID_ATENDIMENTO, ID_PRESCRICAO
-            FROM {schema}.{view_name}
-            WHERE ID_ATENDIMENTO = :rid OR ID_PROTOCOLO = :rid OR ID_PRESCRICAO = :rid
-            FETCH FIRST 1 ROWS ONLY
-            """,
-            {"rid": record_id},
-        )
-    except Exception as exc:
-        LOGGER.debug("Falha ao consultar view de origem %s: %s", view_name, exc)
-        return {}
+def identifier_cache_stats() -> Dict[str, Any]:
+    return _identifier_cache().stats()
 
-    row = cur.fetchone()
-    if not row:
-        return {}
-    return {
-        REFERENCE_COLUMN: _to_int_or_none(row[0]) or row[0],
-        IDADMISSION_COLUMN: _to_int_or_none(row[1]) or row[1],
-        IDREGISTRO_COLUMN: _to_int_or_none(row[2]) or row[2],
-    }
 
-def persist_status_updates(events: Sequence[Dict[str, Any]]) -> None:
-    """Insere um registro por evento do webhook com os dados de retorno do SimpliRoute."""
+def _record_value(record: Dict[str, Any], key: str) -> Any:
+    value = record.get(key)
+    if value in (None, ""):
+        value = record.get(key.lower())
+    return value
 
+
+def remember_sent_identifiers(records: Sequence[Dict[str, Any]], payloads: Sequence[Dict[str, Any]]) -> int:
+    """Aquece o cache com os identificadores das visitas enviadas ao SimpliRoute.
+
+    A chave é a `reference` do payload, que é o ID devolvido nos webhooks da visita.
+    Registros sem `TPREGISTRO` na view não são cacheados: o webhook precisa ler o
+    valor da tabela de status.
+    """
+    cache = _identifier_cache()
+    if not cache.enabled:
+        return 0
+    warmed = 0
+    for record, payload in zip(records, payloads):
+        if not isinstance(record, dict) or not isinstance(payload, dict):
+            continue
+        record_int = _to_int_or_none(payload.get("reference"))
+        if record_int is None:
+            continue
+        identifiers = {
+            REFERENCE_COLUMN: _to_int_or_none(_record_value(record, "ID_PROTOCOLO")),
+            IDADMISSION_COLUMN: _to_int_or_none(_record_value(record, "ID_ATENDIMENTO")),
+            IDREGISTRO_COLUMN: _to_int_or_none(_record_value(record, "ID_PRESCRICAO")),
+            TPREGISTRO_COLUMN: _to_int_or_none(_record_value(record, "TPREGISTRO")),
+        }
+        if identifiers[TPREGISTRO_COLUMN] is None:
+            continue
+        cache.set(record_int, identifiers)
+        warmed += 1
+    return warmed
+
+
+def resolve_identifiers(
+    cur, schema: str, table: str, record_ids: Sequence[int], primary_column: str
+) -> Dict[int, Dict[str, Any]]:
+    """Identificadores Oracle por ID de registro, priorizando a tabela de status sobre a view.
+
+    IDs presentes no cache não são consultados. Só entram no cache (e só contam como
+    acerto) identificadores com `TPREGISTRO`: sem ele a tabela de status é a fonte do
+    valor e a consulta não pode ser pulada.
+    """
+    unique_ids = list(dict.fromkeys(rid for rid in record_ids if rid is not None))
+    if not unique_ids:
+        return {}
+    cache = _identifier_cache()
+    merged: Dict[int, Dict[str, Any]] = {
+        rid: identifiers
+        for rid, identifiers in cache.get_many(unique_ids).items()
+        if identifiers.get(TPREGISTRO_COLUMN) is not None
+    }
+    pending = [rid for rid in unique_ids if rid not in merged]
+    if not pending:
+        return merged
+
+    base = _fetch_base_identifiers(cur, schema, table, pending, primary_column)
+    source = _fetch_source_identifiers(cur, schema, pending)
+    for rid in pending:
+        base_ids = base.get(rid, {})
+        source_ids = source.get(rid, {})
+        identifiers = {
+            REFERENCE_COLUMN: base_ids.get(REFERENCE_COLUMN) or source_ids.get(REFERENCE_COLUMN),
+            IDADMISSION_COLUMN: base_ids.get(IDADMISSION_COLUMN) or source_ids.get(IDADMISSION_COLUMN),
+            IDREGISTRO_COLUMN: base_ids.get(IDREGISTRO_COLUMN) or source_ids.get(IDREGISTRO_COLUMN),
+            TPREGISTRO_COLUMN: base_ids.get(TPREGISTRO_COLUMN),
+        }
+        merged[rid] = identifiers
+        if identifiers[TPREGISTRO_COLUMN] is not None:
+            cache.set(rid, identifiers)
+    return merged
+
+
+def persist_status_updates(
+    events: Sequence[Dict[str, Any]], rejected: Optional[List[Tuple[Dict[str, Any], str]]] = None
+) -> Dict[str, int]:
+    """Insere um registro por evento do webhook com os dados de retorno do SimpliRoute.
+
+    As linhas são montadas em memória e gravadas com um único `executemany`
+    (`batcherrors=True`); os eventos recusados pelo Oracle (`getbatcherrors()`) são
+    acrescentados a `rejected` como (evento, erro). Falha no commit é propagada para
+    o chamador repetir o lote.
+    """
+
+    summary = {"inserted": 0, "failed": 0, "skipped": 0}
     if not events:
-        return
+        return summary
 
     schema = _status_schema()
     target_table = _status_target_table()
@@ -272,41 +428,34 @@ def persist_status_updates(events: Sequence[Dict[str, Any]]) -> None:
 
     with get_connection() as conn:
         cur = conn.cursor()
+        resolvable: List[Tuple[Dict[str, Any], int]] = []
         for entry in events:
             if not isinstance(entry, dict):
+                summary["skipped"] += 1
                 continue
 
             record_int = _resolve_record_identifier(entry)
             if record_int is None:
                 LOGGER.warning("Evento do webhook sem identificador numérico: %s", entry)
+                summary["skipped"] += 1
                 continue
+            resolvable.append((entry, record_int))
+
+        identifiers = resolve_identifiers(cur, schema, target_table, [rid for _, rid in resolvable], id_col)
 
+        rows: List[Dict[str, Any]] = []
+        record_ids: List[int] = []
+        row_events: List[Dict[str, Any]] = []
+        for entry, record_int in resolvable:
             sr_idreference = _extract_numeric(entry, "ID_PROTOCOLO", "IDREFERENCE", "reference")
             sr_idadmission = _extract_numeric(entry, "IDADMISSION", "ID_ATENDIMENTO")
             sr_idregistro = _extract_numeric(entry, "ID_REGISTRO", "ID_PRESCRICAO", "IDREGISTRO")
 
-            base_identifiers = _fetch_base_identifiers(cur, schema, target_table, record_int, id_col)
-            source_identifiers = _fetch_source_identifiers(cur, schema, record_int)
-
-            idreference = (
-                sr_idreference
-                or base_identifiers.get(REFERENCE_COLUMN)
-                or source_identifiers.get(REFERENCE_COLUMN)
-                or record_int
-            )
-            idadmission = (
-                sr_idadmission
-                or base_identifiers.get(IDADMISSION_COLUMN)
-                or source_identifiers.get(IDADMISSION_COLUMN)
-                or record_int
-            )
-            idregistro = (
-                sr_idregistro
-                or base_identifiers.get(IDREGISTRO_COLUMN)
-                or source_identifiers.get(IDREGISTRO_COLUMN)
-                or record_int
-            )
-            tpregistro = base_identifiers.get(TPREGISTRO_COLUMN)
+            resolved = identifiers.get(record_int, {})
+            idreference = sr_idreference or resolved.get(REFERENCE_COLUMN) or record_int
+            idadmission = sr_idadmission or resolved.get(IDADMISSION_COLUMN) or record_int
+            idregistro = sr_idregistro or resolved.get(IDREGISTRO_COLUMN) or record_int
+            tpregistro = resolved.get(TPREGISTRO_COLUMN)
             if tpregistro not in (1, 2):
                 tpregistro = _infer_tpregistro(entry, fallback=2)
 
@@ -316,9 +465,8 @@ def persist_status_updates(events: Sequence[Dict[str, Any]]) -> None:
                 status_code = _map_delivery_status(entry.get("status"), checkout_comment)
                 if status_code is None:
                     LOGGER.warning("Status SimpliRoute não mapeado para registro %s: %s", record_int, entry.get("status"))
+                    summary["skipped"] += 1
                     continue
-            else:
-                status_code = None
 
             event_dt = _resolve_event_datetime(entry)
             payload_str = _serialize_payload(entry)
@@ -334,21 +482,45 @@ def persist_status_updates(events: Sequence[Dict[str, Any]]) -> None:
             if status_col:
                 params["status_code"] = status_code
 
-            try:
-                cur.execute(insert_sql, params)
-                LOGGER.info(
-                    "SR status inserido: idreference=%s idregistro=%s status=%s event=%s",
-                    idreference,
-                    idregistro,
-                    status_code,
-                    event_dt.isoformat(timespec="milliseconds"),
-                )
-            except Exception as exc:
-                LOGGER.warning("Falha ao inserir evento %s na tabela de status: %s", record_int, exc)
+            rows.append(params)
+            record_ids.append(record_int)
+            row_events.append(entry)
+
+        if not rows:
+            return summary
+
+        cur.executemany(insert_sql, rows, batcherrors=True)
+        failed_offsets = set()
+        for error in cur.getbatcherrors():
+            failed_offsets.add(error.offset)
+            LOGGER.warning(
+                "Falha ao inserir evento %s na tabela de status: %s",
+                record_ids[error.offset],
+                error.message,
+            )
+            if rejected is not None:
+                rejected.append((row_events[error.offset], str(error.message)))
+
+        for offset, params in enumerate(rows):
+            if offset in failed_offsets:
+                continue
+            LOGGER.info(
+                "SR status inserido: idreference=%s idregistro=%s status=%s event=%s",
+                params["idreference"],
+                params["idregistro"],
+                params.get("status_code"),
+                params["eventdate"].isoformat(timespec="milliseconds"),
+            )
 
         try:
             conn.commit()
         except Exception as exc:
             LOGGER.error("Não foi possível executar commit dos status SR: %s", exc)
+            raise
+
+        summary["failed"] = len(failed_offsets)
+        summary["inserted"] = len(rows) - len(failed_offsets)
+
+    return summary
 
-__all__ = ["persist_status_updates"]
+__all__ = ["identifier_cache_stats", "persist_status_updates", "remember_sent_identifiers", "resolve_identifiers"]
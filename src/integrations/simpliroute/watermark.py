@@ -0,0 +1,346 @@
+"""High-water mark por view para o polling incremental.
+
+O estado fica em um arquivo JSON local (`SIMPLIROUTE_POLL_STATE_PATH`) com, por
+view, a coluna usada, o maior valor já enviado e o horário da última
+reconciliação completa. Entre reconciliações o polling consulta apenas rows com
+`<coluna> > :hwm`; a reconciliação (a cada `SIMPLIROUTE_POLL_FULL_SYNC_MINUTES`)
+volta a ler tudo o que o filtro de polling retorna e recupera rows que chegaram
+atrasadas (valor abaixo do high-water mark). Com limite de linhas a reconciliação
+avança página a página, a partir do cursor guardado em `sync_value`.
+
+O high-water mark só passa de um valor quando todos os registros com rows até ele
+foram resolvidos (aceitos, recusados pela validação ou já no ledger); um registro
+com falha transitória segura o avanço e volta no próximo ciclo.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+from src.core.config import env_int
+
+from .oracle_source import ViewFilter
+
+LOGGER = logging.getLogger("simpliroute.watermark")
+
+_COLUMN_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_$#]*$")
+
+
+def state_path() -> Path:
+    return Path(os.getenv("SIMPLIROUTE_POLL_STATE_PATH", "data/work/polling_state.json"))
+
+
+def full_sync_minutes() -> int:
+    return max(0, env_int("SIMPLIROUTE_POLL_FULL_SYNC_MINUTES", 360))
+
+
+def watermark_column(view_name: Optional[str], cfg: Optional[Mapping[str, Any]] = None) -> Optional[str]:
+    """Coluna de high-water mark da view (desligado quando não configurada).
+
+    Ordem: `ORACLE_WATERMARK_COLUMN_<VIEW>`, `oracle.watermark_columns.<VIEW>` do
+    config.yaml, `ORACLE_WATERMARK_COLUMN` e `oracle.watermark_column`.
+    """
+    view_upper = (view_name or "").upper()
+    oracle_cfg = ((cfg or {}).get("oracle") or {}) if isinstance(cfg, Mapping) else {}
+    per_view_cfg = oracle_cfg.get("watermark_columns") or {}
+    if not isinstance(per_view_cfg, Mapping):
+        per_view_cfg = {}
+    per_view_cfg = {str(k).upper(): v for k, v in per_view_cfg.items()}
+    candidates = (
+        os.getenv(f"ORACLE_WATERMARK_COLUMN_{view_upper}") if view_upper else None,
+        per_view_cfg.get(view_upper),
+        os.getenv("ORACLE_WATERMARK_COLUMN"),
+        oracle_cfg.get("watermark_column"),
+    )
+    for candidate in candidates:
+        if not isinstance(candidate, str) or not candidate.strip():
+            continue
+        column = candidate.strip().upper()
+        if not _COLUMN_RE.match(column):
+            LOGGER.warning("Coluna de high-water mark inválida para %s: %r", view_name, candidate)
+            return None
+        return column
+    return None
+
+
+def _encode_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, datetime):
+        return {"type": "datetime", "value": value.isoformat()}
+    if isinstance(value, date):
+        return {"type": "date", "value": value.isoformat()}
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {"type": "number", "value": value}
+    return {"type": "str", "value": str(value)}
+
+
+def _decode_value(raw: Any) -> Any:
+    if not isinstance(raw, Mapping):
+        return None
+    kind, value = raw.get("type"), raw.get("value")
+    try:
+        if kind == "datetime":
+            return datetime.fromisoformat(value)
+        if kind == "date":
+            return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+def _row_value(row: Mapping[str, Any], column: str) -> Any:
+    value = row.get(column)
+    if value is None:
+        value = row.get(column.lower())
+    return value
+
+
+@dataclass
+class WatermarkUpdate:
+    """Avanço de uma view, calculado depois do envio.
+
+    `full_sync` marca a reconciliação como concluída; `sync_value` é o cursor de
+    uma reconciliação paginada que continua no próximo ciclo.
+    """
+
+    view: str
+    column: str
+    value: Any = None
+    full_sync: bool = False
+    sync_value: Any = None
+
+
+class WatermarkStore:
+    """Estado do polling incremental em um arquivo JSON (gravação atômica)."""
+
+    def __init__(self, path: Union[str, Path, None] = None) -> None:
+        self.path = Path(path) if path is not None else state_path()
+        self._lock = threading.Lock()
+        self._state: Dict[str, Dict[str, Any]] = self._load()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exc:
+            LOGGER.warning("Estado de polling ilegível em %s (%s); começando do zero", self.path, exc)
+            return {}
+        views = data.get("views") if isinstance(data, dict) else None
+        return dict(views) if isinstance(views, dict) else {}
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({"views": self._state}, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def get(self, view: str, column: str) -> Tuple[Any, Optional[float]]:
+        """(high-water mark, epoch da última reconciliação) da view para `column`."""
+        with self._lock:
+            entry = self._state.get(view) or {}
+        if entry.get("column") != column:
+            # coluna trocada: o valor antigo não serve de referência
+            return None, None
+        return _decode_value(entry.get("value")), entry.get("full_sync_at")
+
+    def sync_value(self, view: str, column: str) -> Any:
+        """Cursor da reconciliação paginada em andamento (`None` fora dela)."""
+        with self._lock:
+            entry = self._state.get(view) or {}
+        if entry.get("column") != column:
+            return None
+        return _decode_value(entry.get("sync_value"))
+
+    def commit(self, updates: Sequence[WatermarkUpdate]) -> None:
+        if not updates:
+            return
+        now = time.time()
+        with self._lock:
+            for update in updates:
+                entry = dict(self._state.get(update.view) or {})
+                if entry.get("column") != update.column:
+                    entry = {"column": update.column}
+                if update.value is not None:
+                    entry["value"] = _encode_value(update.value)
+                if update.full_sync:
+                    entry["full_sync_at"] = now
+                    entry.pop("sync_value", None)
+                elif update.sync_value is not None:
+                    entry["sync_value"] = _encode_value(update.sync_value)
+                entry["updated_at"] = now
+                self._state[update.view] = entry
+            self._save()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                view: {
+                    "column": entry.get("column"),
+                    "value": (entry.get("value") or {}).get("value"),
+                    "full_sync_at": entry.get("full_sync_at"),
+                    "sync_value": (entry.get("sync_value") or {}).get("value"),
+                }
+                for view, entry in self._state.items()
+            }
+
+
+def plan_view_query(
+    store: WatermarkStore, view: str, column: str, now: Optional[float] = None, paged: bool = True
+) -> Tuple[ViewFilter, Any, bool]:
+    """Filtro da próxima consulta da view: (filtro, high-water mark atual, é reconciliação?).
+
+    Só a leitura paginada (`paged`, com limite de linhas) precisa ordenar pela
+    coluna; sem limite a view inteira é lida e pode vir em streaming.
+    """
+    current, full_sync_at = store.get(view, column)
+    cursor = store.sync_value(view, column)
+    interval = full_sync_minutes() * 60
+    now = time.time() if now is None else now
+    full = current is None or full_sync_at is None or interval == 0 or now - full_sync_at >= interval
+    order_by = column if paged else None
+    if cursor is not None:
+        # reconciliação paginada em andamento: continua de onde parou (nulos vêm no fim)
+        view_filter = ViewFilter(
+            condition=f"({column} > :sync OR {column} IS NULL)",
+            params={"sync": cursor},
+            order_by=order_by,
+            columns=(column,),
+        )
+        return view_filter, current, True
+    if full:
+        return ViewFilter(order_by=order_by, columns=(column,)), current, True
+    view_filter = ViewFilter(
+        condition=f"{column} > :hwm", params={"hwm": current}, order_by=order_by, columns=(column,)
+    )
+    return view_filter, current, False
+
+
+def record_values(record: Mapping[str, Any], column: str) -> List[Any]:
+    """Valores não nulos de `column` nas rows do registro (ou no próprio registro)."""
+    rows = record.get("items") or [record]
+    return [v for v in (_row_value(row, column) for row in rows) if v is not None]
+
+
+Bounds = Optional[Tuple[Any, Any]]
+
+
+def _bounds(values: Sequence[Any]) -> Bounds:
+    return (min(values), max(values)) if values else None
+
+
+def _deferred(bounds: Sequence[Bounds], seeds: Sequence[bool]) -> List[bool]:
+    """Registros que precisam voltar junto com os `seeds`.
+
+    A próxima consulta (`<coluna> > :hwm`) traria pela metade qualquer registro com
+    rows acima do menor valor de um registro adiado, então ele também é adiado; o
+    limite desce até estabilizar. Registros sem valor na coluna nunca são adiados.
+    """
+    lows = [bound[0] for bound, seed in zip(bounds, seeds) if seed and bound is not None]
+    if not lows:
+        return [False] * len(bounds)
+    threshold = min(lows)
+    while True:
+        lower = min((bound[0] for bound in bounds if bound is not None and bound[1] >= threshold), default=threshold)
+        if lower >= threshold:
+            break
+        threshold = lower
+    return [bound is not None and bound[1] >= threshold for bound in bounds]
+
+
+def trim_page(
+    records: List[Dict[str, Any]], column: str, page_full: bool
+) -> Tuple[List[Dict[str, Any]], Any]:
+    """Descarta registros que podem estar incompletos e calcula o novo high-water mark.
+
+    Com a página cheia (limite de linhas atingido) podem existir rows além do
+    limite com valor igual ao último lido; os registros que tocam esse valor
+    ficam para o próximo ciclo, junto com qualquer registro que tenha rows acima
+    do menor valor adiado. Retorna (registros emitidos, maior valor emitido).
+    """
+    bounds = [_bounds(record_values(record, column)) for record in records]
+    highs = [bound[1] for bound in bounds if bound is not None]
+    if not highs:
+        return records, None
+    top = max(highs)
+    if not page_full:
+        return records, top
+
+    deferred = _deferred(bounds, [bound is not None and bound[1] >= top for bound in bounds])
+    kept = [record for record, skip in zip(records, deferred) if not skip]
+    kept_highs = [bound[1] for bound, skip in zip(bounds, deferred) if bound is not None and not skip]
+    if not kept_highs:
+        LOGGER.warning(
+            "Página inteira com %s=%s; aumente o limite do polling para não quebrar registros",
+            column,
+            top,
+        )
+        return records, top
+    return kept, max(kept_highs)
+
+
+class PollProgress:
+    """Registros lidos de uma view no ciclo e quais deles já não precisam de reenvio.
+
+    Guarda só o (menor, maior) valor da coluna de cada registro, na ordem de
+    leitura: `track` ao ler uma fatia, `settle` com o resultado do envio dela.
+    """
+
+    def __init__(self, column: str) -> None:
+        self.column = column
+        self.page_full = False
+        # a consulta foi lida até o fim (sem isso nada avança)
+        self.complete = False
+        self._bounds: List[Bounds] = []
+        self._settled: List[bool] = []
+        self._done = 0
+
+    def track(self, records: Sequence[Mapping[str, Any]]) -> None:
+        for record in records:
+            self._bounds.append(_bounds(record_values(record, self.column)))
+            self._settled.append(False)
+
+    def settle(self, settled: Sequence[bool]) -> None:
+        """Resultado da próxima fatia enviada, na mesma ordem de `track`."""
+        end = self._done + len(settled)
+        self._settled[self._done : end] = [bool(done) for done in settled]
+        self._done = end
+
+    def high_water(self) -> Any:
+        """Maior valor até o qual todos os registros lidos foram resolvidos."""
+        deferred = _deferred(self._bounds, [not done for done in self._settled])
+        highs = [bound[1] for bound, skip in zip(self._bounds, deferred) if bound is not None and not skip]
+        return max(highs, default=None)
+
+    def update(self, view: str, current: Any, full: bool) -> Optional[WatermarkUpdate]:
+        """Avanço a gravar para a view; `None` se a leitura foi interrompida."""
+        if not self.complete:
+            return None
+        value = self.high_water()
+        # o high-water mark nunca recua (a reconciliação relê valores antigos)
+        top = current if value is None or (current is not None and value < current) else value
+        if not full:
+            return WatermarkUpdate(view=view, column=self.column, value=top)
+        done = not self.page_full and all(self._settled)
+        return WatermarkUpdate(
+            view=view, column=self.column, value=top, full_sync=done, sync_value=None if done else value
+        )
+
+
+__all__ = [
+    "PollProgress",
+    "WatermarkStore",
+    "WatermarkUpdate",
+    "full_sync_minutes",
+    "plan_view_query",
+    "record_values",
+    "state_path",
+    "trim_page",
+    "watermark_column",
+]
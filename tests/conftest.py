@@ -0,0 +1,23 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.core import batching, rate_limit  # noqa: E402
+from src.integrations.simpliroute import client  # noqa: E402
+
+
+@pytest.fixture
+def simpliroute_env(monkeypatch):
+    """Limiter/chunker novos por teste e sem espera de backoff real."""
+    for name in ("SIMPLIROUTE_DISABLE_SEND", "SIMPLIROUTE_DRY_RUN"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("SIMPLIROUTE_RATE_LIMIT_RPS", "1000")
+    monkeypatch.setenv("SIMPLIROUTE_RATE_LIMIT_BURST", "1000")
+    monkeypatch.setenv("SIMPLIROUTE_RETRY_BASE_SECONDS", "0")
+    monkeypatch.setattr(rate_limit, "_LIMITERS", {})
+    monkeypatch.setattr(batching, "_CHUNKERS", {})
+    monkeypatch.setattr(client, "_HTTP_CLIENTS", {})
+    return monkeypatch
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from src.core.batching import AdaptiveChunker, get_chunker
+from src.core.rate_limit import get_rate_limiter
+from src.integrations.simpliroute import client
+
+
+def _visits(count):
+    return [{"reference": f"r{i}", "title": "Visita"} for i in range(count)]
+
+
+def _send(monkeypatch, handler, visits):
+    monkeypatch.setattr(
+        client, "_build_http_client", lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    )
+
+    async def _run():
+        try:
+            return await client.post_simpliroute(visits)
+        finally:
+            await client.close_http_clients()
+
+    return asyncio.run(_run())
+
+
+def _created(refs):
+    return httpx.Response(201, json=[{"id": f"id-{ref}", "reference": ref} for ref in refs])
+
+
+def test_split_respects_count_and_bytes():
+    chunker = AdaptiveChunker(size=3, max_bytes=1024)
+    assert chunker.split([10] * 7) == [(0, 3), (3, 6), (6, 7)]
+    # dois itens de 600 bytes não cabem juntos em 1024; item maior que o limite vai sozinho
+    assert chunker.split([600, 600, 2000, 10]) == [(0, 1), (1, 2), (2, 3), (3, 4)]
+
+
+def test_413_bisects_until_chunks_fit(simpliroute_env):
+    simpliroute_env.setenv("SIMPLIROUTE_CHUNK_SIZE", "8")
+    sizes = []
+
+    def handler(request):
+        refs = [visit["reference"] for visit in json.loads(request.content)]
+        sizes.append(len(refs))
+        if len(refs) > 2:
+            return httpx.Response(413)
+        return _created(refs)
+
+    result = _send(simpliroute_env, handler, _visits(8))
+
+    assert result.ok and result.settled
+    # status agregado vem dos lotes finais, não do lote dividido (413)
+    assert result.status_code == 201
+    assert result.visit_ids == [f"id-r{i}" for i in range(8)]
+    assert sizes[0] == 8 and max(sizes[1:]) <= 4
+    assert any(chunk.get("bisected") and chunk["status_code"] == 413 for chunk in result.chunks)
+    assert get_chunker("simpliroute").stats()["size"] < 8
+
+
+def test_429_retry_waits_for_retry_after(simpliroute_env):
+    calls = []
+
+    def handler(request):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"Retry-After": "0.2"})
+        return _created([visit["reference"] for visit in json.loads(request.content)])
+
+    result = _send(simpliroute_env, handler, _visits(3))
+
+    assert result.ok
+    assert [outcome.attempts for outcome in result.outcomes] == [2, 2, 2]
+    assert calls[1] - calls[0] >= 0.18
+    assert get_rate_limiter("simpliroute").stats()["throttled"] == 1
+
+
+def test_5xx_exhausts_retries_and_reports_failure(simpliroute_env):
+    simpliroute_env.setenv("SIMPLIROUTE_RETRY_ATTEMPTS", "3")
+    calls = []
+
+    def handler(request):
+        calls.append(1)
+        return httpx.Response(503)
+
+    result = _send(simpliroute_env, handler, _visits(2))
+
+    assert len(calls) == 3
+    assert not result.ok and not result.settled
+    assert result.status_code == 503
+    assert all(outcome.attempts == 3 for outcome in result.outcomes)
+
+
+def test_mixed_batch_bisects_to_invalid_visits(simpliroute_env):
+    bad = {"r2", "r5"}
+
+    def handler(request):
+        refs = [visit["reference"] for visit in json.loads(request.content)]
+        invalid = sorted(bad.intersection(refs))
+        if invalid:
+            return httpx.Response(400, json={"reference": invalid, "error": "invalid"})
+        return _created(refs)
+
+    result = _send(simpliroute_env, handler, _visits(8))
+
+    assert result.accepted == [ref not in bad for ref in (f"r{i}" for i in range(8))]
+    assert [outcome.reference for outcome in result.failures] == ["r2", "r5"]
+    assert all(outcome.status_code == 400 and outcome.rejected for outcome in result.failures)
+    assert result.status_code == 400
+    assert not result.ok and result.settled
+    assert result.visit_ids[0] == "id-r0" and result.visit_ids[2] is None
+    assert [visit["reference"] for visit in result.json()] == ["r0", "r1", "r3", "r4", "r6", "r7"]
@@ -0,0 +1,93 @@
+import pytest
+
+import simpliroute_send
+from simpliroute_send import NullKeyCursor, fetch_page
+
+
+def _row(dt, presc, prot, n=0):
+    return {"DT_ENTREGA": dt, "ID_PRESCRICAO": presc, "ID_PROTOCOLO": prot, "N": n}
+
+
+class FakeView:
+    """Simula a view com a mesma ordem e o mesmo seek de fetch_records_keyset."""
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.calls = []
+
+    def _keyed(self):
+        rows = [r for r in self.rows if r["ID_PRESCRICAO"] is not None and r["ID_PROTOCOLO"] is not None]
+        return sorted(rows, key=simpliroute_send._record_key, reverse=True)
+
+    def keyset(self, limit, after=None, equal_to=None):
+        self.calls.append(("keyset", after, equal_to))
+        rows = self._keyed()
+        if equal_to is not None:
+            return [r for r in rows if simpliroute_send._record_key(r) == equal_to]
+        if after is not None:
+            rows = [r for r in rows if simpliroute_send._record_key(r) < after]
+        return rows[:limit]
+
+    def offset(self, limit, offset=0, null_keys_only=False):
+        self.calls.append(("offset", offset, null_keys_only))
+        rows = [r for r in self.rows if r["ID_PRESCRICAO"] is None or r["ID_PROTOCOLO"] is None]
+        return rows[offset : offset + limit]
+
+
+@pytest.fixture
+def view(monkeypatch):
+    fake = FakeView([])
+    monkeypatch.setattr(simpliroute_send, "SEND_PAGINATION_MODE", "keyset")
+    monkeypatch.setattr(simpliroute_send, "fetch_records_keyset", fake.keyset)
+    monkeypatch.setattr(simpliroute_send, "fetch_records", fake.offset)
+    return fake
+
+
+def _drain(limit):
+    seen, cursor = [], None
+    while True:
+        records, cursor, has_more = fetch_page(limit, cursor)
+        seen.extend(records)
+        if not (records and has_more):
+            return seen
+
+
+def test_keyset_pages_cover_every_row_once(view):
+    view.rows = [_row("2026-10-17", presc, prot) for presc in range(1, 5) for prot in range(1, 4)]
+    seen = _drain(5)
+    assert sorted(map(simpliroute_send._record_key, seen)) == sorted(map(simpliroute_send._record_key, view.rows))
+
+
+def test_tie_group_on_page_boundary_moves_to_next_page(view):
+    view.rows = [_row("2026-10-17", 3, 1), _row("2026-10-17", 2, 1, 0), _row("2026-10-17", 2, 1, 1), _row("2026-10-17", 1, 1)]
+    records, cursor, has_more = fetch_page(2, None)
+    assert [r["ID_PRESCRICAO"] for r in records] == [3] and has_more and cursor == ("2026-10-17", 3, 1)
+    records, cursor, has_more = fetch_page(2, cursor)
+    assert sorted(r["N"] for r in records) == [0, 1] and cursor == ("2026-10-17", 2, 1)
+
+
+def test_page_made_of_one_key_fetches_the_whole_group(view):
+    view.rows = [_row("2026-10-17", 2, 1, n) for n in range(3)] + [_row("2026-10-17", 1, 1)]
+    records, cursor, has_more = fetch_page(2, None)
+    assert len(records) == 3 and has_more and cursor == ("2026-10-17", 2, 1)
+    assert _drain(2)[-1]["ID_PRESCRICAO"] == 1
+
+
+def test_group_marked_before_refetch_keeps_paginating(view, monkeypatch):
+    view.rows = [_row("2026-10-17", 2, 1, n) for n in range(2)] + [_row("2026-10-17", 1, 1)]
+    keyset = view.keyset
+
+    def refetch_empty(limit, after=None, equal_to=None):
+        return [] if equal_to is not None else keyset(limit, after, equal_to)
+
+    monkeypatch.setattr(simpliroute_send, "fetch_records_keyset", refetch_empty)
+    records, cursor, has_more = fetch_page(2, None)
+    assert [r["ID_PRESCRICAO"] for r in records] == [1] and cursor is not None
+
+
+def test_rows_without_key_are_swept_after_the_keyset_pass(view):
+    view.rows = [_row("2026-10-17", 1, 1), _row("2026-10-17", None, 5, 1), _row("2026-10-17", 7, None, 2)]
+    records, cursor, has_more = fetch_page(2, None)
+    assert [r["N"] for r in records] == [0, 1] and cursor == NullKeyCursor(1) and has_more
+    records, cursor, has_more = fetch_page(2, cursor)
+    assert [r["N"] for r in records] == [2] and not has_more
@@ -0,0 +1,53 @@
+import pytest
+
+import simpliroute_send
+from src.adapters.send_ledger import SendLedger, open_send_ledger
+
+
+def _visit(reference, planned_date="2026-10-17"):
+    return {"reference": reference, "planned_date": planned_date}
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = SendLedger(tmp_path / "ledger.sqlite3")
+    yield ledger
+    ledger.close()
+
+
+def test_record_and_lookup_by_reference_and_date(ledger):
+    assert ledger.record([_visit("A"), _visit("B"), _visit(None)], ["v1", None, "v3"]) == 2
+    visits = [_visit("A"), _visit("A", "2026-10-18"), _visit("B"), _visit("")]
+    assert ledger.sent_mask(visits) == [True, False, True, False]
+    assert ledger.lookup(visits) == [(True, "v1"), (False, None), (True, None), (False, None)]
+
+
+def test_record_replaces_visit_id_and_forget_allows_resend(ledger):
+    ledger.record([_visit("A")], ["v1"])
+    ledger.record([_visit("A")], ["v2"])
+    assert len(ledger) == 1 and ledger.lookup([_visit("A")]) == [(True, "v2")]
+    assert ledger.forget(["A"]) == 1
+    assert ledger.sent_mask([_visit("A")]) == [False]
+
+
+def test_lookup_spans_more_references_than_one_query(ledger):
+    visits = [_visit(f"R{n}") for n in range(1200)]
+    ledger.record(visits[::2])
+    assert ledger.sent_mask(visits) == [n % 2 == 0 for n in range(1200)]
+
+
+def test_open_send_ledger_can_be_disabled(monkeypatch, tmp_path):
+    monkeypatch.setenv("SIMPLIROUTE_SEND_LEDGER", "0")
+    assert open_send_ledger(tmp_path / "ledger.sqlite3") is None
+
+
+def test_skip_already_sent_repairs_update_from_ledger(ledger, monkeypatch):
+    monkeypatch.setattr(simpliroute_send, "SEND_LEDGER", ledger)
+    ledger.record([_visit("A"), _visit("B")], ["v1", None])
+    entries = [
+        {"payload": _visit(reference), "reference": reference, "record": {"ID_PRESCRICAO": n, "ID_PROTOCOLO": 10 + n}}
+        for n, reference in enumerate(("A", "B", "C"), start=1)
+    ]
+    pending, repairs = simpliroute_send.skip_already_sent(entries)
+    assert [entry["reference"] for entry in pending] == ["C"]
+    assert repairs == [(1, 11, "v1")]
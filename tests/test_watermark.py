@@ -0,0 +1,91 @@
+from src.integrations.simpliroute.watermark import PollProgress, WatermarkStore, plan_view_query, trim_page
+
+
+def _record(key, *values):
+    return {"ID_ATENDIMENTO": key, "items": [{"ID_ATENDIMENTO": key, "DT": value} for value in values]}
+
+
+def _keys(records):
+    return [record["ID_ATENDIMENTO"] for record in records]
+
+
+def test_trim_page_keeps_everything_when_page_not_full():
+    records = [_record(1, 10), _record(2, 20, 30)]
+    kept, top = trim_page(records, "DT", page_full=False)
+    assert _keys(kept) == [1, 2] and top == 30
+
+
+def test_trim_page_defers_tie_group_at_boundary():
+    # página cheia terminando em 40: pode haver mais rows com 40 além do limite
+    records = [_record(1, 10), _record(2, 20), _record(3, 40), _record(4, 40)]
+    kept, top = trim_page(records, "DT", page_full=True)
+    assert _keys(kept) == [1, 2] and top == 20
+
+
+def test_trim_page_defers_records_straddling_the_boundary_value():
+    # o registro 2 tem uma row acima do menor valor adiado (30 < 35 do registro 3)
+    records = [_record(1, 10), _record(2, 20, 35), _record(3, 30, 40)]
+    kept, top = trim_page(records, "DT", page_full=True)
+    assert _keys(kept) == [1] and top == 10
+
+
+def test_trim_page_with_single_value_keeps_page():
+    records = [_record(1, 40), _record(2, 40)]
+    kept, top = trim_page(records, "DT", page_full=True)
+    assert _keys(kept) == [1, 2] and top == 40
+
+
+def _progress(records, settled, complete=True, page_full=False):
+    progress = PollProgress("DT")
+    progress.track(records)
+    progress.settle(settled)
+    progress.complete = complete
+    progress.page_full = page_full
+    return progress
+
+
+def test_high_water_stops_before_first_unsettled_record():
+    records = [_record(1, 10), _record(2, 20), _record(3, 30), _record(4, 40)]
+    progress = _progress(records, [True, True, False, True])
+    assert progress.high_water() == 20
+    update = progress.update("V", current=5, full=False)
+    assert update.value == 20 and not update.full_sync
+
+
+def test_high_water_defers_settled_record_overlapping_a_failure():
+    # registro 2 (15..25) seria relido pela metade a partir de 20; também volta
+    records = [_record(1, 10), _record(2, 15, 25), _record(3, 20)]
+    progress = _progress(records, [True, True, False])
+    assert progress.high_water() == 10
+
+
+def test_update_never_moves_back_and_waits_for_complete_read():
+    records = [_record(1, 10)]
+    assert _progress(records, [False]).update("V", current=50, full=False).value == 50
+    assert _progress(records, [True], complete=False).update("V", current=5, full=False) is None
+
+
+def test_full_sync_page_keeps_cursor_until_last_page():
+    records = [_record(1, 10), _record(2, 20)]
+    update = _progress(records, [True, True], page_full=True).update("V", current=None, full=True)
+    assert not update.full_sync and update.sync_value == 20 and update.value == 20
+    update = _progress(records, [True, True]).update("V", current=20, full=True)
+    assert update.full_sync and update.sync_value is None
+    update = _progress(records, [True, False]).update("V", current=20, full=True)
+    assert not update.full_sync and update.sync_value == 10
+
+
+def test_store_resumes_paged_full_sync_from_cursor(tmp_path, monkeypatch):
+    monkeypatch.setenv("SIMPLIROUTE_POLL_FULL_SYNC_MINUTES", "60")
+    store = WatermarkStore(tmp_path / "state.json")
+    records = [_record(1, 10), _record(2, 20)]
+    store.commit([_progress(records, [True, True], page_full=True).update("V", current=None, full=True)])
+
+    view_filter, current, full = plan_view_query(WatermarkStore(tmp_path / "state.json"), "V", "DT")
+    assert full and current == 20
+    assert view_filter.params == {"sync": 20} and "DT IS NULL" in view_filter.condition
+
+    store.commit([_progress([_record(3, 30)], [True]).update("V", current=20, full=True)])
+    view_filter, current, full = plan_view_query(store, "V", "DT")
+    assert not full and current == 30 and view_filter.params == {"hwm": 30}
+    assert store.snapshot()["V"]["sync_value"] is None
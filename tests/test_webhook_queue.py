@@ -0,0 +1,72 @@
+import importlib
+
+import pytest
+
+from src.adapters.queue_sqlite import SQLiteQueue
+
+# o pacote reexporta a instância FastAPI como `app`; o módulo vem de importlib
+service = importlib.import_module("src.integrations.simpliroute.app")
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SQLiteQueue(tmp_path / "queue.sqlite3")
+    yield queue
+    queue.close()
+
+
+def test_claim_counts_attempts_until_ack(queue):
+    queue.enqueue_many([{"n": 1}, {"n": 2}])
+    assert queue.claim(10) == [(1, 1, {"n": 1}), (2, 1, {"n": 2})]
+    assert [attempts for _, attempts, _ in queue.claim(1)] == [2]
+    queue.ack([1])
+    assert queue.claim(10) == [(2, 2, {"n": 2})]
+    assert len(queue) == 1
+
+
+def test_bury_moves_items_to_dead_letter(queue):
+    queue.enqueue_many([{"n": 1}, {"n": 2}])
+    assert queue.bury([(1, {"n": 1}, "erro")]) == 1
+    assert len(queue) == 1 and queue.dead_letter_count() == 1
+    assert queue.claim(10) == [(2, 1, {"n": 2})]
+
+
+@pytest.fixture
+def drain(monkeypatch, tmp_path):
+    archived, persisted = [], []
+
+    def persist(events, rejected):
+        if any(event.get("poison") for event in events):
+            raise RuntimeError("ORA-01722")
+        persisted.extend(event["reference"] for event in events)
+        return {"inserted": len(events), "failed": 0, "skipped": 0}
+
+    monkeypatch.setattr(service, "persist_status_updates", persist)
+    monkeypatch.setattr(service, "_archive_webhook", lambda queue_id, item: archived.append(queue_id))
+    monkeypatch.setattr(service, "_append_service_log", lambda entry: None)
+    return archived, persisted
+
+
+def _webhook(reference, poison=False):
+    return {"payload": {"reference": reference, "poison": poison}}
+
+
+def test_failed_batch_is_retried_one_by_one(queue, drain):
+    archived, persisted = drain
+    queue.enqueue_many([_webhook("a"), _webhook("b", poison=True), _webhook("c")])
+    assert service._drain_webhook_batch(queue, 10, max_attempts=3) == 2
+    assert persisted == ["a", "c"] and len(queue) == 1
+    assert archived == [1, 2, 3]
+
+
+def test_poison_item_goes_to_dead_letter_after_max_attempts(queue, drain):
+    archived, persisted = drain
+    queue.enqueue_many([_webhook("b", poison=True)])
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            service._drain_webhook_batch(queue, 10, max_attempts=2)
+    queue.enqueue(_webhook("c"))
+    assert service._drain_webhook_batch(queue, 10, max_attempts=2) == 2
+    assert persisted == ["c"] and len(queue) == 0 and queue.dead_letter_count() == 1
+    # o payload bruto é arquivado uma vez por item, não a cada tentativa
+    assert archived == [1, 2]